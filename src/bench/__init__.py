@@ -0,0 +1,12 @@
+"""
+Benchmarks
+
+Run from the `src` directory:
+
+- `python -m bench.load --engine reactor --json results.json`: scenarios against a real server on loopback
+- `python -m bench.micro --baseline results.json`: microbenchmarks of the request path
+- `python -m bench.keep_alive --engine reactor`: close, keep-alive and pipelined connections compared
+- `python -m bench.headers`: the `HTTPHeaders` container alone
+
+`--json` saves results with the commit they ran on and `--baseline` compares a run with saved results.
+"""
@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+import socket
+import ssl
+import typing
+
+CRLF: typing.Final[bytes] = b"\r\n"
+HEAD_END: typing.Final[bytes] = CRLF * 2
+
+class BenchClient:
+    """
+    Minimal HTTP/1.1 client over a raw socket, it only knows `Content-Length` framed responses.
+
+    Connects lazily and reconnects whenever the server closed the connection, over TLS if it has an `ssl_context`,
+    resuming the previous TLS session unless `resume` is false.
+    """
+    addr: tuple[str, int]
+    ssl_context: ssl.SSLContext | None
+    resume: bool
+    session: ssl.SSLSession | None
+    sock: socket.socket | None
+    buffer: bytearray
+    connections: int
+    headers: dict[str, str]
+    """Headers of the last response, with lower case names"""
+
+    def __init__(self: typing.Self, addr: tuple[str, int], ssl_context: ssl.SSLContext | None = None, resume: bool = True) -> None:
+        self.addr = addr
+        self.ssl_context = ssl_context
+        self.resume = resume
+        self.session = None
+        self.sock = None
+        self.buffer = bytearray()
+        self.connections = 0
+        self.headers = {}
+
+    def connect(self: typing.Self) -> socket.socket:
+        if self.sock is None:
+            self.sock = socket.create_connection(self.addr)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if self.ssl_context is not None:
+                self.sock = self.ssl_context.wrap_socket(self.sock, server_hostname=self.addr[0], session=self.session)
+            self.buffer.clear()
+            self.connections += 1
+
+        return self.sock
+
+    def close(self: typing.Self) -> None:
+        if self.sock is not None:
+            # TLS 1.3 tickets arrive after the handshake, so the session is only complete once responses were read
+            if self.resume and isinstance(self.sock, ssl.SSLSocket):
+                self.session = self.sock.session
+            self.sock.close()
+            self.sock = None
+
+    @staticmethod
+    def encode_request(target: str, host: str, close: bool = False, extra_headers: str = "") -> bytes:
+        connection = "Connection: close\r\n" if close else ""
+        return f"GET {target} HTTP/1.1\r\nHost: {host}\r\n{connection}{extra_headers}\r\n".encode()
+
+    def send(self: typing.Self, data: bytes) -> None:
+        self.connect().sendall(data)
+
+    def recv_response(self: typing.Self) -> tuple[int, bytes, bool]:
+        """Reads one response, returns its status code, body and whether the server keeps the connection open"""
+        sock = self.connect()
+
+        while (head_end:=self.buffer.find(HEAD_END)) == -1:
+            self.fill(sock)
+
+        head = bytes(self.buffer[:head_end]).decode("latin-1")
+        del self.buffer[:head_end + len(HEAD_END)]
+
+        status_line, *header_lines = head.split("\r\n")
+        self.headers = headers = {name.strip().lower(): value.strip() for name, _, value in (line.partition(":") for line in header_lines)}
+
+        length = int(headers.get("content-length", 0))
+        while len(self.buffer) < length:
+            self.fill(sock)
+
+        body = bytes(self.buffer[:length])
+        del self.buffer[:length]
+
+        keep_alive = headers.get("connection", "").lower() != "close"
+        if not keep_alive:
+            self.close()
+
+        return int(status_line.split()[1]), body, keep_alive
+
+    def fill(self: typing.Self, sock: socket.socket) -> None:
+        if len(data:=sock.recv(64 * 1024)) == 0:
+            self.close()
+            raise ConnectionError("Connection closed in the middle of a response")
+
+        self.buffer += data
+
+    def get(self: typing.Self, target: str, close: bool = False, extra_headers: str = "") -> tuple[int, bytes]:
+        self.send(self.encode_request(target, self.addr[0], close, extra_headers))
+        status, body, _ = self.recv_response()
+
+        return status, body
+
+    def pipeline(self: typing.Self, targets: typing.Sequence[str]) -> list[tuple[int, bytes]]:
+        """Sends every request at once and then reads the responses, which come back in request order"""
+        self.send(b"".join(self.encode_request(target, self.addr[0]) for target in targets))
+        responses: list[tuple[int, bytes]] = []
+
+        for _ in targets:
+            status, body, keep_alive = self.recv_response()
+            responses.append((status, body))
+
+            # Requests after the last one the server answered before closing are lost
+            if not keep_alive:
+                break
+
+        return responses
@@ -0,0 +1,88 @@
+"""
+HTTPHeaders microbenchmark
+
+Times the header work of a typical request: building the request headers out of the parsed
+lines of a browser request, the lookups the server and the handler do, and building and
+serializing the response headers.
+"""
+from __future__ import annotations
+
+import argparse
+import timeit
+import typing
+
+from http_headers import HTTPHeaders
+
+REQUEST_HEADERS: typing.Final[tuple[tuple[str, str], ...]] = (
+    ("Host", "localhost:8080"),
+    ("user-agent", "Mozilla/5.0 (X11; Linux x86_64; rv:131.0) Gecko/20100101 Firefox/131.0"),
+    ("Accept", "text/css,*/*;q=0.1"),
+    ("Accept-Language", "en-US,en;q=0.5"),
+    ("accept-encoding", "gzip, deflate, br, zstd"),
+    ("Connection", "keep-alive"),
+    ("Referer", "http://localhost:8080/"),
+    ("Sec-Fetch-Dest", "style"),
+    ("Sec-Fetch-Mode", "no-cors"),
+    ("Sec-Fetch-Site", "same-origin"),
+    ("If-Modified-Since", "Wed, 12 Feb 2025 10:19:16 GMT"),
+    ("If-None-Match", '"18236ea9a57b6800-250"'),
+)
+
+LOOKUPS: typing.Final[tuple[str, ...]] = (
+    "Content-Length", "Transfer-Encoding", "Connection", "Accept-Encoding", "If-None-Match",
+    "If-Modified-Since", "Range", "If-Range", "Expect", "content-length",
+)
+
+RESPONSE_HEADERS: typing.Final[tuple[tuple[str, str], ...]] = (
+    ("Content-Type", "text/css"),
+    ("Last-Modified", "Wed, 12 Feb 2025 10:19:16 GMT"),
+    ("Vary", "Accept-Encoding"),
+    ("Accept-Ranges", "bytes"),
+    ("ETag", '"18236ea9a57b6800-250"'),
+    ("Cache-Control", "no-cache"),
+    ("Content-Length", "592"),
+    ("Date", "Sun, 18 Oct 2026 13:36:02 GMT"),
+    ("Connection", "keep-alive"),
+    ("Keep-Alive", "timeout=5, max=99"),
+)
+
+def request_headers() -> HTTPHeaders:
+    headers = HTTPHeaders()
+
+    for header_name, header_value in REQUEST_HEADERS:
+        headers[header_name] = header_value
+
+    for header_name in LOOKUPS:
+        headers[header_name]
+
+    return headers
+
+def response_headers() -> bytes:
+    headers = HTTPHeaders()
+
+    for header_name, header_value in RESPONSE_HEADERS:
+        headers[header_name] = header_value
+
+    return b"".join(f"{header_name}: {header_value}\r\n".encode() for header_name, header_value in headers.items())
+
+CASES: typing.Final[dict[str, typing.Callable[[], object]]] = {
+    "construct": HTTPHeaders,
+    "request": request_headers,
+    "response": response_headers,
+}
+
+def run(number: int, repeat: int) -> dict[str, float]:
+    """Best time of each case in nanoseconds per call"""
+    return {name: min(timeit.repeat(case, number=number, repeat=repeat)) / number * 1e9 for name, case in CASES.items()}
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="bench.headers", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--number", type=int, default=20_000, help="calls per timing")
+    parser.add_argument("--repeat", type=int, default=5, help="timings per case, the best one is kept")
+    args = parser.parse_args(argv)
+
+    for name, ns in run(args.number, args.repeat).items():
+        print(f"{name:<12}{ns / 1000:>10.2f} us")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Page load benchmark for persistent connections
+
+Loads a page and its assets (about 10 requests) over and over from several client processes, with
+a new connection per request, with one persistent connection per client, and with the assets of a
+page pipelined on a persistent connection, then prints the requests per second of each mode.
+"""
+from __future__ import annotations
+
+import argparse
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import time
+import typing
+
+from bench.client import BenchClient
+
+PAGE_ASSETS: typing.Final[tuple[str, ...]] = (
+    "/index.html",
+    "/css/base.css",
+    "/css/index.css",
+    "/syntax_higlight/prism.css",
+    "/syntax_higlight/prism.js",
+    "/favicon.ico",
+    "/oneko/index.html",
+    "/oneko/oneko.js",
+    "/oneko/oneko.gif",
+    "/not_found.html",
+)
+
+MODES: typing.Final[tuple[str, ...]] = ("close", "keep-alive", "pipeline")
+
+SRC_DIR: typing.Final[str] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLES_DIR: typing.Final[str] = os.path.join(os.path.dirname(SRC_DIR), "examples")
+
+def load_page(client: BenchClient, mode: str) -> int:
+    """Loads every asset of the page once, returns the number of requests answered"""
+    match mode:
+        case "close":
+            for target in PAGE_ASSETS:
+                client.get(target, close=True)
+        case "keep-alive":
+            for target in PAGE_ASSETS:
+                client.get(target)
+        case "pipeline":
+            remaining = PAGE_ASSETS
+            # The server may close after `keep_alive_max` requests, the unanswered ones are sent again
+            while len(remaining) != 0:
+                remaining = remaining[len(client.pipeline(remaining)):]
+
+    return len(PAGE_ASSETS)
+
+def run_client(addr: tuple[str, int], mode: str, duration: float, results: multiprocessing.Queue) -> None:
+    client = BenchClient(addr)
+    requests = 0
+
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        requests += load_page(client, mode)
+
+    client.close()
+    results.put((requests, client.connections))
+
+def run_mode(addr: tuple[str, int], mode: str, clients: int, duration: float) -> dict[str, float]:
+    results: multiprocessing.Queue = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=run_client, args=(addr, mode, duration, results)) for _ in range(clients)]
+
+    started_at = time.perf_counter()
+    for process in processes:
+        process.start()
+
+    totals = [results.get() for _ in processes]
+    elapsed = time.perf_counter() - started_at
+
+    for process in processes:
+        process.join()
+
+    requests = sum(requests for requests, _ in totals)
+    connections = sum(connections for _, connections in totals)
+
+    return {"requests": requests, "connections": connections, "req_per_sec": requests / elapsed}
+
+def wait_for_server(addr: tuple[str, int], timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+
+    while True:
+        try:
+            socket.create_connection(addr, timeout=1.0).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+
+            time.sleep(0.1)
+
+def start_server(args: argparse.Namespace) -> subprocess.Popen:
+    # The second port is the HTTPS one, which the server doesn't start
+    command = [
+        sys.executable, os.path.join(SRC_DIR, "http_server.py"), str(args.port), str(args.port + 1),
+        "--addr", args.addr, "--engine", args.engine, "--keep-alive-max", str(args.keep_alive_max),
+    ]
+
+    return subprocess.Popen(command, cwd=EXAMPLES_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="bench.keep_alive", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--addr", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--engine", choices=("thread", "reactor", "asyncio"), default="reactor")
+    parser.add_argument("--external", action="store_true", help="benchmark an already running server instead of starting one")
+    parser.add_argument("--clients", type=int, default=4, help="number of client processes")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds each mode runs")
+    parser.add_argument("--keep-alive-max", type=int, default=1000)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    args = parser.parse_args(argv)
+
+    addr = (args.addr, args.port)
+    server = None if args.external else start_server(args)
+
+    try:
+        wait_for_server(addr)
+
+        print(f"{'mode':<12}{'requests':>10}{'connections':>13}{'req/s':>12}{'speedup':>10}")
+        baseline: float | None = None
+        for mode in args.modes:
+            result = run_mode(addr, mode, args.clients, args.duration)
+            baseline = baseline or result["req_per_sec"]
+
+            print(f"{mode:<12}{result['requests']:>10}{result['connections']:>13}{result['req_per_sec']:>12.0f}{result['req_per_sec'] / baseline:>9.2f}x")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+"""
+Load generator
+
+Starts a server engine (plain or TLS) on loopback in a document root of generated files and drives it
+scenario by scenario from several client processes over raw sockets, with a new connection per request,
+persistent connections or pipelining. Reports requests per second, latency percentiles, the server's
+CPU time per request and its peak RSS, optionally saved as JSON and compared with a previous run.
+"""
+from __future__ import annotations
+
+import argparse
+import array
+import dataclasses
+import multiprocessing
+import os
+import random
+import socket
+import ssl
+import subprocess
+import sys
+import tempfile
+import time
+import typing
+
+from bench.client import BenchClient
+from bench.report import change, load, save
+
+SRC_DIR: typing.Final[str] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES: typing.Final[tuple[str, ...]] = ("close", "keep-alive", "pipeline")
+
+@dataclasses.dataclass(frozen=True)
+class Scenario:
+    name: str
+    description: str
+    target: str
+    headers: str = ""
+    """Extra header lines, `{etag}` is replaced by the ETag of the target"""
+    statuses: tuple[int, ...] = (200,)
+    """Statuses of successful responses"""
+    idle_connections: bool = False
+    """Whether `--idle-connections` connections are held open without requests during the scenario"""
+
+SCENARIOS: typing.Final[dict[str, Scenario]] = {scenario.name: scenario for scenario in (
+    Scenario("small", "512 B stylesheet", "/small.css"),
+    Scenario("large", "16 MiB binary file, sent with sendfile", "/large.bin"),
+    Scenario("gzip", "64 KiB page compressed with gzip", "/page.html", "Accept-Encoding: gzip\r\n"),
+    Scenario("identity", "64 KiB page without content coding", "/page.html"),
+    Scenario("not-modified", "revalidation of the stylesheet answered with 304", "/small.css", "If-None-Match: {etag}\r\n", (304,)),
+    Scenario("idle", "512 B stylesheet while many connections sit idle", "/small.css", idle_connections=True),
+)}
+
+LARGE_FILE_SIZE: typing.Final[int] = 16 * 1024 * 1024
+
+def make_document_root(directory: str) -> None:
+    """Writes the files the scenarios request"""
+    rng = random.Random(0)
+
+    with open(os.path.join(directory, "small.css"), "w") as file:
+        file.write(("body { margin: 0; padding: 0; color: #222; }\n" * 12)[:512])
+
+    words = ("server", "request", "response", "header", "socket", "engine", "buffer", "client", "persistent", "chunk")
+    with open(os.path.join(directory, "page.html"), "w") as file:
+        text = " ".join(rng.choice(words) for _ in range(16 * 1024))
+        file.write(f"<!DOCTYPE html>\n<html><body><p>{text}</p></body></html>\n"[:64 * 1024])
+
+    with open(os.path.join(directory, "large.bin"), "wb") as file:
+        file.write(rng.randbytes(LARGE_FILE_SIZE))
+
+def make_certificate(directory: str) -> tuple[str, str]:
+    """Self-signed certificate and key for the TLS server, made with the `openssl` command"""
+    certfile, keyfile = os.path.join(directory, "bench.crt"), os.path.join(directory, "bench.key")
+
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=localhost", "-keyout", keyfile, "-out", certfile],
+        check=True, capture_output=True,
+    )
+
+    return certfile, keyfile
+
+def serve(engine: str, tls: bool, addr: tuple[str, int], document_root: str, certificate: tuple[str, str] | None, options: dict[str, typing.Any]) -> None:
+    """Server process, serves `document_root` until terminated"""
+    import http_server
+
+    os.chdir(document_root)
+    sys.stdout = open(os.devnull, "w")
+
+    server_cls = http_server.get_engine(engine)[1 if tls else 0]
+    server = server_cls(addr=addr, **options)
+    if certificate is not None:
+        server.set_cert(*certificate)
+
+    server.serv()
+
+def process_cpu_time(pid: int) -> float | None:
+    """User and system CPU seconds of a process and all its threads, read from `/proc`"""
+    try:
+        with open(f"/proc/{pid}/stat") as file:
+            # The command name may contain spaces, the fields after it don't
+            fields = file.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+def process_peak_rss(pid: int) -> int | None:
+    """Peak resident set size of a process in bytes, read from `/proc`"""
+    try:
+        with open(f"/proc/{pid}/status") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    return None
+
+def client_context() -> ssl.SSLContext:
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+
+    return context
+
+def run_client(addr: tuple[str, int], tls: bool, resume: bool, target: str, headers: str, statuses: tuple[int, ...], mode: str, depth: int, duration: float, results: multiprocessing.Queue) -> None:
+    """Client process, sends requests for `duration` seconds and reports their latencies"""
+    client = BenchClient(addr, client_context() if tls else None, resume)
+    latencies = array.array("d")
+    errors = 0
+
+    close = mode == "close"
+    request = client.encode_request(target, addr[0], close, headers)
+    batch = request * (depth if mode == "pipeline" else 1)
+    count = depth if mode == "pipeline" else 1
+
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        try:
+            sent_at = time.perf_counter()
+            client.send(batch)
+
+            for _ in range(count):
+                status, _, keep_alive = client.recv_response()
+                latencies.append(time.perf_counter() - sent_at)
+
+                if status not in statuses:
+                    errors += 1
+                # The server closed after `keep_alive_max` requests, the rest of the batch is lost
+                if not keep_alive:
+                    break
+        except OSError:
+            errors += 1
+            client.close()
+
+    client.close()
+    results.put((latencies.tobytes(), errors, client.connections))
+
+def open_idle_connections(addr: tuple[str, int], tls: bool, count: int) -> list[socket.socket]:
+    context = client_context() if tls else None
+    connections = []
+
+    for _ in range(count):
+        sock = socket.create_connection(addr)
+        connections.append(context.wrap_socket(sock, server_hostname=addr[0]) if context is not None else sock)
+
+    return connections
+
+def percentile(ordered: typing.Sequence[float], fraction: float) -> float | None:
+    if len(ordered) == 0:
+        return None
+
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def run_scenario(args: argparse.Namespace, scenario: Scenario, server_pid: int, addr: tuple[str, int]) -> dict[str, typing.Any]:
+    headers = scenario.headers
+    if "{etag}" in headers:
+        client = BenchClient(addr, client_context() if args.tls else None)
+        client.get(scenario.target)
+        headers = headers.replace("{etag}", client.headers["etag"])
+        client.close()
+
+    idle = open_idle_connections(addr, args.tls, args.idle_connections) if scenario.idle_connections else []
+
+    results: multiprocessing.Queue = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=run_client, args=(addr, args.tls, args.resume, scenario.target, headers, scenario.statuses, args.mode, args.depth, args.duration, results))
+        for _ in range(args.clients)
+    ]
+
+    cpu_before = process_cpu_time(server_pid)
+    started_at = time.perf_counter()
+    for process in processes:
+        process.start()
+
+    totals = [results.get() for _ in processes]
+    elapsed = time.perf_counter() - started_at
+    cpu_after = process_cpu_time(server_pid)
+
+    for process in processes:
+        process.join()
+    for sock in idle:
+        sock.close()
+
+    latencies = array.array("d")
+    for data, _, _ in totals:
+        latencies.frombytes(data)
+    ordered = sorted(latencies)
+
+    requests = len(ordered)
+    cpu = cpu_after - cpu_before if cpu_before is not None and cpu_after is not None else None
+    peak_rss = process_peak_rss(server_pid)
+
+    def ms(seconds: float | None) -> float | None:
+        return seconds * 1000 if seconds is not None else None
+
+    return {
+        "requests": requests,
+        "errors": sum(errors for _, errors, _ in totals),
+        "connections": sum(connections for _, _, connections in totals),
+        "req_per_sec": requests / elapsed,
+        "p50_ms": ms(percentile(ordered, 0.50)),
+        "p99_ms": ms(percentile(ordered, 0.99)),
+        "p999_ms": ms(percentile(ordered, 0.999)),
+        "max_ms": ms(ordered[-1] if requests != 0 else None),
+        "cpu_us_per_request": cpu / requests * 1e6 if cpu is not None and requests != 0 else None,
+        "peak_rss_mb": peak_rss / (1024 * 1024) if peak_rss is not None else None,
+    }
+
+def wait_for_server(addr: tuple[str, int], timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+
+    while True:
+        try:
+            socket.create_connection(addr, timeout=1.0).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+
+            time.sleep(0.1)
+
+def format_value(value: float | None, digits: int = 2) -> str:
+    return f"{value:.{digits}f}" if value is not None else "-"
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="bench.load", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("scenarios", nargs="*", metavar="scenario", help=f"scenarios to run, all by default: {', '.join(SCENARIOS)}")
+    parser.add_argument("--addr", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--engine", choices=("thread", "reactor", "asyncio"), default="reactor")
+    parser.add_argument("--tls", action="store_true", help="benchmark the HTTPS server with a self-signed certificate")
+    parser.add_argument("--tls-preset", default="intermediate", help="TLS preset of the server")
+    parser.add_argument("--no-resume", dest="resume", action="store_false", help="make every TLS connection a full handshake")
+    parser.add_argument("--mode", choices=MODES, default="keep-alive")
+    parser.add_argument("--depth", type=int, default=8, help="requests per batch in pipeline mode")
+    parser.add_argument("--clients", type=int, default=4, help="number of client processes, each with one connection at a time")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds each scenario runs")
+    parser.add_argument("--idle-connections", type=int, default=500, help="connections held open during the idle scenario")
+    parser.add_argument("--keep-alive-max", type=int, default=10_000)
+    parser.add_argument("--json", metavar="FILE", help="save the results as JSON")
+    parser.add_argument("--baseline", metavar="FILE", help="JSON results of a previous run to compare with")
+    args = parser.parse_args(argv)
+
+    if len(unknown:=[name for name in args.scenarios if name not in SCENARIOS]) != 0:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    scenarios = [SCENARIOS[name] for name in args.scenarios] or list(SCENARIOS.values())
+    baseline = load(args.baseline, "load") if args.baseline is not None else {}
+    addr = (args.addr, args.port)
+
+    options = {
+        "max_connections": args.idle_connections + args.clients + 64,
+        # Every connection comes from the same address
+        "max_connections_per_ip": None,
+        "keep_alive_max": args.keep_alive_max,
+        # Idle connections must outlive the scenario
+        "keep_alive_timeout": args.duration + 30,
+        "access_log": False,
+    }
+    if args.tls:
+        options["tls_preset"] = args.tls_preset
+
+    with tempfile.TemporaryDirectory(prefix="http-bench-") as document_root:
+        make_document_root(document_root)
+        certificate = make_certificate(document_root) if args.tls else None
+
+        # The server imports the `src` modules, the client processes don't need them
+        sys.path.insert(0, SRC_DIR)
+        server = multiprocessing.Process(target=serve, args=(args.engine, args.tls, addr, document_root, certificate, options), daemon=True)
+        server.start()
+
+        try:
+            wait_for_server(addr)
+
+            print(f"{'scenario':<14}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'p999 ms':>10}{'cpu us/req':>12}{'rss MB':>9}{'errors':>8}")
+            results: dict[str, dict[str, typing.Any]] = {}
+
+            for scenario in scenarios:
+                result = results[scenario.name] = run_scenario(args, scenario, server.pid, addr)
+                compared = change(baseline.get(scenario.name, {}).get("req_per_sec"), result["req_per_sec"])
+
+                print(
+                    f"{scenario.name:<14}{result['req_per_sec']:>10.0f}{format_value(result['p50_ms']):>10}{format_value(result['p99_ms']):>10}"
+                    f"{format_value(result['p999_ms']):>10}{format_value(result['cpu_us_per_request'], 1):>12}{format_value(result['peak_rss_mb'], 1):>9}"
+                    f"{result['errors']:>8}  {compared}"
+                )
+        finally:
+            server.terminate()
+            server.join()
+
+    if args.json is not None:
+        save(args.json, "load", results, engine=args.engine, tls=args.tls_preset if args.tls else None, resume=args.resume, mode=args.mode, depth=args.depth, clients=args.clients, duration=args.duration)
+
+if __name__ == "__main__":
+    main()
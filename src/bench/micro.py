@@ -0,0 +1,110 @@
+"""
+Request path microbenchmarks
+
+Times the per-request steps of the server in isolation: cutting a request head out of the receive
+buffer, parsing it, the header container and building the response head. Results can be saved as
+JSON and compared with a previous run.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import socket
+import timeit
+import typing
+
+from http import HTTPStatus
+
+from http_message import HTTPRequest, HTTPResponse
+from http_server import HTTPServer
+
+from bench import headers
+from bench.report import change, load, save
+
+REQUEST_HEAD: typing.Final[bytes] = (
+    b"GET /static/style.css?v=3&theme=dark HTTP/1.1\r\n"
+    + b"".join(f"{header_name}: {header_value}\r\n".encode() for header_name, header_value in headers.REQUEST_HEADERS)
+)
+"""Request head as `read_head` returns it, without the empty line ending it"""
+
+class ReplaySocket:
+    """Socket stand-in whose every receive returns the same request, like a client sending one after another"""
+    data: bytes
+
+    def __init__(self: typing.Self, data: bytes) -> None:
+        self.data = data
+
+    def recv_into(self: typing.Self, buffer: memoryview) -> int:
+        size = min(len(self.data), len(buffer))
+        buffer[:size] = self.data[:size]
+
+        return size
+
+    def getpeername(self: typing.Self) -> tuple[str, int]:
+        return ("127.0.0.1", 0)
+
+def read_head_case() -> typing.Callable[[], object]:
+    server = HTTPServer(addr=("127.0.0.1", 0), access_log=False)
+    server.sock.close()
+
+    sock = typing.cast(socket.socket, ReplaySocket(REQUEST_HEAD + b"\r\n"))
+    reader = server.new_reader()
+
+    return lambda: server.read_head(sock, reader)
+
+def parse_request_head_case() -> typing.Callable[[], object]:
+    return lambda: HTTPRequest().parse_request_head(REQUEST_HEAD)
+
+def construct_head_case() -> typing.Callable[[], object]:
+    request = HTTPRequest()
+    request.parse_request_head(REQUEST_HEAD)
+    file_stat = os.stat(__file__)
+
+    def construct_head() -> bytes:
+        response = HTTPResponse()
+        response.status = HTTPStatus.OK
+
+        for header_name, header_value in headers.RESPONSE_HEADERS:
+            response.headers[header_name] = header_value
+
+        response.construct_head(request, file_stat)
+        return response.encode_head()
+
+    return construct_head
+
+def cases() -> dict[str, typing.Callable[[], object]]:
+    return {
+        "read_head": read_head_case(),
+        "parse_request_head": parse_request_head_case(),
+        **{f"headers.{name}": case for name, case in headers.CASES.items()},
+        "construct_head": construct_head_case(),
+    }
+
+def run(number: int, repeat: int, selected: typing.Collection[str] = ()) -> dict[str, float]:
+    """Best time of each case in nanoseconds per call"""
+    return {
+        name: min(timeit.repeat(case, number=number, repeat=repeat)) / number * 1e9
+        for name, case in cases().items() if len(selected) == 0 or name in selected
+    }
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="bench.micro", description=__doc__.strip().splitlines()[0])
+    parser.add_argument("cases", nargs="*", metavar="case", help="cases to run, all by default")
+    parser.add_argument("--number", type=int, default=20_000, help="calls per timing")
+    parser.add_argument("--repeat", type=int, default=5, help="timings per case, the best one is kept")
+    parser.add_argument("--json", metavar="FILE", help="save the results as JSON")
+    parser.add_argument("--baseline", metavar="FILE", help="JSON results of a previous run to compare with")
+    args = parser.parse_args(argv)
+
+    baseline = load(args.baseline, "micro") if args.baseline is not None else {}
+    results: dict[str, dict[str, typing.Any]] = {}
+
+    for name, ns in run(args.number, args.repeat, args.cases).items():
+        results[name] = {"ns_per_call": ns}
+        print(f"{name:<20}{ns / 1000:>10.2f} us  {change(baseline.get(name, {}).get('ns_per_call'), ns)}")
+
+    if args.json is not None:
+        save(args.json, "micro", results, number=args.number, repeat=args.repeat)
+
+if __name__ == "__main__":
+    main()
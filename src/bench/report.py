@@ -0,0 +1,58 @@
+"""
+Benchmark results as JSON
+
+Every run is saved with the commit and the environment it ran in, so results of two commits can
+be compared case by case with `--baseline`.
+"""
+from __future__ import annotations
+
+import datetime
+import json
+import os
+import platform
+import subprocess
+import typing
+
+def commit() -> str | None:
+    """Commit of the working tree, with a `-dirty` suffix if it has uncommitted changes"""
+    src_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=src_dir, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=src_dir, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return revision + "-dirty" if len(dirty) != 0 else revision
+
+def metadata(**options: typing.Any) -> dict[str, typing.Any]:
+    return {
+        "commit": commit(),
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "options": options,
+    }
+
+def save(path: str, benchmark: str, results: dict[str, dict[str, typing.Any]], **options: typing.Any) -> None:
+    with open(path, "w") as file:
+        json.dump({"benchmark": benchmark, "meta": metadata(**options), "results": results}, file, indent=2)
+        file.write("\n")
+
+def load(path: str, benchmark: str) -> dict[str, dict[str, typing.Any]]:
+    with open(path) as file:
+        report = json.load(file)
+
+    if report.get("benchmark") != benchmark:
+        raise ValueError(f"{path} holds {report.get('benchmark')!r} results, not {benchmark!r} ones!")
+
+    return report["results"]
+
+def change(baseline: float | None, value: float | None) -> str:
+    """Relative change of `value` against `baseline`, e.g. `+12.5%`"""
+    if baseline is None or value is None or baseline == 0:
+        return ""
+
+    return f"{(value - baseline) / baseline * 100:+.1f}%"
@@ -0,0 +1,478 @@
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import contextlib
+import socket
+import ssl
+import time
+import typing
+
+from http import HTTPStatus
+
+import http_constants
+from http_message import HTTPRequest, HTTPResponse
+from http_handler import HTTPHandler
+from http_reader  import RequestReader
+from http_body    import BodyDecoder, CONTINUE_RESPONSE
+from http_metrics import RequestTiming
+from http_server  import HTTPServer, HTTPSServer, SENDFILE_CHUNK_SIZE
+from http_h2      import SWITCHING_PROTOCOLS, ErrorCode, H2Connection, H2Stream
+from http_deadlines import Phase
+
+WRITE_CHUNK_SIZE: typing.Final[int] = 64 * 1024
+
+class AsyncHTTPServer(HTTPServer):
+    """
+    Server engine built on `asyncio.start_server`.
+
+    Handler methods defined with `async def` run on the event loop, plain ones run in the
+    bounded worker pool, so a slow handler never blocks other connections.
+    Responses are written in chunks with `drain()` between them to respect backpressure.
+    Every stream of an HTTP/2 connection is answered by a task of its own, so its requests are
+    handled concurrently too. The deadlines of a connection are those of the task serving it, which
+    is cancelled when one passes.
+    """
+    loop_factory: typing.Callable[[], asyncio.AbstractEventLoop] | None
+    stream_limit: int
+
+    loop: asyncio.AbstractEventLoop | None
+    server: asyncio.Server | None
+    stop_event: asyncio.Event | None
+    writers: set[asyncio.StreamWriter]
+    expired: dict[asyncio.Task, Phase]
+    """Connection tasks cancelled for missing a deadline, with its phase"""
+
+    def __init__(self: typing.Self,
+                 version: str = "HTTP/1.1",
+                 addr: tuple[str, int] = ("localhost", 80),
+                 handler: HTTPHandler | None = None,
+                 loop_factory: typing.Callable[[], asyncio.AbstractEventLoop] | None = None,
+                 **kwargs) -> None:
+        super().__init__(version, addr, handler, **kwargs)
+        self.loop_factory = loop_factory
+        self.stream_limit = 64 * 1024
+
+        self.loop = None
+        self.server = None
+        self.stop_event = None
+        self.writers = set()
+        self.expired = {}
+
+    @typing.override
+    def serv(self: typing.Self) -> typing.NoReturn:
+        """Runs the server in a new event loop created by `loop_factory` (e.g. `uvloop.new_event_loop`)"""
+        asyncio.run(self.serv_async(), loop_factory=self.loop_factory)
+
+    async def serv_async(self: typing.Self) -> None:
+        self.sock.listen(socket.SOMAXCONN)
+        self.sock.setblocking(False)
+
+        self.loop = asyncio.get_running_loop()
+        self.executor = concurrent.futures.ThreadPoolExecutor(self.max_workers, thread_name_prefix="http-worker")
+        self.stop_event = asyncio.Event()
+        # asyncio runs the TLS handshakes itself, without blocking the loop
+        handshake_timeout = self.handshake_timeout if self.ssl_context is not None else None
+        self.server = await asyncio.start_server(self.handle_connection, sock=self.sock, ssl=self.ssl_context, ssl_handshake_timeout=handshake_timeout, limit=self.stream_limit)
+        print(f"[INFO]: HTTP Server (asyncio) listening on: {self.addr[0]}:{self.addr[1]}")
+
+        self.running = True
+
+        housekeeping = asyncio.create_task(self.housekeeping())
+
+        async with self.server:
+            await self.stop_event.wait()
+
+            housekeeping.cancel()
+
+            for writer in tuple(self.writers):
+                writer.close()
+
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def housekeeping(self: typing.Self) -> None:
+        """Periodic work the other engines do in their loops, such as reloading a changed certificate"""
+        while True:
+            await asyncio.sleep(0.5)
+            self.reap(time.monotonic())
+
+    @typing.override
+    def expire(self: typing.Self, task: asyncio.Task, phase: Phase) -> None:
+        """Cancels the task serving a connection that missed a deadline, which answers or closes it"""
+        self.expired[task] = phase
+        task.cancel()
+
+    async def read_head_async(self: typing.Self, reader: asyncio.StreamReader, request_reader: RequestReader) -> bytes:
+        """Returns the next request head, or no bytes if the client closed"""
+        while (head:=request_reader.next_head()) is None:
+            if len(data:=await reader.read(self.stream_limit)) == 0:
+                if len(request_reader) == 0:
+                    return bytes()
+
+                raise http_constants.HTTPError("Incomplete head recived!")
+
+            if len(request_reader) == 0 and self.deadlines.phase(task:=asyncio.current_task()) is Phase.IDLE:
+                self.arm(task, Phase.HEAD)
+
+            request_reader.feed(data)
+
+        return head
+
+    async def read_body_async(self: typing.Self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, request_reader: RequestReader, http_request: HTTPRequest, body_decoder: BodyDecoder) -> None:
+        task = asyncio.current_task()
+
+        if self.expects_continue(http_request, request_reader):
+            writer.write(CONTINUE_RESPONSE)
+            await writer.drain()
+
+        self.arm(task, Phase.BODY)
+        try:
+            while not body_decoder.feed(request_reader):
+                if len(data:=await reader.read(self.stream_limit)) == 0:
+                    raise http_constants.HTTPError("Incomplete request body recived!")
+
+                request_reader.feed(data)
+                self.deadlines.progress(task, len(data))
+        except BaseException:
+            body_decoder.body.close()
+            raise
+
+        http_request.body = body_decoder.body
+
+    @typing.override
+    def connection_count(self: typing.Self) -> int:
+        return len(self.writers)
+
+    async def handle_connection(self: typing.Self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        peername = writer.get_extra_info("peername")
+        if len(self.writers) >= self.max_connections:
+            return await self.reject_async(reader, writer)
+        if not self.admit(peername):
+            return await self.reject_async(reader, writer, HTTPStatus.TOO_MANY_REQUESTS)
+
+        self.writers.add(writer)
+        request_reader = self.new_reader()
+        accepted_at = time.perf_counter()
+        task = asyncio.current_task()
+
+        if (sock:=writer.get_extra_info("socket")) is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        protocol = None
+        if (ssl_object:=writer.get_extra_info("ssl_object")) is not None:
+            protocol = self.handshake_done(ssl_object)
+        served = 0
+        h2 = None
+        responding = False
+
+        try:
+            self.arm(task, Phase.HEAD)
+
+            if protocol == "h2":
+                return await self.serve_h2_async(reader, writer, h2:=self.new_h2_connection())
+
+            while True:
+                request_head = await self.read_head_async(reader, request_reader)
+
+                if len(request_head) == 0:
+                    break
+
+                if (h2:=self.prior_knowledge(request_head, served)) is not None:
+                    await self.serve_h2_async(reader, writer, h2, request_reader.read(len(request_reader)))
+                    break
+
+                http_request = HTTPRequest()
+                http_request.parse_request_head(request_head)
+                timing = RequestTiming(accepted_at if served == 0 else request_reader.received_at, time.perf_counter(), received=len(request_head))
+
+                if (body_decoder:=self.new_body_decoder(http_request)) is not None:
+                    await self.read_body_async(reader, writer, request_reader, http_request, body_decoder)
+
+                if (h2:=self.h2c_upgrade(http_request, timing)) is not None:
+                    writer.write(SWITCHING_PROTOCOLS)
+                    await self.serve_h2_async(reader, writer, h2, request_reader.read(len(request_reader)), (h2.streams[1],))
+                    break
+
+                served += 1
+                self.deadlines.cancel(task)
+                try:
+                    http_response = await self.process_request_async(http_request, served)
+                finally:
+                    http_request.body.close()
+                timing.handler = time.perf_counter()
+
+                responding = True
+                timing.sent = await self.write_response(writer, http_response)
+                responding = False
+                timing.received += http_request.body.length
+                self.observe_request(http_request, http_response, timing, served)
+
+                if not http_response.keep_alive:
+                    break
+
+                self.arm(task, Phase.HEAD if len(request_reader) != 0 else Phase.IDLE)
+        except http_constants.HTTPError as e:
+            await self.refuse_async(writer, e)
+        except asyncio.CancelledError:
+            if (phase:=self.expired.pop(task, None)) is None:
+                raise
+            task.uncancel()
+
+            if h2 is None and (phase is Phase.BODY or phase is Phase.HEAD and len(request_reader) != 0):
+                await self.refuse_async(writer, http_constants.HTTPError(self.timeout_message(phase), status=HTTPStatus.REQUEST_TIMEOUT))
+            elif phase is Phase.IDLE and h2 is not None:
+                h2.goaway()
+                writer.write(h2.data_to_send())
+            elif phase in (Phase.BODY, Phase.WRITE):
+                print(f"[ERROR]: {peername[0]}:{peername[1]} {self.timeout_message(phase)}")
+        except (ConnectionError, asyncio.IncompleteReadError, ssl.SSLError):
+            pass
+        except Exception as e:
+            # Answered unless part of a response or HTTP/2 frames went out already
+            if h2 is None and not responding:
+                await self.refuse_async(writer, http_constants.HTTPError(repr(e), status=HTTPStatus.INTERNAL_SERVER_ERROR))
+            else:
+                print(f"[ERROR]: {peername[0]}:{peername[1]} {e!r}")
+        finally:
+            self.deadlines.cancel(task)
+            self.expired.pop(task, None)
+            self.release(peername)
+            self.writers.discard(writer)
+            writer.close()
+
+    async def reject_async(self: typing.Self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, status: HTTPStatus = HTTPStatus.SERVICE_UNAVAILABLE) -> None:
+        """
+        Sheds load by answering with `503 Service Unavailable` right away and closing the connection,
+        `429 Too Many Requests` for a client over `max_connections_per_ip`.
+        """
+        with self.stats_lock:
+            self.rejected += 1
+
+        writer.write(self.error_response(status, {"Retry-After": self.retry_after}))
+        try:
+            if writer.can_write_eof():
+                writer.write_eof()
+
+            # Discard the unread request, closing with pending input would reset the connection before the 503 arrives
+            async with asyncio.timeout(self.header_timeout):
+                while len(await reader.read(self.stream_limit)) != 0:
+                    pass
+        except (TimeoutError, ConnectionError, ssl.SSLError):
+            pass
+        finally:
+            writer.close()
+
+    async def refuse_async(self: typing.Self, writer: asyncio.StreamWriter, error: http_constants.HTTPError) -> None:
+        """Answers a request that can't be served with the status of `error`, the connection is closed after"""
+        peername = writer.get_extra_info("peername")
+        print(f"[ERROR]: {peername[0]}:{peername[1]} {error}")
+        self.metrics.errors.inc((error.status.value,))
+
+        self.arm(asyncio.current_task(), Phase.WRITE)
+        writer.write(self.error_response(error.status))
+        try:
+            await writer.drain()
+        except (ConnectionError, ssl.SSLError):
+            pass
+
+    async def serve_h2_async(self: typing.Self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, h2: H2Connection,
+                             data: bytes = b"", streams: typing.Iterable[H2Stream] = ()) -> None:
+        """
+        Serves an HTTP/2 connection: this task reads, a task of every stream answers it and a writer
+        task sends the output whenever `wake` is set. `streams` are already complete requests (the
+        upgraded one), `data` bytes already received.
+        """
+        wake = asyncio.Event()
+        """Set when there may be output to send"""
+        sent = asyncio.Event()
+        """Set when output was sent, streams pushing their body wait for it to go on"""
+        tasks: set[asyncio.Task] = set()
+        served = 0
+        conn = asyncio.current_task()
+
+        def waiting() -> None:
+            """Starts the deadline of what the connection waits for from the client, none while handlers run"""
+            if len(tasks) != 0:
+                self.deadlines.cancel(conn)
+            else:
+                self.arm(conn, Phase.IDLE if h2.idle else Phase.BODY)
+
+        def answer(stream: H2Stream) -> None:
+            nonlocal served
+            served += 1
+
+            task = asyncio.create_task(self.answer_h2_stream_async(h2, stream, served, wake, sent))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        writing = asyncio.create_task(self.write_h2(writer, h2, wake, sent, conn, waiting))
+        try:
+            for stream in (*streams, *h2.receive(data)):
+                answer(stream)
+            wake.set()
+            waiting()
+
+            while not h2.done:
+                if len(data:=await reader.read(self.stream_limit)) == 0:
+                    return
+
+                for stream in h2.receive(data):
+                    answer(stream)
+                wake.set()
+
+                # The writer takes over the deadline once its output is done draining
+                if self.deadlines.phase(conn) is not Phase.WRITE:
+                    waiting()
+
+            # The GOAWAY and what is left of the streams in flight
+            async with asyncio.timeout(self.keep_alive_timeout):
+                await writing
+
+            if h2.error is not None:
+                peername = writer.get_extra_info("peername")
+                print(f"[ERROR]: {peername[0]}:{peername[1]} {h2.error}")
+        except TimeoutError:
+            pass
+        finally:
+            writing.cancel()
+            for task in tuple(tasks):
+                task.cancel()
+            h2.close()
+
+    async def write_h2(self: typing.Self, writer: asyncio.StreamWriter, h2: H2Connection, wake: asyncio.Event, sent: asyncio.Event,
+                       conn: asyncio.Task, waiting: typing.Callable[[], None]) -> None:
+        """Sends the output of `h2` under the write deadline of the connection task `conn`, `waiting` starts the next one after"""
+        peername = writer.get_extra_info("peername")
+
+        while True:
+            if len(data:=h2.data_to_send()) != 0:
+                writer.write(data)
+                self.arm(conn, Phase.WRITE)
+                await writer.drain()
+                waiting()
+
+                self.observe_h2(h2, peername)
+                sent.set()
+                continue
+
+            if h2.done:
+                return
+
+            wake.clear()
+            await wake.wait()
+
+    async def answer_h2_stream_async(self: typing.Self, h2: H2Connection, stream: H2Stream, served: int, wake: asyncio.Event, sent: asyncio.Event) -> None:
+        """Generates the response of a complete HTTP/2 request, a streamed body is pushed to its stream as it is produced"""
+        stream.served = served
+        try:
+            http_response = await self.process_request_async(stream.request, served)
+        except Exception as e:
+            print(f"[ERROR]: {stream.request.method} {stream.request.target} {e!r}")
+            h2.reset_stream(stream.id, ErrorCode.INTERNAL_ERROR)
+            wake.set()
+            return
+        finally:
+            stream.request.body.close()
+
+        stream.timing.handler = time.perf_counter()
+
+        # Bytes and files are framed as they are sent, a stream may have to wait for its source
+        body_stream = http_response.body_stream
+        sending = h2.send_response(stream.id, http_response, pull=body_stream is None)
+        wake.set()
+
+        if body_stream is None or not sending:
+            return
+
+        try:
+            async with contextlib.aclosing(aiter(body_stream)) as pieces:
+                async for data in pieces:
+                    if not h2.send_data(stream.id, data):
+                        return
+                    wake.set()
+
+                    while h2.buffered(stream.id) > WRITE_CHUNK_SIZE:
+                        sent.clear()
+                        await sent.wait()
+        except ConnectionAbortedError:
+            h2.reset_stream(stream.id, ErrorCode.INTERNAL_ERROR)
+        else:
+            h2.end_data(stream.id, body_stream.trailers.items())
+
+        wake.set()
+
+    async def process_request_async(self: typing.Self, http_request: HTTPRequest, served: int = 1) -> HTTPResponse:
+        if self.is_metrics_request(http_request) or not self.handler.is_async(http_request):
+            return await asyncio.get_running_loop().run_in_executor(self.executor, self.process_request, http_request, served)
+
+        http_response = await self.handler.generate_response_async(http_request)
+
+        return self.finish_response(http_request, http_response, served)
+
+    async def write_response(self: typing.Self, writer: asyncio.StreamWriter, http_response: HTTPResponse) -> int:
+        """Writes the whole response under the write deadline of the current task, returns the number of bytes written"""
+        task = asyncio.current_task()
+
+        if (body_stream:=http_response.body_stream) is not None:
+            writer.write(head:=http_response.encode_head())
+            sent = len(head)
+
+            async for data in body_stream:
+                writer.write(data)
+                sent += len(data)
+
+                # Only the client's part counts, not the time the stream takes to produce the next piece
+                self.arm(task, Phase.WRITE)
+                await writer.drain()
+                self.deadlines.cancel(task)
+            return sent
+
+        self.arm(task, Phase.WRITE)
+
+        if (body_file:=http_response.body_file) is not None:
+            writer.write(head:=http_response.encode_head())
+
+            with body_file:
+                await writer.drain()
+
+                if writer.get_extra_info("ssl_object") is not None:
+                    # The fallback of loop.sendfile reads at the file position, which responses sharing the file would move
+                    for chunk in body_file.chunks():
+                        writer.write(chunk)
+                        await writer.drain()
+                        self.deadlines.progress(task, len(chunk))
+                else:
+                    # In pieces, for the deadline to see the progress
+                    loop = asyncio.get_running_loop()
+                    for offset in range(body_file.offset, body_file.offset + body_file.length, SENDFILE_CHUNK_SIZE):
+                        count = min(SENDFILE_CHUNK_SIZE, body_file.offset + body_file.length - offset)
+                        await loop.sendfile(writer.transport, body_file.file, offset, count)
+                        self.deadlines.progress(task, count)
+            return len(head) + body_file.length
+
+        body = memoryview(http_response.encode_head() + http_response.encode_body())
+        for offset in range(0, len(body), WRITE_CHUNK_SIZE):
+            writer.write(piece:=body[offset:offset + WRITE_CHUNK_SIZE])
+            await writer.drain()
+            self.deadlines.progress(task, len(piece))
+
+        await writer.drain()
+        return len(body)
+
+    @typing.override
+    def shutdown(self: typing.Self, timeout: float) -> None:
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.server.close)
+
+        super().shutdown(timeout)
+
+    @typing.override
+    def close(self: typing.Self) -> None:
+        self.running = False
+
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.stop_event.set)
+        else:
+            self.sock.close()
+
+class AsyncHTTPSServer(HTTPSServer, AsyncHTTPServer):
+    pass
@@ -0,0 +1,219 @@
+"""
+Request bodies
+
+`BodyDecoder` takes a `Content-Length` or chunked body out of a connection's `RequestReader` as the
+bytes arrive, without doing any I/O itself, so every server engine drives it the same way.
+The decoded body is handed to the handler as a `RequestBody`, which stays in memory up to a
+threshold and is spooled to a temporary file above it.
+"""
+from __future__ import annotations
+
+import asyncio
+import enum
+import tempfile
+import typing
+
+from http import HTTPStatus
+
+from http_constants import HEX, HTTPError
+from http_headers import HTTPHeaders
+from http_reader import RequestReader
+
+READ_CHUNK_SIZE: typing.Final[int] = 64 * 1024
+MAX_CHUNK_LINE: typing.Final[int] = 4 * 1024
+"""Longest chunk size line (size and extensions) or trailer line accepted"""
+MAX_TRAILERS: typing.Final[int] = 100
+
+CONTINUE_RESPONSE: typing.Final[bytes] = b"HTTP/1.1 100 Continue\r\n\r\n"
+
+HEX_DIGITS: typing.Final[frozenset[int]] = frozenset(b"".join(HEX))
+
+class RequestBody:
+    """
+    Body of a request, kept in memory up to `spool_threshold` bytes and in a temporary file above it.
+
+    It is file-like (`read`, `readinto`, `seek`), iterates in chunks of `READ_CHUNK_SIZE` bytes and
+    supports `async for` too, reading from disk in a thread once spooled.
+    """
+    file: tempfile.SpooledTemporaryFile | None
+    """Created on the first write, most requests have no body"""
+    length: int
+    spool_threshold: int
+    trailers: HTTPHeaders
+
+    def __init__(self: typing.Self, spool_threshold: int = 1024 * 1024) -> None:
+        self.file = None
+        self.length = 0
+        self.spool_threshold = spool_threshold
+        self.trailers = HTTPHeaders()
+
+    @classmethod
+    def from_bytes(cls: type[typing.Self], data: bytes) -> typing.Self:
+        body = cls(max(len(data), 1))
+        body.write(data)
+        body.seek(0)
+
+        return body
+
+    @property
+    def spooled(self: typing.Self) -> bool:
+        """Whether the body went to a temporary file"""
+        return self.length > self.spool_threshold
+
+    def write(self: typing.Self, data: bytes) -> None:
+        if self.file is None:
+            self.file = tempfile.SpooledTemporaryFile(max_size=self.spool_threshold, prefix="http-body-")
+
+        self.file.write(data)
+        self.length += len(data)
+
+    def read(self: typing.Self, size: int = -1) -> bytes:
+        return self.file.read(size) if self.file is not None else bytes()
+
+    def readinto(self: typing.Self, buffer: bytearray | memoryview) -> int:
+        return self.file.readinto(buffer) if self.file is not None else 0
+
+    def seek(self: typing.Self, offset: int, whence: int = 0) -> int:
+        return self.file.seek(offset, whence) if self.file is not None else 0
+
+    def tell(self: typing.Self) -> int:
+        return self.file.tell() if self.file is not None else 0
+
+    def readable(self: typing.Self) -> bool:
+        return True
+
+    def close(self: typing.Self) -> None:
+        """Closes the body, deleting its temporary file"""
+        if self.file is not None:
+            self.file.close()
+
+    def __len__(self: typing.Self) -> int:
+        return self.length
+
+    def __iter__(self: typing.Self) -> typing.Iterator[bytes]:
+        while len(chunk:=self.read(READ_CHUNK_SIZE)) != 0:
+            yield chunk
+
+    async def __aiter__(self: typing.Self) -> typing.AsyncIterator[bytes]:
+        while True:
+            # Reading from memory never blocks, reading from disk might
+            chunk = await asyncio.to_thread(self.read, READ_CHUNK_SIZE) if self.spooled else self.read(READ_CHUNK_SIZE)
+
+            if len(chunk) == 0:
+                return
+
+            yield chunk
+
+    def __enter__(self: typing.Self) -> typing.Self:
+        return self
+
+    def __exit__(self: typing.Self, *args) -> None:
+        self.close()
+
+class DecoderState(enum.Enum):
+    DATA = enum.auto()
+    CHUNK_SIZE = enum.auto()
+    CHUNK_DATA = enum.auto()
+    CHUNK_END = enum.auto()
+    TRAILERS = enum.auto()
+    DONE = enum.auto()
+
+class BodyDecoder:
+    """
+    Incremental decoder of a request body framed by `Content-Length` (`length`) or chunked (`length` is `None`).
+
+    Raises `HTTPError` with 413 as soon as the body grows over `max_size` and with 400 on malformed chunks.
+    """
+    body: RequestBody
+    state: DecoderState
+    remaining: int
+    max_size: int
+    trailer_count: int
+
+    def __init__(self: typing.Self, length: int | None, max_size: int, spool_threshold: int) -> None:
+        if length is not None and length > max_size:
+            raise HTTPError(f"Request body of {length} byte(s) exceeds {max_size} byte(s)!", status=HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+
+        self.body = RequestBody(spool_threshold)
+        self.state = DecoderState.DATA if length is not None else DecoderState.CHUNK_SIZE
+        self.remaining = length if length is not None else 0
+        self.max_size = max_size
+        self.trailer_count = 0
+
+        if self.state is DecoderState.DATA and self.remaining == 0:
+            self.finish()
+
+    @property
+    def done(self: typing.Self) -> bool:
+        return self.state is DecoderState.DONE
+
+    def feed(self: typing.Self, reader: RequestReader) -> bool:
+        """Takes as much of the body out of `reader` as it holds, returns `True` once the body is complete"""
+        while self.state is not DecoderState.DONE:
+            match self.state:
+                case DecoderState.DATA | DecoderState.CHUNK_DATA:
+                    if len(reader) == 0:
+                        return False
+
+                    data = reader.read(min(self.remaining, len(reader)))
+                    self.body.write(data)
+                    self.remaining -= len(data)
+
+                    if self.remaining != 0:
+                        return False
+
+                    if self.state is DecoderState.DATA:
+                        self.finish()
+                    else:
+                        self.state = DecoderState.CHUNK_END
+                case DecoderState.CHUNK_SIZE:
+                    if (line:=reader.read_line(MAX_CHUNK_LINE)) is None:
+                        return False
+
+                    self.start_chunk(line)
+                case DecoderState.CHUNK_END:
+                    if (line:=reader.read_line(MAX_CHUNK_LINE)) is None:
+                        return False
+                    if len(line) != 0:
+                        raise HTTPError("Chunk data is not followed by CRLF!")
+
+                    self.state = DecoderState.CHUNK_SIZE
+                case DecoderState.TRAILERS:
+                    if (line:=reader.read_line(MAX_CHUNK_LINE)) is None:
+                        return False
+
+                    self.add_trailer(line)
+
+        return True
+
+    def start_chunk(self: typing.Self, line: bytes) -> None:
+        # Chunk extensions are allowed and ignored
+        size = line.split(b";", 1)[0].strip()
+
+        if len(size) == 0 or not HEX_DIGITS.issuperset(size):
+            raise HTTPError(f"Invalid chunk size {size!r}!")
+
+        chunk_size = int(size, 16)
+        if self.body.length + chunk_size > self.max_size:
+            raise HTTPError(f"Request body exceeds {self.max_size} byte(s)!", status=HTTPStatus.REQUEST_ENTITY_TOO_LARGE)
+
+        self.remaining = chunk_size
+        self.state = DecoderState.CHUNK_DATA if chunk_size != 0 else DecoderState.TRAILERS
+
+    def add_trailer(self: typing.Self, line: bytes) -> None:
+        if len(line) == 0:
+            return self.finish()
+
+        header_name, colon, header_value = line.decode("latin-1").partition(":")
+        if len(colon) == 0 or len(header_name.strip()) == 0:
+            raise HTTPError(f"Invalid trailer line {line!r}!")
+
+        if (trailer_count:=self.trailer_count + 1) > MAX_TRAILERS:
+            raise HTTPError(f"Request has more than {MAX_TRAILERS} trailer(s)!", status=HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+
+        self.trailer_count = trailer_count
+        self.body.trailers.add(header_name.strip(), header_value.strip())
+
+    def finish(self: typing.Self) -> None:
+        self.body.seek(0)
+        self.state = DecoderState.DONE
@@ -0,0 +1,338 @@
+from __future__ import annotations
+
+import collections
+import dataclasses
+import functools
+import mimetypes
+import mmap
+import os
+import stat
+import threading
+import time
+import typing
+
+from http_compression import compress, fresh_sidecars, sidecar_path
+from http_conditional import http_date, make_etag
+from http_message import FileBody
+
+def within(root: str, path: str) -> bool:
+    """Whether the real path of `path`, with every symlink resolved, is the real path `root` or under it"""
+    real_path = os.path.realpath(path)
+
+    return real_path == root or real_path.startswith(root.rstrip(os.sep) + os.sep)
+
+@dataclasses.dataclass(eq=False)
+class CachedFile:
+    """A static file held in memory or open, together with everything derived from it"""
+    path: str
+    data: bytes | mmap.mmap | None
+    """Content of the files up to `max_file_size`, `None` for larger ones"""
+    file: typing.BinaryIO | None
+    """Files larger than `max_file_size` stay open, shared by the responses sending them"""
+    content_type: str | None
+    file_stat: os.stat_result
+    last_modified: str
+    etag: str
+    checked_at: float
+    used_at: float
+
+    variants: dict[str, bytes] = dataclasses.field(default_factory=dict)
+    """Encoded bodies by content coding, loaded from sidecars or compressed on first use"""
+    sidecars: dict[str, os.stat_result] = dataclasses.field(default_factory=dict)
+
+    users: int = 0
+    """Responses still sending from `file`, which is closed once the entry is dropped and there are none left"""
+    dropped: bool = False
+
+    @property
+    def size(self: typing.Self) -> int:
+        return (len(self.data) if self.data is not None else 0) + sum(map(len, self.variants.values()))
+
+    def is_stale(self: typing.Self, file_stat: os.stat_result) -> bool:
+        if (file_stat.st_mtime_ns, file_stat.st_size, file_stat.st_ino) != (self.file_stat.st_mtime_ns, self.file_stat.st_size, self.file_stat.st_ino):
+            return True
+
+        sidecars = fresh_sidecars(self.path, file_stat)
+        return {coding: (s.st_mtime_ns, s.st_size) for coding, s in sidecars.items()} != {coding: (s.st_mtime_ns, s.st_size) for coding, s in self.sidecars.items()}
+
+class StaticFileCache:
+    """
+    Open file cache of the static files keyed by path, bounded to `max_entries` files and `max_size` bytes.
+
+    Files up to `max_file_size` are memory mapped, so their pages are the page cache's and shared by
+    prefork workers instead of being copied, files smaller than a page are read. Larger files are kept
+    open and sent with `sendfile`. Files unused for `ttl` seconds are closed, the least recently used
+    ones are evicted when a bound is reached.
+
+    Entries are revalidated with a `stat` at most every `check_interval` seconds and reloaded
+    when their mtime, size or inode, or their precompressed sidecars changed.
+    Variants without a sidecar are compressed once, on first use.
+
+    Paths that are not found are remembered for `not_found_ttl` seconds, so repeated misses
+    (e.g. scanners probing for `/wp-admin`) don't touch the file system.
+
+    A mapped file truncated in place while it is being sent crashes the process with SIGBUS,
+    static files should be replaced by renaming new files over them.
+    """
+    max_size: int
+    max_file_size: int
+    max_entries: int
+    ttl: float
+    check_interval: float
+    max_not_found: int
+    not_found_ttl: float
+
+    entries: collections.OrderedDict[str, CachedFile]
+    not_found: collections.OrderedDict[str, float]
+    """Expiry time of the paths that were not found, in order of expiry"""
+    size: int
+    lock: threading.Lock
+
+    hits: int
+    misses: int
+    not_found_hits: int
+    evictions: int
+    invalidations: int
+
+    def __init__(self: typing.Self,
+                 max_size: int = 64 * 1024 * 1024,
+                 max_file_size: int = 1024 * 1024,
+                 max_entries: int = 1024,
+                 ttl: float = 60.0,
+                 check_interval: float = 1.0,
+                 max_not_found: int = 10_000,
+                 not_found_ttl: float = 5.0) -> None:
+        self.max_size = max_size
+        self.max_file_size = max_file_size
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self.max_not_found = max_not_found
+        self.not_found_ttl = not_found_ttl
+
+        self.entries = collections.OrderedDict()
+        self.not_found = collections.OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.not_found_hits = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self: typing.Self, path: str, root: str | None = None) -> CachedFile | None:
+        """
+        Returns the cached file at `path`, loading it on a miss.
+
+        Returns `None` if `path` is not a regular file or, with a `root`, if its real path is outside
+        of `root`. Raises `IsADirectoryError` if it is a directory, which has no entry.
+        """
+        now = time.monotonic()
+
+        with self.lock:
+            self.expire(now)
+            entry = self.entries.get(path)
+
+            if entry is not None and now - entry.checked_at < self.check_interval:
+                self.entries.move_to_end(path)
+                entry.used_at = now
+                self.hits += 1
+                return entry
+
+            if entry is None and path in self.not_found:
+                self.not_found_hits += 1
+                return None
+
+        try:
+            file_stat = os.stat(path)
+        except OSError:
+            self.discard(path)
+            self.remember_not_found(path, now)
+            return None
+
+        if entry is not None and not entry.is_stale(file_stat):
+            with self.lock:
+                entry.checked_at = entry.used_at = now
+                if path in self.entries:
+                    self.entries.move_to_end(path)
+                self.hits += 1
+            return entry
+
+        if entry is not None:
+            self.discard(path)
+            with self.lock:
+                self.invalidations += 1
+
+        # Only checked when a file is loaded, a symlink pointed elsewhere since changes the inode
+        if root is not None and not within(root, path):
+            self.remember_not_found(path, now)
+            return None
+
+        if stat.S_ISDIR(file_stat.st_mode):
+            raise IsADirectoryError(path)
+
+        if not stat.S_ISREG(file_stat.st_mode):
+            self.remember_not_found(path, now)
+            return None
+
+        try:
+            entry = self.load(path, now)
+        except OSError:
+            return None
+
+        with self.lock:
+            self.misses += 1
+            self.insert(entry)
+
+        return entry
+
+    def load(self: typing.Self, path: str, now: float) -> CachedFile:
+        file = open(path, "rb")
+
+        try:
+            file_stat = os.fstat(file.fileno())
+            sidecars = fresh_sidecars(path, file_stat)
+            variants: dict[str, bytes] = {}
+
+            if file_stat.st_size < mmap.PAGESIZE:
+                data = file.read()
+            elif file_stat.st_size <= self.max_file_size:
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                data = None
+
+            # Sidecars of the open files are sent from their own file too
+            if data is not None:
+                for coding in sidecars:
+                    with open(sidecar_path(path, coding), "rb") as sidecar:
+                        variants[coding] = sidecar.read()
+        except BaseException:
+            file.close()
+            raise
+
+        if data is not None:
+            # A mapping holds its own descriptor
+            file.close()
+
+        return CachedFile(
+            path=path,
+            data=data,
+            file=file if data is None else None,
+            content_type=mimetypes.guess_type(path)[0],
+            file_stat=file_stat,
+            last_modified=http_date(file_stat.st_mtime),
+            etag=make_etag(file_stat),
+            checked_at=now,
+            used_at=now,
+            variants=variants,
+            sidecars=sidecars,
+        )
+
+    def get_variant(self: typing.Self, entry: CachedFile, coding: str, level: int | None = None) -> bytes:
+        """Body of `entry` encoded with `coding`, from its sidecar or compressed on first use only"""
+        if (variant:=entry.variants.get(coding)) is None:
+            variant = compress(bytes(entry.data), coding, level)
+
+            with self.lock:
+                if coding not in entry.variants and self.entries.get(entry.path) is entry:
+                    entry.variants[coding] = variant
+                    self.size += len(variant)
+                    self.evict()
+
+        return variant
+
+    def file_body(self: typing.Self, entry: CachedFile, offset: int, length: int) -> FileBody:
+        """Body sending `length` bytes of the open file of `entry` from `offset`"""
+        with self.lock:
+            if not entry.file.closed:
+                entry.users += 1
+                return FileBody(entry.file, offset, length, functools.partial(self.release, entry))
+
+        # Dropped and closed by another thread since it was looked up
+        return FileBody(open(entry.path, "rb"), offset, length)
+
+    def release(self: typing.Self, entry: CachedFile) -> None:
+        with self.lock:
+            entry.users -= 1
+
+            if entry.dropped and entry.users == 0:
+                entry.file.close()
+
+    def insert(self: typing.Self, entry: CachedFile) -> None:
+        if (old_entry:=self.entries.pop(entry.path, None)) is not None:
+            self.size -= old_entry.size
+            self.drop(old_entry)
+
+        self.not_found.pop(entry.path, None)
+        self.entries[entry.path] = entry
+        self.size += entry.size
+        self.evict()
+
+    def evict(self: typing.Self) -> None:
+        while (self.size > self.max_size or len(self.entries) > self.max_entries) and len(self.entries) != 0:
+            _, entry = self.entries.popitem(last=False)
+            self.size -= entry.size
+            self.evictions += 1
+            self.drop(entry)
+
+    def expire(self: typing.Self, now: float) -> None:
+        """Drops the files unused for `ttl` seconds and the expired not found paths, both are kept oldest first"""
+        while len(self.entries) != 0 and now - (entry:=next(iter(self.entries.values()))).used_at >= self.ttl:
+            del self.entries[entry.path]
+            self.size -= entry.size
+            self.drop(entry)
+
+        while len(self.not_found) != 0 and next(iter(self.not_found.values())) <= now:
+            self.not_found.popitem(last=False)
+
+    def drop(self: typing.Self, entry: CachedFile) -> None:
+        """Closes the file of an entry taken out of the cache, once no response sends from it anymore"""
+        entry.dropped = True
+
+        if entry.file is not None and entry.users == 0:
+            entry.file.close()
+
+        # Mappings are unmapped when the last response holding their data is gone
+
+    def remember_not_found(self: typing.Self, path: str, now: float) -> None:
+        with self.lock:
+            self.not_found.pop(path, None)
+            self.not_found[path] = now + self.not_found_ttl
+
+            while len(self.not_found) > self.max_not_found:
+                self.not_found.popitem(last=False)
+
+    def discard(self: typing.Self, path: str) -> None:
+        with self.lock:
+            if (entry:=self.entries.pop(path, None)) is not None:
+                self.size -= entry.size
+                self.drop(entry)
+
+    def clear(self: typing.Self) -> None:
+        with self.lock:
+            for entry in self.entries.values():
+                self.drop(entry)
+
+            self.entries.clear()
+            self.not_found.clear()
+            self.size = 0
+
+    def stats(self: typing.Self) -> dict[str, int | float]:
+        with self.lock:
+            lookups = self.hits + self.misses
+
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "open_files": sum(entry.file is not None for entry in self.entries.values()),
+                "size": self.size,
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups != 0 else 0.0,
+                "not_found_entries": len(self.not_found),
+                "not_found_hits": self.not_found_hits,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,224 @@
+"""
+Content codings
+
+Compression helpers shared by the handler and the `compress` command, which writes precompressed
+sidecar files (`foo.js.gz`, `foo.js.br`, `foo.js.zst`) next to the static files of a document root.
+Brotli and Zstandard are only available if the `brotli` and `zstandard` packages are installed.
+"""
+from __future__ import annotations
+
+import argparse
+import concurrent.futures
+import dataclasses
+import gzip
+import mimetypes
+import os
+import typing
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SIDECAR_EXTENSIONS: typing.Final[dict[str, str]] = {"br": ".br", "zstd": ".zst", "gzip": ".gz"}
+"""Content coding of each sidecar extension, in order of preference"""
+
+DYNAMIC_CODINGS: typing.Final[tuple[str, ...]] = ("br", "zstd", "gzip", "deflate")
+"""Content codings that can be applied on the fly, in order of preference"""
+
+COMPRESSIBLE_TYPES: typing.Final[frozenset[str]] = frozenset({
+    "application/javascript", "application/json", "application/manifest+json", "application/wasm",
+    "application/xml", "application/xhtml+xml", "application/x-javascript", "font/otf", "font/ttf",
+    "image/bmp", "image/svg+xml", "image/vnd.microsoft.icon", "image/x-icon",
+})
+
+def is_compressible(content_type: str | None) -> bool:
+    """Whether a body of `content_type` is worth compressing, media and archives already are compressed"""
+    if content_type is None:
+        return False
+
+    content_type = content_type.split(";")[0].strip().lower()
+
+    return content_type.startswith("text/") or content_type in COMPRESSIBLE_TYPES or content_type.endswith(("+json", "+xml"))
+
+def is_available(coding: str) -> bool:
+    match coding:
+        case "br":
+            return brotli is not None
+        case "zstd":
+            return zstandard is not None
+    
+    return coding in ("gzip", "deflate")
+
+def available_codings() -> tuple[str, ...]:
+    """Content codings the `compress` command can write sidecars for"""
+    return tuple(filter(is_available, SIDECAR_EXTENSIONS))
+
+def compress(data: bytes, coding: str, level: int | None = None) -> bytes:
+    match coding:
+        case "gzip":
+            return gzip.compress(data, level if level is not None else 9)
+        case "deflate":
+            # HTTP's deflate coding is the zlib format, not raw deflate
+            return zlib.compress(data, level if level is not None else 9)
+        case "br" if brotli is not None:
+            return brotli.compress(data, quality=level if level is not None else 11)
+        case "zstd" if zstandard is not None:
+            return zstandard.ZstdCompressor(level=level if level is not None else 19).compress(data)
+
+    raise ValueError(f"Content coding {coding!r} is not available!")
+
+def parse_accept_encoding(accept_encoding: str | None) -> dict[str, float]:
+    """Quality value of each content coding listed in an `Accept-Encoding` header"""
+    qualities: dict[str, float] = {}
+
+    if accept_encoding is None:
+        return qualities
+
+    for element in accept_encoding.split(","):
+        coding, *params = element.split(";")
+        if len(coding:=coding.strip().lower()) == 0:
+            continue
+
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = min(max(float(value), 0.0), 1.0)
+                except ValueError:
+                    quality = 0.0
+
+        # "x-gzip" is an alias of "gzip" (RFC 9110 8.4.1.3)
+        qualities["gzip" if coding == "x-gzip" else coding] = quality
+
+    return qualities
+
+def negotiate(accept_encoding: str | None, candidates: typing.Iterable[str]) -> str | None:
+    """
+    Picks the content coding of `candidates` with the highest quality value, ties are broken by the
+    order of `candidates`. Returns `None` if the body should be sent without a content coding.
+    """
+    qualities = parse_accept_encoding(accept_encoding)
+    wildcard = qualities.get("*", 0.0)
+
+    best: str | None = None
+    best_quality = 0.0
+    for coding in candidates:
+        if (quality:=qualities.get(coding, wildcard)) > best_quality:
+            best, best_quality = coding, quality
+
+    # An explicitly preferred identity wins over compressing
+    if best is not None and qualities.get("identity", 0.0) > best_quality:
+        return None
+
+    return best
+
+@dataclasses.dataclass
+class CompressionPolicy:
+    """Decides which bodies get compressed on the fly and at which level"""
+    min_size: int = 1024
+    """Smaller bodies are sent as they are, the framing overhead would eat most of the gain"""
+    default_levels: dict[str, int] = dataclasses.field(default_factory=lambda: {"gzip": 6, "deflate": 6, "br": 5, "zstd": 3})
+    levels: dict[str, dict[str, int]] = dataclasses.field(default_factory=dict)
+    """Levels by MIME type (e.g. `{"application/javascript": {"gzip": 9}}`) overriding `default_levels`"""
+
+    def should_compress(self: typing.Self, content_type: str | None, size: int) -> bool:
+        return size >= self.min_size and is_compressible(content_type)
+
+    def level(self: typing.Self, content_type: str | None, coding: str) -> int | None:
+        if content_type is not None and (level:=self.levels.get(content_type.split(";")[0].strip().lower(), {}).get(coding)) is not None:
+            return level
+
+        return self.default_levels.get(coding)
+
+    def codings(self: typing.Self) -> tuple[str, ...]:
+        return tuple(filter(is_available, DYNAMIC_CODINGS))
+
+def sidecar_path(path: str, coding: str) -> str:
+    return path + SIDECAR_EXTENSIONS[coding]
+
+def is_sidecar(path: str) -> bool:
+    return path.endswith(tuple(SIDECAR_EXTENSIONS.values()))
+
+def fresh_sidecars(path: str, file_stat: os.stat_result) -> dict[str, os.stat_result]:
+    """Sidecars of `path` that are at least as new as the file itself, by content coding"""
+    sidecars: dict[str, os.stat_result] = {}
+
+    for coding in SIDECAR_EXTENSIONS:
+        try:
+            sidecar_stat = os.stat(sidecar_path(path, coding))
+        except OSError:
+            continue
+
+        if sidecar_stat.st_mtime_ns >= file_stat.st_mtime_ns:
+            sidecars[coding] = sidecar_stat
+
+    return sidecars
+
+def write_sidecars(path: str, codings: tuple[str, ...], min_size: int) -> list[str]:
+    """Writes the missing or outdated sidecars of `path`, keeping only the ones smaller than the file itself"""
+    file_stat = os.stat(path)
+    if file_stat.st_size < min_size:
+        return []
+
+    fresh = fresh_sidecars(path, file_stat)
+    written: list[str] = []
+
+    with open(path, "rb") as file:
+        data = file.read()
+
+    for coding in codings:
+        if coding in fresh:
+            continue
+
+        compressed = compress(data, coding)
+        if len(compressed) >= len(data):
+            continue
+
+        tmp_path = sidecar_path(path, coding) + ".tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(compressed)
+        os.replace(tmp_path, sidecar_path(path, coding))
+
+        written.append(sidecar_path(path, coding))
+
+    return written
+
+def compress_command(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="compress", description="Writes precompressed sidecars of the static files in a document root")
+    parser.add_argument("root", help="document root to walk")
+    parser.add_argument("--codings", nargs="+", choices=SIDECAR_EXTENSIONS, default=list(available_codings()))
+    parser.add_argument("--jobs", type=int, default=None, help="number of compressing processes")
+    parser.add_argument("--min-size", type=int, default=256, help="smaller files are not worth compressing")
+    args = parser.parse_args(argv)
+
+    if len(missing:=set(args.codings) - set(available_codings())) != 0:
+        parser.error(f"content coding(s) not available, install the matching package: {', '.join(missing)}")
+
+    paths: list[str] = []
+    for dirpath, _, filenames in os.walk(args.root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+
+            if not is_sidecar(path) and not path.endswith(".tmp") and is_compressible(mimetypes.guess_type(path)[0]):
+                paths.append(path)
+
+    with concurrent.futures.ProcessPoolExecutor(args.jobs) as executor:
+        futures = {executor.submit(write_sidecars, path, tuple(args.codings), args.min_size): path for path in paths}
+
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                for written in future.result():
+                    print(f"[INFO]: Wrote {written}")
+            except OSError as e:
+                print(f"[ERROR]: {futures[future]}: {e}")
+
+if __name__ == "__main__":
+    compress_command()
@@ -0,0 +1,103 @@
+"""
+Conditional requests and caching
+
+Validators (`ETag`, `Last-Modified`) derived from the stat data of static files, evaluation of
+`If-None-Match`/`If-Modified-Since` and the `Cache-Control` policy of the handler.
+"""
+from __future__ import annotations
+
+import dataclasses
+import email.utils
+import fnmatch
+import os
+import typing
+
+def make_etag(file_stat: os.stat_result, coding: str | None = None, weak: bool = False) -> str:
+    """
+    Entity tag of a static file, built from its mtime and size so it never needs the file content.
+
+    Strong tags differ for every content coding, as each one is a different representation,
+    weak ones are shared by all of them.
+    """
+    opaque = f"{file_stat.st_mtime_ns:x}-{file_stat.st_size:x}"
+
+    if weak:
+        return f'W/"{opaque}"'
+
+    return f'"{opaque}-{coding}"' if coding is not None else f'"{opaque}"'
+
+def http_date(timestamp: float) -> str:
+    return email.utils.formatdate(timestamp, usegmt=True)
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Weak comparison (RFC 9110 8.8.3.2) of `etag` against the list of an `If-None-Match` header"""
+    if if_none_match.strip() == "*":
+        return True
+
+    opaque = etag.removeprefix("W/")
+
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+def is_not_modified(if_none_match: str | None, if_modified_since: str | None, etag: str, mtime: float) -> bool:
+    """Whether a `304 Not Modified` can be sent instead of the representation, `If-None-Match` takes precedence"""
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+
+    if if_modified_since is None:
+        return False
+
+    try:
+        since = email.utils.parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+
+    # HTTP dates have a one second resolution
+    return int(mtime) <= since.timestamp()
+
+def if_range_matches(if_range: str, etag: str, mtime: float) -> bool:
+    """
+    Whether the representation a client holds a part of is still the current one, so the
+    `Range` of the request applies. Entity tags are compared strongly, dates exactly.
+    """
+    if_range = if_range.strip()
+
+    if if_range.startswith(('"', "W/")):
+        return not etag.startswith("W/") and if_range == etag
+
+    try:
+        return int(mtime) == email.utils.parsedate_to_datetime(if_range).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+@dataclasses.dataclass
+class CachePolicy:
+    """
+    Decides the `Cache-Control` of successful static responses.
+
+    `paths` are glob patterns of the target (e.g. `{"css/*": "public, max-age=86400"}`), `types` are MIME
+    types, possibly with a wildcard subtype (e.g. `{"image/*": "public, max-age=604800, immutable"}`).
+    The first matching path wins over the MIME type, anything else gets `default`.
+    """
+    paths: dict[str, str] = dataclasses.field(default_factory=dict)
+    types: dict[str, str] = dataclasses.field(default_factory=dict)
+    default: str | None = "no-cache"
+    """Lets clients keep the files but revalidate them on every use, which mostly costs a bodyless 304"""
+    weak_etags: bool = False
+
+    def cache_control(self: typing.Self, path: str, content_type: str | None) -> str | None:
+        for pattern, directives in self.paths.items():
+            if fnmatch.fnmatchcase(path, pattern):
+                return directives
+
+        if content_type is not None:
+            content_type = content_type.split(";")[0].strip().lower()
+
+            if (directives:=self.types.get(content_type)) is not None:
+                return directives
+            if (directives:=self.types.get(content_type.split("/")[0] + "/*")) is not None:
+                return directives
+
+        return self.default
+
+    def etag(self: typing.Self, file_stat: os.stat_result, coding: str | None) -> str:
+        return make_etag(file_stat, coding, self.weak_etags)
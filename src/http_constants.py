@@ -1,12 +1,16 @@
 from typing import Final, Literal
 
+from http import HTTPStatus
+
 OCTET: Final[tuple[bytes]]   = tuple(octet.to_bytes() for octet in range(256))
 CHAR: Final[tuple[bytes]]    = OCTET[:128]
 UPALPHA: Final[tuple[bytes]] = tuple(filter(bytes.isupper, CHAR))
 LOALPHA: Final[tuple[bytes]] = tuple(filter(bytes.islower, CHAR))
 ALPHA: Final[tuple[bytes]]   = UPALPHA + LOALPHA
-DIGIT: Final[tuple[bytes]]   = tuple((i.to_bytes() for i in range(10)))
+DIGIT: Final[tuple[bytes]]   = tuple(filter(bytes.isdigit, CHAR))
 CTL: Final[tuple[bytes]]     = CHAR[0:32] + (CHAR[127],)
+VCHAR: Final[tuple[bytes]]   = CHAR[33:127]
+OBS_TEXT: Final[tuple[bytes]] = OCTET[128:]
 CR: Literal[b'\r']           = b'\r'
 LF: Literal[b'\n']           = b'\n'
 SP: Literal[b' ']            = b' '
@@ -14,9 +18,15 @@ HT: Literal[b'\t']           = b'\t'
 DQ: Literal[b'\"']           = b'"'
 CRLF: Literal[b'\r\n']       = CR + LF
 HEX: Final[tuple[bytes]]     = b'A' , b'B' , b'C' , b'D' , b'E' , b'F' , b'a' , b'b' , b'c' , b'd' , b'e' , b'f' , *DIGIT
+TCHAR: Final[tuple[bytes]]   = b'!' , b'#' , b'$' , b'%' , b'&' , b"'" , b'*' , b'+' , b'-' , b'.' , b'^' , b'_' , b'`' , b'|' , b'~' , *DIGIT , *ALPHA
+"""Characters of a token (RFC 9110 5.6.2), e.g. a method or a header name"""
 
 class HTTPError(Exception):
-    pass
+    status: HTTPStatus
+
+    def __init__(self, *args: object, status: HTTPStatus = HTTPStatus.BAD_REQUEST) -> None:
+        super().__init__(*args)
+        self.status = status
 
 NOT_FOUND_PAGE_PATH = "not_found.html"
 NOT_FOUND_PAGE = """
@@ -0,0 +1,146 @@
+"""
+Connection deadlines
+
+A connection has one deadline at a time, for the phase it is in: completing its TLS handshake,
+waiting for its next request, receiving a request head or body, or sending a response. The deadlines
+of all connections of a server are kept in a single heap that the engine checks periodically,
+instead of a timeout on every socket. Pushing a deadline back only updates its entry, the heap entry
+left behind is moved when it comes out on top, so a transfer making progress costs no heap operation.
+
+A head has to arrive within a fixed time from the start of its phase, however the client slices it.
+Bodies and responses may take as long as they need while they keep moving: their deadline is the
+phase's timeout after the last progress, and at the latest the timeout plus the time the bytes
+transferred so far take at the minimum rate, so a client trickling a byte now and then is cut off
+once it falls behind that rate.
+"""
+from __future__ import annotations
+
+import dataclasses
+import enum
+import heapq
+import itertools
+import threading
+import time
+import typing
+
+class Phase(enum.StrEnum):
+    HANDSHAKE = "handshake"
+    IDLE = "idle"
+    HEAD = "head"
+    BODY = "body"
+    WRITE = "write"
+
+RATED_PHASES: typing.Final[frozenset[Phase]] = frozenset((Phase.BODY, Phase.WRITE))
+"""Phases whose deadline moves with the bytes transferred"""
+
+@dataclasses.dataclass(slots=True)
+class Deadline:
+    phase: Phase
+    timeout: float
+    min_rate: int
+    """Bytes per second the transfer has to average once its timeout passed, 0 for no minimum"""
+    started: float
+    last: float
+    """Last progress of the transfer"""
+    transferred: int = 0
+
+    due: float = 0.0
+    scheduled: float | None = None
+    """Time of the heap entry of the deadline, at most `due`"""
+
+    def update(self: typing.Self) -> None:
+        if self.phase not in RATED_PHASES:
+            self.due = self.started + self.timeout
+        elif self.min_rate == 0:
+            self.due = self.last + self.timeout
+        else:
+            self.due = min(self.last + self.timeout, self.started + self.timeout + self.transferred / self.min_rate)
+
+class Deadlines[K]:
+    """
+    The deadlines of a server's connections, `K` being whatever the engine keeps per connection.
+
+    Engines with worker threads set them from the workers while their loop takes the expired
+    ones, every method holds a lock.
+    """
+    heap: list[tuple[float, int, K]]
+    entries: dict[K, Deadline]
+    counter: typing.Iterator[int]
+    """Orders heap entries due at the same time, the keys themselves needn't be comparable"""
+    lock: threading.Lock
+
+    def __init__(self: typing.Self) -> None:
+        self.heap = []
+        self.entries = {}
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+    def __len__(self: typing.Self) -> int:
+        return len(self.entries)
+
+    def start(self: typing.Self, key: K, phase: Phase, timeout: float, min_rate: int = 0, now: float | None = None) -> None:
+        """Replaces the deadline of `key` with the one of `phase`, which starts `now`"""
+        now = time.monotonic() if now is None else now
+        deadline = Deadline(phase, timeout, min_rate, now, now)
+        deadline.update()
+
+        with self.lock:
+            if (previous:=self.entries.get(key)) is not None:
+                deadline.scheduled = previous.scheduled
+
+            self.entries[key] = deadline
+            self.schedule(key, deadline)
+
+    def progress(self: typing.Self, key: K, size: int, now: float | None = None) -> None:
+        """Records `size` more bytes transferred in the current phase of `key`, which only ever moves its deadline back"""
+        with self.lock:
+            if (deadline:=self.entries.get(key)) is not None and deadline.phase in RATED_PHASES:
+                deadline.transferred += size
+                deadline.last = time.monotonic() if now is None else now
+                deadline.update()
+
+    def phase(self: typing.Self, key: K) -> Phase | None:
+        with self.lock:
+            return deadline.phase if (deadline:=self.entries.get(key)) is not None else None
+
+    def keys(self: typing.Self, phase: Phase) -> list[K]:
+        """Keys whose current deadline is the one of `phase`"""
+        with self.lock:
+            return [key for key, deadline in self.entries.items() if deadline.phase is phase]
+
+    def cancel(self: typing.Self, key: K) -> None:
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def expired(self: typing.Self, now: float | None = None) -> list[tuple[K, Phase]]:
+        """Takes the deadlines that passed, with the phase each one was set for"""
+        now = time.monotonic() if now is None else now
+        expired: list[tuple[K, Phase]] = []
+
+        with self.lock:
+            while len(self.heap) != 0 and self.heap[0][0] <= now:
+                scheduled, _, key = heapq.heappop(self.heap)
+
+                # Cancelled, or replaced by an earlier entry
+                if (deadline:=self.entries.get(key)) is None or deadline.scheduled != scheduled:
+                    continue
+
+                if deadline.due <= now:
+                    del self.entries[key]
+                    expired.append((key, deadline.phase))
+                else:
+                    deadline.scheduled = None
+                    self.schedule(key, deadline)
+
+        return expired
+
+    def schedule(self: typing.Self, key: K, deadline: Deadline) -> None:
+        """Adds a heap entry if the deadline comes before the one it has"""
+        if deadline.scheduled is None or deadline.due < deadline.scheduled:
+            deadline.scheduled = deadline.due
+            heapq.heappush(self.heap, (deadline.due, next(self.counter), key))
+
+            # Entries left behind by cancelled and replaced deadlines would otherwise pile up until they come due
+            if len(self.heap) > 2 * len(self.entries) + 1024:
+                self.heap = [(entry.scheduled, next(self.counter), entry_key) for entry_key, entry in self.entries.items()]
+                heapq.heapify(self.heap)
@@ -0,0 +1,926 @@
+"""
+HTTP/2 (RFC 9113)
+
+`H2Connection` is the protocol state of a connection without any I/O: the engine feeds it the bytes
+it received and gets back the streams whose request is complete, answers them with `send_response`
+and sends what `data_to_send` returns. So every engine runs HTTP/2 the same way it runs HTTP/1.1,
+just with many requests in flight on one connection.
+
+Responses are the ones of `HTTPHandler`, their head is turned into a HEADERS frame compressed with
+HPACK and their body (bytes, a file or a stream) is cut into DATA frames within the flow control
+windows of the client, taking turns between the streams so a large download doesn't hold up the
+small responses next to it.
+
+Connections start with the client's preface: after ALPN selected `h2` on TLS, by prior knowledge on
+a cleartext connection or after a cleartext HTTP/1.1 request asked to upgrade to `h2c`.
+"""
+from __future__ import annotations
+
+import collections
+import dataclasses
+import enum
+import struct
+import time
+import typing
+
+from http import HTTPStatus
+
+import http_hpack
+from http_body import RequestBody
+from http_constants import HTTPError
+from http_message import HTTPRequest, HTTPResponse
+from http_metrics import RequestTiming
+from http_parser import METHODS, TARGET, TOKEN, split_target
+
+PREFACE: typing.Final[bytes] = b"PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n"
+PREFACE_HEAD: typing.Final[bytes] = b"PRI * HTTP/2.0\r\n"
+"""Start of the preface as `RequestReader.next_head` cuts it out, a client speaking HTTP/2 by prior knowledge"""
+
+SWITCHING_PROTOCOLS: typing.Final[bytes] = b"HTTP/1.1 101 Switching Protocols\r\nConnection: Upgrade\r\nUpgrade: h2c\r\n\r\n"
+
+FRAME_HEADER: typing.Final[struct.Struct] = struct.Struct(">HBBBI")
+"""Length (as 16 high and 8 low bits), type, flags and stream id of a frame"""
+FRAME_HEADER_SIZE: typing.Final[int] = 9
+
+DEFAULT_WINDOW_SIZE: typing.Final[int] = 65_535
+MAX_WINDOW_SIZE: typing.Final[int] = 2**31 - 1
+DEFAULT_FRAME_SIZE: typing.Final[int] = 16_384
+MAX_FRAME_SIZE: typing.Final[int] = 2**24 - 1
+
+CONNECTION_HEADERS: typing.Final[frozenset[str]] = frozenset({"connection", "keep-alive", "proxy-connection", "transfer-encoding", "upgrade"})
+"""Headers of HTTP/1.1 connections, malformed in an HTTP/2 request and dropped from responses (RFC 9113 8.2.2)"""
+
+class FrameType(enum.IntEnum):
+    DATA = 0x0
+    HEADERS = 0x1
+    PRIORITY = 0x2
+    RST_STREAM = 0x3
+    SETTINGS = 0x4
+    PUSH_PROMISE = 0x5
+    PING = 0x6
+    GOAWAY = 0x7
+    WINDOW_UPDATE = 0x8
+    CONTINUATION = 0x9
+
+class Flag(enum.IntFlag):
+    END_STREAM = 0x1
+    ACK = 0x1
+    END_HEADERS = 0x4
+    PADDED = 0x8
+    PRIORITY = 0x20
+
+class ErrorCode(enum.IntEnum):
+    NO_ERROR = 0x0
+    PROTOCOL_ERROR = 0x1
+    INTERNAL_ERROR = 0x2
+    FLOW_CONTROL_ERROR = 0x3
+    SETTINGS_TIMEOUT = 0x4
+    STREAM_CLOSED = 0x5
+    FRAME_SIZE_ERROR = 0x6
+    REFUSED_STREAM = 0x7
+    CANCEL = 0x8
+    COMPRESSION_ERROR = 0x9
+    CONNECT_ERROR = 0xa
+    ENHANCE_YOUR_CALM = 0xb
+    INADEQUATE_SECURITY = 0xc
+    HTTP_1_1_REQUIRED = 0xd
+
+class Setting(enum.IntEnum):
+    HEADER_TABLE_SIZE = 0x1
+    ENABLE_PUSH = 0x2
+    MAX_CONCURRENT_STREAMS = 0x3
+    INITIAL_WINDOW_SIZE = 0x4
+    MAX_FRAME_SIZE = 0x5
+    MAX_HEADER_LIST_SIZE = 0x6
+
+class H2Error(Exception):
+    """Connection error, answered with GOAWAY and closing the connection"""
+    code: ErrorCode
+
+    def __init__(self: typing.Self, code: ErrorCode, *args: object) -> None:
+        super().__init__(*args)
+        self.code = code
+
+class H2StreamError(H2Error):
+    """Stream error, answered with RST_STREAM while the other streams go on"""
+    stream_id: int
+
+    def __init__(self: typing.Self, stream_id: int, code: ErrorCode, *args: object) -> None:
+        super().__init__(code, *args)
+        self.stream_id = stream_id
+
+def frame(frame_type: FrameType, flags: int, stream_id: int, payload: bytes | memoryview = b"") -> bytes:
+    return FRAME_HEADER.pack(len(payload) >> 8, len(payload) & 0xff, frame_type, flags, stream_id) + payload
+
+def parse_settings(payload: bytes) -> list[tuple[int, int]]:
+    return [struct.unpack_from(">HI", payload, offset) for offset in range(0, len(payload), 6)]
+
+@dataclasses.dataclass(eq=False)
+class H2Stream:
+    """A request and its response on a connection"""
+    id: int
+    request: HTTPRequest
+    timing: RequestTiming
+    send_window: int
+    recv_window: int
+
+    content_length: int | None          = dataclasses.field(default=None)
+    body_received: int                  = dataclasses.field(default=0)
+    remote_closed: bool                 = dataclasses.field(default=False)
+    """Whether the request is complete, the client sent END_STREAM"""
+    local_closed: bool                  = dataclasses.field(default=False)
+    answered: bool                      = dataclasses.field(default=False)
+    """Whether the stream was handed to the engine or answered with an error, it is never handed over again"""
+    discard_body: bool                  = dataclasses.field(default=False)
+    """Answered before the request was complete (e.g. a too large body), the rest of it is dropped"""
+
+    response: HTTPResponse | None       = dataclasses.field(default=None)
+    error: HTTPError | None             = dataclasses.field(default=None)
+    """Error the request was answered with instead of a response of the handler"""
+    chunks: collections.deque[memoryview] = dataclasses.field(default_factory=collections.deque)
+    """Body bytes produced but not framed yet"""
+    source: typing.Iterator[bytes] | None = dataclasses.field(default=None)
+    """Produces the body as it is sent, `None` if it is pushed with `send_data` instead"""
+    source_done: bool                   = dataclasses.field(default=True)
+    remaining: int | None               = dataclasses.field(default=None)
+    """Body bytes left to send if the length is known, so END_STREAM goes on the last DATA frame"""
+    trailers: list[tuple[str, str]]     = dataclasses.field(default_factory=list)
+
+    served: int                         = dataclasses.field(default=0)
+    """Number of the request on its connection, set by the engine"""
+
+    @property
+    def buffered(self: typing.Self) -> int:
+        return sum(map(len, self.chunks))
+
+class H2Connection:
+    """
+    Protocol state of an HTTP/2 connection, without I/O.
+
+    The server's limits go into its SETTINGS: `max_concurrent_streams` requests in flight (more are
+    refused with REFUSED_STREAM), header lists up to `max_header_list_size` bytes (larger requests get
+    431) and request bodies up to `max_body_size` (413), spooled to disk above `spool_threshold`.
+    Received DATA is credited back right away since it goes straight into the request body.
+
+    Raises nothing, a connection error queues a GOAWAY and sets `terminated`, after which the engine
+    sends the remaining output and closes the connection.
+    """
+    max_concurrent_streams: int
+    max_header_list_size: int
+    max_body_size: int
+    spool_threshold: int
+
+    decoder: http_hpack.Decoder
+    encoder: http_hpack.Encoder
+
+    buffer: bytearray
+    preface_received: bool
+    settings_received: bool
+    continuation: tuple[int, int, bytearray] | None
+    """Stream id, flags and header block so far of a HEADERS frame waiting for its CONTINUATION frames"""
+
+    streams: dict[int, H2Stream]
+    sending: collections.deque[H2Stream]
+    """Answered streams with body left to send, in the order they take turns"""
+    finished: list[H2Stream]
+    """Streams whose response was fully queued since the last `take_finished`"""
+    last_stream_id: int
+
+    output: bytearray
+    """Frames queued ahead of any DATA frame"""
+    send_window: int
+    initial_send_window: int
+    max_send_frame_size: int
+    recv_window: int
+    recv_credit: int
+    """Bytes received on the connection since the last connection WINDOW_UPDATE"""
+
+    goaway_sent: bool
+    goaway_received: bool
+    terminated: bool
+    error: H2Error | None
+
+    def __init__(self: typing.Self,
+                 max_concurrent_streams: int = 100,
+                 max_header_list_size: int = 16 * 1024,
+                 max_body_size: int = 1024 * 1024 * 1024,
+                 spool_threshold: int = 1024 * 1024,
+                 recv_window: int = 1024 * 1024) -> None:
+        self.max_concurrent_streams = max_concurrent_streams
+        self.max_header_list_size = max_header_list_size
+        self.max_body_size = max_body_size
+        self.spool_threshold = spool_threshold
+
+        self.decoder = http_hpack.Decoder()
+        self.encoder = http_hpack.Encoder()
+
+        self.buffer = bytearray()
+        self.preface_received = False
+        self.settings_received = False
+        self.continuation = None
+
+        self.streams = {}
+        self.sending = collections.deque()
+        self.finished = []
+        self.last_stream_id = 0
+
+        self.output = bytearray()
+        self.send_window = DEFAULT_WINDOW_SIZE
+        self.initial_send_window = DEFAULT_WINDOW_SIZE
+        self.max_send_frame_size = DEFAULT_FRAME_SIZE
+        self.recv_window = recv_window
+        self.recv_credit = 0
+
+        self.goaway_sent = False
+        self.goaway_received = False
+        self.terminated = False
+        self.error = None
+
+        settings = (
+            (Setting.MAX_CONCURRENT_STREAMS, max_concurrent_streams),
+            (Setting.INITIAL_WINDOW_SIZE, recv_window),
+            (Setting.ENABLE_PUSH, 0),
+            (Setting.MAX_HEADER_LIST_SIZE, max_header_list_size),
+        )
+        self.output += frame(FrameType.SETTINGS, 0, 0, b"".join(struct.pack(">HI", *setting) for setting in settings))
+
+        # The connection window can only be raised by a WINDOW_UPDATE
+        if recv_window > DEFAULT_WINDOW_SIZE:
+            self.output += frame(FrameType.WINDOW_UPDATE, 0, 0, struct.pack(">I", recv_window - DEFAULT_WINDOW_SIZE))
+
+    @property
+    def idle(self: typing.Self) -> bool:
+        """Whether no request is in flight and nothing is left to send"""
+        return len(self.streams) == 0 and len(self.output) == 0
+
+    @property
+    def done(self: typing.Self) -> bool:
+        """Whether the connection should be closed once the remaining output is sent"""
+        return self.terminated or ((self.goaway_sent or self.goaway_received) and len(self.streams) == 0)
+
+    def upgrade(self: typing.Self, settings: bytes, request: HTTPRequest, timing: RequestTiming) -> H2Stream:
+        """
+        Starts the connection as the upgrade of `request`, which becomes stream 1 and is answered on
+        it (RFC 7540 3.2). `settings` is the payload of the `HTTP2-Settings` header, which the client
+        doesn't expect an acknowledgement of.
+        """
+        try:
+            if len(settings) % 6 != 0:
+                raise H2Error(ErrorCode.FRAME_SIZE_ERROR, "Truncated setting!")
+
+            self.apply_settings(settings)
+        except H2Error as e:
+            raise HTTPError(f"Malformed HTTP2-Settings header: {e}") from None
+
+        request.version = (2, 0)
+        stream = self.streams[1] = H2Stream(1, request, timing, self.initial_send_window, 0, remote_closed=True, answered=True)
+        self.last_stream_id = 1
+
+        return stream
+
+    def receive(self: typing.Self, data: bytes) -> list[H2Stream]:
+        """Processes received bytes, returns the streams whose request just became complete"""
+        if self.terminated:
+            return []
+
+        self.buffer += data
+        ready: list[H2Stream] = []
+
+        try:
+            if not self.preface_received:
+                if len(self.buffer) < len(PREFACE):
+                    if not PREFACE.startswith(self.buffer):
+                        raise H2Error(ErrorCode.PROTOCOL_ERROR, "Invalid connection preface!")
+                    return ready
+                if not self.buffer.startswith(PREFACE):
+                    raise H2Error(ErrorCode.PROTOCOL_ERROR, "Invalid connection preface!")
+
+                del self.buffer[:len(PREFACE)]
+                self.preface_received = True
+
+            pos = 0
+            with memoryview(self.buffer) as view:
+                while len(self.buffer) - pos >= FRAME_HEADER_SIZE:
+                    length_high, length_low, frame_type, flags, stream_id = FRAME_HEADER.unpack_from(self.buffer, pos)
+                    length = length_high << 8 | length_low
+
+                    if length > DEFAULT_FRAME_SIZE:
+                        raise H2Error(ErrorCode.FRAME_SIZE_ERROR, f"Frame of {length} bytes exceeds the maximum frame size!")
+                    if len(self.buffer) - pos < FRAME_HEADER_SIZE + length:
+                        break
+
+                    payload = bytes(view[pos + FRAME_HEADER_SIZE:pos + FRAME_HEADER_SIZE + length])
+                    pos += FRAME_HEADER_SIZE + length
+
+                    try:
+                        if (stream:=self.process_frame(frame_type, flags, stream_id & MAX_WINDOW_SIZE, payload)) is not None:
+                            ready.append(stream)
+                    except H2StreamError as e:
+                        self.reset_stream(e.stream_id, e.code)
+
+                    if self.terminated:
+                        break
+
+            del self.buffer[:pos]
+        except H2Error as e:
+            self.goaway(e.code, e)
+        except http_hpack.HPACKError as e:
+            self.goaway(ErrorCode.COMPRESSION_ERROR, H2Error(ErrorCode.COMPRESSION_ERROR, e))
+
+        return ready
+
+    def process_frame(self: typing.Self, frame_type: int, flags: int, stream_id: int, payload: bytes) -> H2Stream | None:
+        if self.continuation is not None and (frame_type != FrameType.CONTINUATION or stream_id != self.continuation[0]):
+            raise H2Error(ErrorCode.PROTOCOL_ERROR, "Header block interrupted by another frame!")
+
+        if not self.settings_received and frame_type != FrameType.SETTINGS:
+            raise H2Error(ErrorCode.PROTOCOL_ERROR, "Connection preface not followed by SETTINGS!")
+
+        match frame_type:
+            case FrameType.DATA:
+                return self.receive_data(flags, stream_id, payload)
+            case FrameType.HEADERS:
+                return self.receive_headers(flags, stream_id, payload)
+            case FrameType.CONTINUATION:
+                return self.receive_continuation(flags, stream_id, payload)
+            case FrameType.PRIORITY:
+                # Priorities are deprecated (RFC 9113 5.3.2), the streams just take turns
+                self.check_stream_frame(stream_id, payload, 5)
+            case FrameType.RST_STREAM:
+                self.check_stream_frame(stream_id, payload, 4)
+                if stream_id > self.last_stream_id:
+                    raise H2Error(ErrorCode.PROTOCOL_ERROR, f"RST_STREAM on idle stream {stream_id}!")
+
+                self.close_stream(stream_id)
+            case FrameType.SETTINGS:
+                self.receive_settings(flags, stream_id, payload)
+            case FrameType.PING:
+                if stream_id != 0 or len(payload) != 8:
+                    raise H2Error(ErrorCode.FRAME_SIZE_ERROR if stream_id == 0 else ErrorCode.PROTOCOL_ERROR, "Malformed PING!")
+                if not flags & Flag.ACK:
+                    self.output += frame(FrameType.PING, Flag.ACK, 0, payload)
+            case FrameType.GOAWAY:
+                if stream_id != 0:
+                    raise H2Error(ErrorCode.PROTOCOL_ERROR, "GOAWAY on a stream!")
+
+                # Streams the server already accepted are still answered
+                self.goaway_received = True
+            case FrameType.WINDOW_UPDATE:
+                self.receive_window_update(stream_id, payload)
+            case FrameType.PUSH_PROMISE:
+                raise H2Error(ErrorCode.PROTOCOL_ERROR, "PUSH_PROMISE sent by a client!")
+
+        # Frames of unknown types are ignored (RFC 9113 5.5)
+        return None
+
+    def check_stream_frame(self: typing.Self, stream_id: int, payload: bytes, length: int) -> None:
+        if stream_id == 0:
+            raise H2Error(ErrorCode.PROTOCOL_ERROR, "Stream frame on stream 0!")
+        if len(payload) != length:
+            raise H2StreamError(stream_id, ErrorCode.FRAME_SIZE_ERROR, "Malformed frame!")
+
+    def unpad(self: typing.Self, flags: int, payload: bytes) -> bytes:
+        if not flags & Flag.PADDED:
+            return payload
+
+        if len(payload) == 0 or payload[0] >= len(payload):
+            raise H2Error(ErrorCode.PROTOCOL_ERROR, "Padding exceeds the frame!")
+
+        return payload[1:len(payload) - payload[0]]
+
+    def receive_settings(self: typing.Self, flags: int, stream_id: int, payload: bytes) -> None:
+        if stream_id != 0:
+            raise H2Error(ErrorCode.PROTOCOL_ERROR, "SETTINGS on a stream!")
+
+        if flags & Flag.ACK:
+            if len(payload) != 0:
+                raise H2Error(ErrorCode.FRAME_SIZE_ERROR, "SETTINGS acknowledgement with a payload!")
+            return
+
+        if len(payload) % 6 != 0:
+            raise H2Error(ErrorCode.FRAME_SIZE_ERROR, "Malformed SETTINGS!")
+
+        self.apply_settings(payload)
+        self.settings_received = True
+        self.output += frame(FrameType.SETTINGS, Flag.ACK, 0)
+
+    def apply_settings(self: typing.Self, payload: bytes) -> None:
+        for setting, value in parse_settings(payload):
+            match setting:
+                case Setting.HEADER_TABLE_SIZE:
+                    self.encoder.set_max_table_size(value)
+                case Setting.ENABLE_PUSH if value > 1:
+                    raise H2Error(ErrorCode.PROTOCOL_ERROR, f"Invalid ENABLE_PUSH {value}!")
+                case Setting.INITIAL_WINDOW_SIZE:
+                    if value > MAX_WINDOW_SIZE:
+                        raise H2Error(ErrorCode.FLOW_CONTROL_ERROR, f"Invalid INITIAL_WINDOW_SIZE {value}!")
+
+                    # Applies to the windows of the open streams too, which may even become negative
+                    for stream in self.streams.values():
+                        if (window:=stream.send_window + value - self.initial_send_window) > MAX_WINDOW_SIZE:
+                            raise H2Error(ErrorCode.FLOW_CONTROL_ERROR, "INITIAL_WINDOW_SIZE overflows a stream window!")
+                        stream.send_window = window
+
+                    self.initial_send_window = value
+                case Setting.MAX_FRAME_SIZE:
+                    if not DEFAULT_FRAME_SIZE <= value <= MAX_FRAME_SIZE:
+                        raise H2Error(ErrorCode.PROTOCOL_ERROR, f"Invalid MAX_FRAME_SIZE {value}!")
+
+                    self.max_send_frame_size = value
+
+    def receive_window_update(self: typing.Self, stream_id: int, payload: bytes) -> None:
+        if len(payload) != 4:
+            raise H2Error(ErrorCode.FRAME_SIZE_ERROR, "Malformed WINDOW_UPDATE!")
+
+        increment = int.from_bytes(payload) & MAX_WINDOW_SIZE
+
+        if stream_id == 0:
+            if increment == 0:
+                raise H2Error(ErrorCode.PROTOCOL_ERROR, "WINDOW_UPDATE of 0!")
+            if (window:=self.send_window + increment) > MAX_WINDOW_SIZE:
+                raise H2Error(ErrorCode.FLOW_CONTROL_ERROR, "Connection window overflow!")
+
+            self.send_window = window
+            return
+
+        if stream_id > self.last_stream_id:
+            raise H2Error(ErrorCode.PROTOCOL_ERROR, f"WINDOW_UPDATE on idle stream {stream_id}!")
+
+        # Closed streams may still get updates sent before the client saw them close
+        if (stream:=self.streams.get(stream_id)) is None:
+            return
+
+        if increment == 0:
+            raise H2StreamError(stream_id, ErrorCode.PROTOCOL_ERROR, "WINDOW_UPDATE of 0!")
+        if (window:=stream.send_window + increment) > MAX_WINDOW_SIZE:
+            raise H2StreamError(stream_id, ErrorCode.FLOW_CONTROL_ERROR, "Stream window overflow!")
+
+        stream.send_window = window
+
+    def receive_data(self: typing.Self, flags: int, stream_id: int, payload: bytes) -> H2Stream | None:
+        if stream_id == 0:
+            raise H2Error(ErrorCode.PROTOCOL_ERROR, "DATA on stream 0!")
+        if stream_id > self.last_stream_id:
+            raise H2Error(ErrorCode.PROTOCOL_ERROR, f"DATA on idle stream {stream_id}!")
+
+        # Counts against the connection window whatever happens to the stream, padding included
+        if len(payload) > self.recv_window - self.recv_credit:
+            raise H2Error(ErrorCode.FLOW_CONTROL_ERROR, "Connection window exceeded!")
+        self.credit(0, len(payload))
+
+        # The client may not have seen the stream reset yet
+        if (stream:=self.streams.get(stream_id)) is None:
+            return None
+        if stream.remote_closed:
+            raise H2StreamError(stream_id, ErrorCode.STREAM_CLOSED, f"DATA on closed stream {stream_id}!")
+
+        if len(payload) > stream.recv_window:
+            raise H2StreamError(stream_id, ErrorCode.FLOW_CONTROL_ERROR, "Stream window exceeded!")
+
+        data = self.unpad(flags, payload)
+        body = stream.request.body
+
+        if not stream.discard_body:
+            if body.length + len(data) > self.max_body_size:
+                self.respond_error(stream, HTTPError(f"Request body exceeds {self.max_body_size} byte(s)!", status=HTTPStatus.REQUEST_ENTITY_TOO_LARGE))
+            else:
+                body.write(data)
+
+        stream.body_received += len(data)
+        stream.timing.received += len(data)
+
+        if stream.content_length is not None and stream.body_received > stream.content_length:
+            raise H2StreamError(stream_id, ErrorCode.PROTOCOL_ERROR, "Request body exceeds its Content-Length!")
+
+        if flags & Flag.END_STREAM:
+            return self.end_request(stream)
+
+        stream.recv_window -= len(payload)
+        self.credit(stream, len(payload))
+
+        return None
+
+    def credit(self: typing.Self, stream: H2Stream | typing.Literal[0], size: int) -> None:
+        """Gives received bytes back to the client's window once half of it is used up"""
+        if stream == 0:
+            self.recv_credit += size
+            if self.recv_credit >= self.recv_window // 2:
+                self.output += frame(FrameType.WINDOW_UPDATE, 0, 0, struct.pack(">I", self.recv_credit))
+                self.recv_credit = 0
+        elif stream.recv_window <= self.recv_window // 2:
+            self.output += frame(FrameType.WINDOW_UPDATE, 0, stream.id, struct.pack(">I", self.recv_window - stream.recv_window))
+            stream.recv_window = self.recv_window
+
+    def receive_headers(self: typing.Self, flags: int, stream_id: int, payload: bytes) -> H2Stream | None:
+        if stream_id == 0:
+            raise H2Error(ErrorCode.PROTOCOL_ERROR, "HEADERS on stream 0!")
+
+        block = self.unpad(flags, payload)
+        if flags & Flag.PRIORITY:
+            if len(block) < 5:
+                raise H2Error(ErrorCode.FRAME_SIZE_ERROR, "HEADERS too short for its priority!")
+            block = block[5:]
+
+        if not flags & Flag.END_HEADERS:
+            self.continuation = (stream_id, flags, bytearray(block))
+            return None
+
+        return self.header_block(stream_id, flags, block)
+
+    def receive_continuation(self: typing.Self, flags: int, stream_id: int, payload: bytes) -> H2Stream | None:
+        if self.continuation is None:
+            raise H2Error(ErrorCode.PROTOCOL_ERROR, "CONTINUATION without HEADERS!")
+
+        block = self.continuation[2]
+        block += payload
+
+        # Every CONTINUATION is cheap to send and the block can only be decoded once complete
+        if len(block) > self.max_header_list_size * 2:
+            raise H2Error(ErrorCode.ENHANCE_YOUR_CALM, "Header block too large!")
+
+        if not flags & Flag.END_HEADERS:
+            return None
+
+        stream_id, flags, _ = self.continuation
+        self.continuation = None
+
+        return self.header_block(stream_id, flags, bytes(block))
+
+    def header_block(self: typing.Self, stream_id: int, flags: int, block: bytes) -> H2Stream | None:
+        """Handles a complete header block, a request or its trailers"""
+        # Decoded even for a refused stream, the dynamic table must stay in step with the client's
+        fields = self.decoder.decode(block)
+
+        if (stream:=self.streams.get(stream_id)) is not None and not stream.remote_closed:
+            if not flags & Flag.END_STREAM:
+                raise H2StreamError(stream_id, ErrorCode.PROTOCOL_ERROR, "Trailers without END_STREAM!")
+
+            for name, value in fields:
+                if name.startswith(":"):
+                    raise H2StreamError(stream_id, ErrorCode.PROTOCOL_ERROR, "Pseudo-header in trailers!")
+                stream.request.body.trailers.add(name, value)
+
+            return self.end_request(stream)
+
+        if stream_id % 2 == 0:
+            raise H2Error(ErrorCode.PROTOCOL_ERROR, f"HEADERS on server stream {stream_id}!")
+
+        # Trailers of a stream that was answered and reset while they were on their way
+        if stream_id <= self.last_stream_id or self.goaway_sent:
+            return None
+
+        self.last_stream_id = stream_id
+        if len(self.streams) >= self.max_concurrent_streams:
+            raise H2StreamError(stream_id, ErrorCode.REFUSED_STREAM, "Too many concurrent streams!")
+
+        now = time.perf_counter()
+        request = HTTPRequest(version=(2, 0), body=RequestBody(self.spool_threshold))
+        stream = self.streams[stream_id] = H2Stream(stream_id, request, RequestTiming(now, now, received=len(block)), self.initial_send_window, self.recv_window)
+        stream.remote_closed = bool(flags & Flag.END_STREAM)
+
+        try:
+            stream.content_length = self.parse_request(request, fields)
+        except HTTPError as e:
+            self.respond_error(stream, e)
+            return None
+
+        return self.end_request(stream) if stream.remote_closed else None
+
+    def parse_request(self: typing.Self, request: HTTPRequest, fields: list[tuple[str, str]]) -> int | None:
+        """
+        Fills `request` with the fields of its header block, returns its `Content-Length` if it has one.
+
+        Raises `H2StreamError` if the request is malformed as HTTP/2 and `HTTPError` (answered with a
+        response) if it is malformed as HTTP.
+        """
+        stream_id = self.last_stream_id
+        pseudo: dict[str, str] = {}
+        size = 0
+
+        for name, value in fields:
+            size += len(name) + len(value) + http_hpack.ENTRY_OVERHEAD
+
+            if name.startswith(":"):
+                if name not in (":method", ":scheme", ":path", ":authority") or name in pseudo or len(request.headers) != 0:
+                    raise H2StreamError(stream_id, ErrorCode.PROTOCOL_ERROR, f"Malformed pseudo-header {name!r}!")
+
+                pseudo[name] = value
+                continue
+
+            if name != name.lower() or len(name.encode("latin-1").translate(None, TOKEN)) != 0 or name in CONNECTION_HEADERS or (name == "te" and value != "trailers"):
+                raise H2StreamError(stream_id, ErrorCode.PROTOCOL_ERROR, f"Malformed header {name!r}!")
+            if value != value.strip(" \t") or any(character in value for character in "\0\r\n"):
+                raise H2StreamError(stream_id, ErrorCode.PROTOCOL_ERROR, f"Malformed value of header {name!r}!")
+
+            request.headers.add(name, value)
+
+        if size > self.max_header_list_size:
+            raise HTTPError(f"Request headers exceed {self.max_header_list_size} byte(s)!", status=HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+
+        if ":method" not in pseudo or ":scheme" not in pseudo or len(path:=pseudo.get(":path", "")) == 0:
+            raise H2StreamError(stream_id, ErrorCode.PROTOCOL_ERROR, "Request without :method, :scheme or :path!")
+
+        if (method:=METHODS.get(pseudo[":method"].encode("latin-1"))) is None:
+            raise HTTPError(f"Unknown method {pseudo[':method'][:64]!r}!", status=HTTPStatus.NOT_IMPLEMENTED)
+
+        target = path.encode("latin-1")
+        if len(target.translate(None, TARGET)) != 0:
+            raise HTTPError(f"Malformed request target {target[:64]!r}!")
+
+        request.method = method
+        request.target, request.query = split_target(target)
+
+        # Handlers look at Host, which :authority replaces in HTTP/2 (RFC 9113 8.3.1)
+        if (authority:=pseudo.get(":authority")) is not None and "host" not in request.headers:
+            request.headers["Host"] = authority
+
+        if (content_length:=request.headers["Content-Length"]) is None:
+            return None
+
+        if not (content_length.isascii() and content_length.isdigit()):
+            raise H2StreamError(stream_id, ErrorCode.PROTOCOL_ERROR, f"Invalid Content-Length {content_length!r}!")
+
+        return int(content_length)
+
+    def end_request(self: typing.Self, stream: H2Stream) -> H2Stream | None:
+        """The request of the stream is complete, returns the stream if it is to be answered by the handler"""
+        stream.remote_closed = True
+
+        if stream.answered:
+            self.finish_stream(stream)
+            return None
+
+        if stream.content_length is not None and stream.body_received != stream.content_length:
+            raise H2StreamError(stream.id, ErrorCode.PROTOCOL_ERROR, "Request body doesn't match its Content-Length!")
+
+        stream.request.body.seek(0)
+        stream.answered = True
+
+        return stream
+
+    def send_response(self: typing.Self, stream_id: int, response: HTTPResponse, pull: bool = True) -> bool:
+        """
+        Queues the response of a stream, its body is sent as the windows allow.
+
+        A streamed body is pulled from its `ResponseStream` as it is sent, or with `pull=False` left
+        to the engine to push with `send_data` and `end_data`. Returns `False` if the stream was reset
+        in the meantime, the body is then released right away.
+        """
+        if (stream:=self.streams.get(stream_id)) is None or self.terminated:
+            self.release(response, None)
+            return False
+
+        stream.response = response
+        stream.answered = True
+
+        if (body_stream:=response.body_stream) is not None:
+            stream.source = iter(body_stream) if pull else None
+            stream.source_done = False
+        elif (body_file:=response.body_file) is not None:
+            stream.source = body_file.chunks()
+            stream.source_done = False
+            stream.remaining = body_file.length
+        else:
+            if len(body:=response.body) != 0:
+                stream.chunks.append(memoryview(body))
+            stream.remaining = len(body)
+
+        ends = stream.remaining == 0
+        self.send_headers(stream, self.response_fields(response), ends)
+
+        if ends:
+            self.end_stream(stream)
+        else:
+            self.sending.append(stream)
+
+        return True
+
+    def response_fields(self: typing.Self, response: HTTPResponse) -> list[tuple[str, str]]:
+        fields = [(":status", str(response.status.value))]
+
+        for name, value in response.headers.items():
+            if (name:=name.lower()) not in CONNECTION_HEADERS:
+                fields.append((name, value))
+
+        return fields
+
+    def respond_error(self: typing.Self, stream: H2Stream, error: HTTPError) -> None:
+        """Answers a request the server won't process with a bodyless error response, without the handler"""
+        stream.error = error
+        stream.answered = stream.discard_body = True
+        self.send_headers(stream, [(":status", str(error.status.value)), ("content-length", "0")], True)
+        self.end_stream(stream)
+
+    def send_data(self: typing.Self, stream_id: int, data: bytes) -> bool:
+        """Adds bytes to the body of a response sent with `pull=False`, returns `False` if the stream is gone"""
+        if (stream:=self.streams.get(stream_id)) is None or stream.local_closed:
+            return False
+
+        if len(data) != 0:
+            stream.chunks.append(memoryview(data))
+
+            if stream not in self.sending:
+                self.sending.append(stream)
+
+        return True
+
+    def end_data(self: typing.Self, stream_id: int, trailers: typing.Iterable[tuple[str, str]] = ()) -> None:
+        """Ends the body of a response sent with `pull=False`, optionally with trailers"""
+        if (stream:=self.streams.get(stream_id)) is None or stream.local_closed:
+            return
+
+        stream.trailers = [(name.lower(), value) for name, value in trailers]
+        stream.source_done = True
+
+        if stream not in self.sending:
+            self.sending.append(stream)
+
+    def buffered(self: typing.Self, stream_id: int) -> int:
+        """Body bytes of the stream not sent yet, for engines pushing the body to hold back"""
+        return stream.buffered if (stream:=self.streams.get(stream_id)) is not None and not stream.local_closed else 0
+
+    def send_headers(self: typing.Self, stream: H2Stream, fields: list[tuple[str, str]], end_stream: bool) -> None:
+        block = self.encoder.encode(fields)
+        flags = Flag.END_STREAM if end_stream else 0
+        frame_type = FrameType.HEADERS
+        size = self.max_send_frame_size
+
+        # A block larger than a frame goes on in CONTINUATION frames, nothing may come in between
+        for offset in range(0, max(len(block), 1), size):
+            if offset + size >= len(block):
+                flags |= Flag.END_HEADERS
+
+            self.output += frame(frame_type, flags, stream.id, block[offset:offset + size])
+            frame_type, flags = FrameType.CONTINUATION, 0
+
+        stream.timing.sent += len(block)
+
+    def data_to_send(self: typing.Self, limit: int = 256 * 1024) -> bytes:
+        """
+        Frames to send next: the queued control frames and response heads, then DATA frames of the
+        answered streams taking turns, as far as the windows of the client allow, up to about `limit` bytes.
+        """
+        output = self.output
+        self.output = bytearray()
+        stalled = 0
+
+        # Stops once every stream in turn had nothing to send
+        while len(output) < limit and stalled < len(self.sending) and not self.terminated:
+            stream = self.sending.popleft()
+            stalled = 0 if self.send_frame(stream, output) else stalled + 1
+
+            if not stream.local_closed:
+                self.sending.append(stream)
+
+        # Frames queued while sending, e.g. trailers and resets
+        output += self.output
+        self.output.clear()
+
+        return bytes(output)
+
+    def send_frame(self: typing.Self, stream: H2Stream, output: bytearray) -> bool:
+        """
+        Appends the next DATA frame of the stream to `output`, or the end of its body.
+
+        Returns `False` if the stream has nothing to send for now: it is out of window or waits for the
+        engine to push more of its body.
+        """
+        if len(stream.chunks) == 0 and not stream.source_done:
+            if stream.source is None:
+                return False
+
+            try:
+                chunk = next(stream.source, None)
+            except Exception as e:
+                # Only the stream is lost and not the whole connection, a `ResponseStream` reported why already
+                if not isinstance(e, ConnectionAbortedError):
+                    print(f"[ERROR]: Response body failed: {e!r}")
+                self.reset_stream(stream.id, ErrorCode.INTERNAL_ERROR)
+                return True
+
+            if chunk is None:
+                self.source_done(stream)
+            elif len(chunk) == 0:
+                return True
+            else:
+                stream.chunks.append(memoryview(chunk))
+
+        if len(stream.chunks) == 0:
+            if len(stream.trailers) != 0:
+                # Encoded now and not when queued, the HPACK state must follow the order frames are sent in
+                output += self.output
+                self.output.clear()
+                self.send_headers(stream, stream.trailers, True)
+            else:
+                output += frame(FrameType.DATA, Flag.END_STREAM, stream.id)
+
+            self.end_stream(stream)
+            return True
+
+        window = min(self.send_window, stream.send_window)
+        if window <= 0:
+            return False
+
+        chunk = stream.chunks[0]
+        size = min(len(chunk), window, self.max_send_frame_size)
+
+        if size == len(chunk):
+            stream.chunks.popleft()
+        else:
+            stream.chunks[0] = chunk[size:]
+
+        ends = False
+        if stream.remaining is not None:
+            stream.remaining -= size
+            ends = stream.remaining <= 0
+
+        output += frame(FrameType.DATA, Flag.END_STREAM if ends else 0, stream.id, chunk[:size])
+        self.send_window -= size
+        stream.send_window -= size
+        stream.timing.sent += FRAME_HEADER_SIZE + size
+
+        if ends:
+            self.end_stream(stream)
+
+        return True
+
+    def source_done(self: typing.Self, stream: H2Stream) -> None:
+        stream.source_done = True
+
+        if stream.response is not None and stream.response.body_stream is not None:
+            stream.trailers = [(name.lower(), value) for name, value in stream.response.body_stream.trailers.items()]
+
+    def end_stream(self: typing.Self, stream: H2Stream) -> None:
+        """The last frame of the response was queued"""
+        stream.local_closed = True
+        self.release(stream.response, stream)
+        self.finished.append(stream)
+
+        if stream.remote_closed:
+            self.finish_stream(stream)
+        else:
+            # Answered before the request was complete, the client can stop sending it (RFC 9113 8.1)
+            self.reset_stream(stream.id, ErrorCode.NO_ERROR)
+
+    def finish_stream(self: typing.Self, stream: H2Stream) -> None:
+        if stream.local_closed and stream.remote_closed:
+            self.streams.pop(stream.id, None)
+
+    def take_finished(self: typing.Self) -> list[H2Stream]:
+        """Streams whose response was fully queued since the last call, for the engine to record"""
+        finished, self.finished = self.finished, []
+        return finished
+
+    def release(self: typing.Self, response: HTTPResponse | None, stream: H2Stream | None) -> None:
+        """Closes the body file or generator of a response that is done or won't be sent"""
+        if stream is not None and stream.source is not None:
+            if isinstance(stream.source, typing.Generator):
+                stream.source.close()
+            stream.source = None
+
+        if response is not None and response.body_file is not None:
+            response.body_file.close()
+            response.body_file = None
+
+    def reset_stream(self: typing.Self, stream_id: int, code: ErrorCode) -> None:
+        self.output += frame(FrameType.RST_STREAM, 0, stream_id, struct.pack(">I", code))
+        self.close_stream(stream_id)
+
+    def close_stream(self: typing.Self, stream_id: int) -> None:
+        if (stream:=self.streams.pop(stream_id, None)) is None:
+            return
+
+        stream.local_closed = stream.remote_closed = True
+        stream.chunks.clear()
+
+        if stream in self.sending:
+            self.sending.remove(stream)
+
+        # The body of an answered request belongs to the engine, which closes it after the handler
+        if not stream.answered:
+            stream.request.body.close()
+        self.release(stream.response, stream)
+
+    def goaway(self: typing.Self, code: ErrorCode = ErrorCode.NO_ERROR, error: H2Error | None = None) -> None:
+        """
+        Tells the client that no more streams will be accepted. Without an error the streams in flight
+        are still answered, with one the connection is closed as soon as the GOAWAY is sent.
+        """
+        if self.goaway_sent and error is None:
+            return
+
+        debug = str(error).encode("latin-1", "replace")[:256] if error is not None else b""
+        self.output += frame(FrameType.GOAWAY, 0, 0, struct.pack(">II", self.last_stream_id, code) + debug)
+        self.goaway_sent = True
+
+        if error is not None:
+            self.error = error
+            self.terminated = True
+            self.close()
+
+    def close(self: typing.Self) -> None:
+        """Releases the bodies of every stream, once the connection is closed"""
+        for stream_id in tuple(self.streams):
+            self.close_stream(stream_id)
+
+        self.sending.clear()
@@ -1,102 +1,336 @@
+import asyncio
 import dataclasses
-import mimetypes
-import gzip
+import inspect
 import typing
 import os
 import os.path
+import urllib.parse
 
 from http import HTTPStatus, HTTPMethod
 
-from http_message import HTTPRequest, HTTPResponse
+from http_message import HTTPRequest, HTTPResponse, FileBody
 from http_constants import NOT_FOUND_PAGE, NOT_FOUND_PAGE_PATH
-from http_util import optional
+from http_cache import CachedFile, StaticFileCache
+from http_conditional import CachePolicy, if_range_matches, is_not_modified
+from http_ranges import MAX_MULTIPART_SIZE, content_range, multipart_byteranges, new_boundary, parse_range
+from http_metrics import METRICS, ServerMetrics
+from http_router import Endpoint, Router, RouteMatch, StaticMount
+from http_compression import SIDECAR_EXTENSIONS, CompressionPolicy, compress, negotiate, sidecar_path
+
+async def wait(awaitable: typing.Awaitable[typing.Any]) -> typing.Any:
+    """Coroutine awaiting `awaitable`, as `asyncio.run` only takes coroutines"""
+    return await awaitable
 
 @dataclasses.dataclass
 class HTTPHandler:
+    cache: typing.ClassVar[StaticFileCache] = StaticFileCache()
+    """Static files up to `cache.max_file_size` are served from memory, larger ones are sent straight from the file"""
+    not_found_page: typing.ClassVar[dict[str | None, bytes]] = {}
+    """Body of 404 responses by content coding"""
+    compression: typing.ClassVar[CompressionPolicy] = CompressionPolicy()
+    caching: typing.ClassVar[CachePolicy] = CachePolicy()
+    """`Cache-Control` and `ETag` flavour of the static files, revalidations are answered with 304 when possible"""
+    router: typing.ClassVar[Router] = Router().mount("/", ".")
+    """Routes of the handler, by default every path is a file relative to the working directory"""
+    metrics: typing.ClassVar[ServerMetrics] = METRICS
+
     @classmethod
     def generate_response(cls: type[typing.Self], request: HTTPRequest, _gzip: bool = True) -> HTTPResponse:
+        """Called from the workers of the sync engines, which have no event loop, an `async def` endpoint is run to completion on one of its own"""
         response = HTTPResponse(gzip=_gzip)
 
-        match request.method:
-            case HTTPMethod.GET:
-                cls.GET(response, request)
-            case HTTPMethod.POST:
-                cls.POST()
-            case HTTPMethod.HEAD:
-                cls.HEAD()
-            case HTTPMethod.OPTIONS:
-                cls.OPTIONS()
+        if inspect.isawaitable(result:=cls.dispatch(response, request)):
+            asyncio.run(wait(result))
+
+        if request.method is HTTPMethod.HEAD:
+            cls.strip_body(response)
         
         return response
     
-    @staticmethod
-    def GET(response: HTTPResponse, request: HTTPRequest) -> None:
-        if request.target.endswith("/"):
-            request.target += "index.html"
+    @classmethod
+    async def generate_response_async(cls: type[typing.Self], request: HTTPRequest, _gzip: bool = True) -> HTTPResponse:
+        """Same as `generate_response`, but awaits the endpoint if it was defined with `async def`"""
+        response = HTTPResponse(gzip=_gzip)
+
+        if inspect.isawaitable(result:=cls.dispatch(response, request)):
+            await result
+
+        if request.method is HTTPMethod.HEAD:
+            cls.strip_body(response)
         
-        request.target = request.target.lstrip('/')
-        response.headers["Content-Type"] = mimetypes.guess_type(request.target)[0]
+        return response
+    
+    @classmethod
+    def dispatch(cls: type[typing.Self], response: HTTPResponse, request: HTTPRequest) -> typing.Any:
+        if request.method is HTTPMethod.OPTIONS and request.target == "*":
+            return cls.empty_response(response, request, HTTPStatus.NO_CONTENT, {"Allow": ", ".join(cls.router.methods())})
+
+        if (route:=cls.resolve(request)) is None:
+            return cls.not_found(response, request)
+
+        if (endpoint:=cls.endpoint(request)) is None:
+            allow = {"Allow": ", ".join(route.allowed_methods)}
+
+            if request.method is HTTPMethod.OPTIONS:
+                return cls.empty_response(response, request, HTTPStatus.NO_CONTENT, allow)
+            return cls.empty_response(response, request, HTTPStatus.METHOD_NOT_ALLOWED, allow)
+
+        if isinstance(endpoint, StaticMount):
+            return cls.serve_static(response, request, os.path.join(endpoint.directory, route.params["path"].lstrip("/")), endpoint.root)
+
+        return endpoint(response, request)
+
+    @classmethod
+    def resolve(cls: type[typing.Self], request: HTTPRequest) -> RouteMatch | None:
+        """Route of the request target, matched once per request"""
+        if request.route is None and (route:=cls.router.match(request.target)) is not None:
+            request.route = route
+            request.path_params = route.params
+
+        return request.route
+
+    @classmethod
+    def endpoint(cls: type[typing.Self], request: HTTPRequest) -> Endpoint | StaticMount | None:
+        """Endpoint answering the request, HEAD requests are answered by the GET endpoint"""
+        if (route:=cls.resolve(request)) is None:
+            return None
+
+        if (endpoint:=route.endpoints.get(request.method)) is None and request.method is HTTPMethod.HEAD:
+            endpoint = route.endpoints.get(HTTPMethod.GET)
+
+        return endpoint
+    
+    @classmethod
+    def is_async(cls: type[typing.Self], request: HTTPRequest) -> bool:
+        """Whether the endpoint of the request is a coroutine function"""
+        return inspect.iscoroutinefunction(cls.endpoint(request))
+
+    @classmethod
+    def empty_response(cls: type[typing.Self], response: HTTPResponse, request: HTTPRequest, status: HTTPStatus, headers: dict[str, str] | None = None) -> None:
+        response.status = status
+
+        for header_name, header_value in (headers or {}).items():
+            response.headers[header_name] = header_value
+        if status is not HTTPStatus.NO_CONTENT:
+            response.headers["Content-Length"] = 0
+
+        response.construct_head(request, None)
+        response.body = bytes()
+
+    @classmethod
+    def strip_body(cls: type[typing.Self], response: HTTPResponse) -> None:
+        """Drops the body of a GET response answering a HEAD request, keeping its head"""
+        if response.body_file is not None:
+            response.body_file.close()
+
+        response.body = bytes()
+        response.body_file = response.body_stream = None
+    
+    @classmethod
+    def serve_static(cls: type[typing.Self], response: HTTPResponse, request: HTTPRequest, path: str, root: str | None = None) -> None:
+        """
+        Answers with the file at `path`, or with the not found page.
+
+        With a `root`, files whose real path is outside of it are not found, so neither `..` nor
+        symlinks reach outside of the document root. A directory requested without the trailing
+        slash is redirected to it, so the relative links of its index page resolve under it.
+        """
+        if path.endswith("/") or len(path) == 0:
+            path += "index.html"
+
+        if path.endswith("not_found.html") or ".." in path.split("/"):
+            return cls.not_found(response, request)
+
+        try:
+            entry = cls.cache.get(path, root)
+        except IsADirectoryError:
+            location = urllib.parse.quote(request.target + "/") + (f"?{request.query}" if len(request.query) != 0 else "")
+            return cls.empty_response(response, request, HTTPStatus.MOVED_PERMANENTLY, {"Location": location})
+
+        if entry is None:
+            return cls.not_found(response, request)
+
+        # Only GET gets a body, HEAD gets the same metadata without any file being read or compressed
+        head_only = request.method is HTTPMethod.HEAD
+        content_coding: str | None = None
+
+        response.status = HTTPStatus.OK
+        response.headers["Content-Type"] = entry.content_type
+        response.headers["Last-Modified"] = entry.last_modified
+
+        file_stat = entry.file_stat
+        size = file_stat.st_size
+        # Files too large to be held in memory are sent by the server straight from the file so memory use doesn't depend on the file size
+        in_memory = entry.data is not None
 
-        if not os.path.exists(request.target) or (request.target.endswith("not_found.html") and response.headers["Content-Type"] == "text/html"):
-            response.status = HTTPStatus.NOT_FOUND
+        # Ranges are served from the file as it is, only the whole file gets a content coding
+        ranges: list[tuple[int, int]] | None = None
+        if not head_only and (range_header:=request.headers["Range"]) is not None:
+            if_range = request.headers["If-Range"]
 
-            if os.path.exists(NOT_FOUND_PAGE_PATH):
-                with open(NOT_FOUND_PAGE_PATH, "br") as file:
-                    file_data = file.read()
+            if if_range is None or if_range_matches(if_range, cls.caching.etag(file_stat, None), file_stat.st_mtime):
+                ranges = parse_range(range_header, size)
+
+                if ranges is not None and len(ranges) > 1 and sum(end - start + 1 for start, end in ranges) > MAX_MULTIPART_SIZE:
+                    ranges = None
+
+        # Sidecars cost nothing to serve so they come first, streamed files are never compressed on the fly
+        candidates = [coding for coding in SIDECAR_EXTENSIONS if coding in entry.sidecars]
+        if in_memory and cls.compression.should_compress(response.headers["Content-Type"], size):
+            candidates += [coding for coding in cls.compression.codings() if coding not in candidates]
+
+        if len(candidates) != 0:
+            response.headers["Vary"] = "Accept-Encoding"
+
+            if response.gzip and ranges is None:
+                content_coding = negotiate(request.headers["Accept-Encoding"], candidates)
+        
+        response.gzip = content_coding == "gzip"
+
+        if content_coding is not None:
+            response.headers["Content-Encoding"] = content_coding
+
+        response.headers["Accept-Ranges"] = "bytes"
+        response.headers["ETag"] = cls.caching.etag(file_stat, content_coding)
+        if (cache_control:=cls.caching.cache_control(request.target.lstrip("/"), response.headers["Content-Type"])) is not None:
+            response.headers["Cache-Control"] = cache_control
+
+        if is_not_modified(request.headers["If-None-Match"], request.headers["If-Modified-Since"], response.headers["ETag"], file_stat.st_mtime):
+            response.status = HTTPStatus.NOT_MODIFIED
+            # Nothing is read nor compressed, a 304 only repeats the validators and caching headers
+            response.headers["Content-Encoding"] = None
+
+            response.construct_head(request, None)
+            response.body = bytes()
+            return
+
+        if ranges is not None and len(ranges) == 0:
+            response.status = HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE
+            response.headers["Content-Range"] = f"bytes */{size}"
+            response.headers["Content-Length"] = 0
+
+            response.construct_head(request, None)
+            response.body = bytes()
+            return
+
+        if head_only:
+            return cls.head_metadata(response, request, entry, content_coding)
+
+        if ranges is not None:
+            body = cls.partial_content(response, entry, ranges)
+        elif not in_memory:
+            if content_coding is None:
+                response.body_file = cls.cache.file_body(entry, 0, size)
             else:
-                file_data = NOT_FOUND_PAGE.encode()
-            
-            file_stat = None
+                file = open(sidecar_path(path, content_coding), "rb")
+                response.body_file = FileBody(file, 0, os.fstat(file.fileno()).st_size)
+
+            body = bytes()
+            response.headers["Content-Length"] = response.body_file.length
+
+            if content_coding is not None:
+                cls.metrics.observe_compression(content_coding, size, response.body_file.length)
         else:
-            response.status = HTTPStatus.OK
-            with open(request.target, "rb") as file:
-                file_data = file.read()
-                file_stat = os.fstat(file.fileno())
-        
-        response.headers["Connection"] = "keep-alive"
-        
-        if response.gzip:
-            response.headers["Content-Encoding"] = "gzip"
+            if content_coding is None:
+                body = entry.data
+            else:
+                body = cls.cache.get_variant(entry, content_coding, cls.compression.level(entry.content_type, content_coding))
+                cls.metrics.observe_compression(content_coding, size, len(body))
 
-            body = gzip.compress(file_data)
             response.headers["Content-Length"] = len(body)
-        # elif request.headers.range_requests_headers["Range"].startswith("bytes"):
-            # ranges = request.headers.range_requests_headers["Range"].split(";")
 
-            # r = ranges[0]
+        response.construct_head(request, None)
+        response.body = body
 
-            # ittr = map(int, r.split("=")[1].split("-"))
+    @classmethod
+    def not_found(cls: type[typing.Self], response: HTTPResponse, request: HTTPRequest) -> None:
+        response.status = HTTPStatus.NOT_FOUND
+        response.headers["Content-Type"] = "text/html"
+        content_coding: str | None = None
 
-            # start = next(ittr)
-            # try:
-                # end = next(ittr)
-            # except ValueError:
-                # end = len(file_data) - 1
+        if cls.compression.should_compress("text/html", len(page:=cls.not_found_body(None))):
+            response.headers["Vary"] = "Accept-Encoding"
 
-            # body = file_data[start : start+1024 if end == len(file_data) - 1 else end+1]
+            if response.gzip:
+                content_coding = negotiate(request.headers["Accept-Encoding"], cls.compression.codings())
 
-            # response.status = HTTPStatus.PARTIAL_CONTENT
+        response.gzip = content_coding == "gzip"
 
-            # response.headers["Content-Range"] = f"bytes={start}-{end}/{len(file_data)}"
-            # response.headers["Content-Length"] = end - start + 1
+        if content_coding is not None:
+            response.headers["Content-Encoding"] = content_coding
+            body = cls.not_found_body(content_coding)
+            cls.metrics.observe_compression(content_coding, len(page), len(body))
         else:
-            body = file_data
-            response.headers["Content-Length"] = len(body)
-        
-        response.construct_head(request, file_stat)
+            body = page
+
+        response.headers["Content-Length"] = len(body)
+
+        response.construct_head(request, None)
         response.body = body
-    
+
     @classmethod
-    @optional
-    def POST(cls: type[typing.Self]):
-        pass
+    def not_found_body(cls: type[typing.Self], content_coding: str | None) -> bytes:
+        """The not found page, read from `NOT_FOUND_PAGE_PATH` on first use and encoded once per content coding"""
+        if (body:=cls.not_found_page.get(content_coding)) is not None:
+            return body
+
+        if content_coding is not None:
+            body = compress(cls.not_found_body(None), content_coding, cls.compression.level("text/html", content_coding))
+        else:
+            try:
+                with open(NOT_FOUND_PAGE_PATH, "rb") as file:
+                    body = file.read()
+            except OSError:
+                body = NOT_FOUND_PAGE.encode()
+
+        cls.not_found_page[content_coding] = body
+        return body
 
     @classmethod
-    @optional
-    def HEAD(cls: type[typing.Self]):
-        pass
+    def head_metadata(cls: type[typing.Self], response: HTTPResponse, request: HTTPRequest, entry: CachedFile, content_coding: str | None) -> None:
+        """Completes a HEAD response with the `Content-Length` a GET would get, if it is known without producing the body"""
+        if content_coding is None:
+            response.headers["Content-Length"] = entry.file_stat.st_size
+        elif (variant:=entry.variants.get(content_coding)) is not None:
+            response.headers["Content-Length"] = len(variant)
+        elif (sidecar_stat:=entry.sidecars.get(content_coding)) is not None:
+            response.headers["Content-Length"] = sidecar_stat.st_size
 
+        response.construct_head(request, None)
+        response.body = bytes()
+    
     @classmethod
-    @optional
-    def OPTIONS(cls: type[typing.Self]):
-        pass
+    def partial_content(cls: type[typing.Self], response: HTTPResponse, entry: CachedFile, ranges: list[tuple[int, int]]) -> bytes:
+        """
+        Makes `response` a 206 with the `ranges` of the file of `entry` and returns its in-memory body.
+
+        A single range of an open file is sent straight from it with an offset, the parts of a
+        multipart body are read at their offsets.
+        """
+        response.status = HTTPStatus.PARTIAL_CONTENT
+        size = entry.file_stat.st_size
+
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            response.headers["Content-Range"] = content_range(start, end, size)
+            response.headers["Content-Length"] = end - start + 1
+
+            if entry.data is not None:
+                return entry.data[start:end + 1]
+
+            response.body_file = cls.cache.file_body(entry, start, end - start + 1)
+            return bytes()
+
+        if entry.data is not None:
+            parts = [(start, end, entry.data[start:end + 1]) for start, end in ranges]
+        else:
+            with cls.cache.file_body(entry, 0, size) as body_file:
+                parts = [(start, end, os.pread(body_file.file.fileno(), end - start + 1, start)) for start, end in ranges]
+
+        boundary = new_boundary()
+        body = multipart_byteranges(parts, size, response.headers["Content-Type"], boundary)
+
+        response.headers["Content-Type"] = f"multipart/byteranges; boundary={boundary}"
+        response.headers["Content-Length"] = len(body)
+
+        return body
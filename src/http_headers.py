@@ -1,59 +1,167 @@
-import dataclasses
+import collections.abc
+import sys
 import typing
 
-from pformat import PP_Repr
+from pformat import pformat
 
-@dataclasses.dataclass(repr=False)
-class HTTPHeaders(PP_Repr):
+HEADER_CATEGORIES: typing.Final[dict[str, tuple[str, ...]]] = {
+    "authentication_headers": ("WWW-Authenticate", "Authorization", "Proxy-Authenticate", "Proxy-Authorization"),
+    "caching_headers": ("Age", "Cache-Control", "Clear-Site-Data", "Expires", "No-Vary-Search"),
+    "conditionals_headers": ("Last-Modified", "ETag", "If-Match", "If-None-Match", "If-Modified-Since", "If-Unmodified-Since", "Vary"),
+    "connection_management_headers": ("Connection", "Keep-Alive"),
+    "content_negotiation_headers": ("Accept", "Accept-Encoding", "Accept-Language", "Accept-Patch", "Accept-Post"),
+    "controls_headers": ("Expect", "Max-Forwards"),
+    "cookies_headers": ("Cookie", "Set-Cookie"),
+    "cors_headers": ("Access-Control-Allow-Credentials", "Access-Control-Allow-Headers", "Access-Control-Allow-Methods", "Access-Control-Allow-Origin", "Access-Control-Expose-Headers", "Access-Control-Max-Age", "Access-Control-Request-Headers", "Access-Control-Request-Method", "Origin", "Timing-Allow-Origin"),
+    "downloads_headers": ("Content-Disposition",),
+    "integrity_digests_headers": ("Content-Digest", "Repr-Digest", "Want-Content-Digest", "Want-Repr-Digest"),
+    "message_body_information_headers": ("Content-Length", "Content-Type", "Content-Encoding", "Content-Language", "Content-Location"),
+    "proxies_headers": ("Forwarded", "Via"),
+    "range_requests_headers": ("Accept-Ranges", "Range", "If-Range", "Content-Range"),
+    "redirects_headers": ("Location", "Refresh"),
+    "request_context_headers": ("From", "Host", "Referer", "Referrer-Policy", "User-Agent"),
+    "response_context_headers": ("Allow", "Server"),
+    "security_headers": ("Cross-Origin-Embedder-Policy", "Cross-Origin-Opener-Policy", "Cross-Origin-Resource-Policy", "Content-Security-Policy", "Content-Security-Policy-Report-Only", "Permissions-Policy", "Reporting-Endpoints", "Strict-Transport-Security", "Upgrade-Insecure-Requests", "X-Content-Type-Options", "X-Frame-Options", "X-Permitted-Cross-Domain-Policies", "X-Powered-By", "X-XSS-Protection"),
+    "fetch_metadata_request_headers": ("Sec-Fetch-Site", "Sec-Fetch-Mode", "Sec-Fetch-User", "Sec-Fetch-Dest", "Sec-Purpose", "Service-Worker-Navigation-Preload"),
+    "server_sent_events_headers": ("Report-To",),
+    "transfer_coding_headers": ("Transfer-Encoding", "TE", "Trailer"),
+    "websockets_headers": ("Sec-WebSocket-Accept",),
+}
+"""Most of the HTTP headers sorted into their respective category, headers of no category are `other_headers`"""
+
+CANONICAL_NAMES: typing.Final[dict[str, str]] = {sys.intern(name.lower()): sys.intern(name) for names in HEADER_CATEGORIES.values() for name in names}
+"""Interned canonical spelling of the known header names by their lowercase name"""
+
+MULTI_LINE_HEADERS: typing.Final[frozenset[str]] = frozenset({"set-cookie"})
+"""Headers whose values can't be combined into a single comma separated line (RFC 9110 5.3)"""
+
+class HTTPHeaders:
     """
-    Collects most of the HTTP headers into their respective catagory.
+    Case-insensitive HTTP header container.
 
-    It offers easy setting and accessing their name via `__setitem__` and `__getitem__` dunder methods.
+    Header fields live in a single dict keyed by their lowercase name, so every lookup is O(1).
+    A field keeps the spelling it was first set with (or the canonical one of a known header) and
+    all of its values, `__getitem__` combines them while `items` yields one line per value.
+    The categories of `HEADER_CATEGORIES` are available as read-only views (e.g. `headers.caching_headers`).
     """
-    authentication_headers: dict[str, str | None]           = dataclasses.field(default_factory=lambda: {"WWW-Authenticate": None, "Authorization": None, "Proxy-Authenticate": None, "Proxy-Authorization": None}, init=False)
-    caching_headers: dict[str, str | None]                  = dataclasses.field(default_factory=lambda: {"Age": None, "Cache-Control": None, "Clear-Site-Data": None, "Expires": None, "No-Vary-Search": None}, init=False)
-    conditionals_headers: dict[str, str | None]             = dataclasses.field(default_factory=lambda: {"Last-Modified": None, "ETag": None, "If-Match": None, "If-None-Match": None, "If-Modified-Since": None, "If-Unmodified-Since": None, "Vary": None}, init=False)
-    connection_management_headers: dict[str, str | None]    = dataclasses.field(default_factory=lambda: {"Connection": None, "Keep-Alive": None}, init=False)
-    content_negotiation_headers: dict[str, str | None]      = dataclasses.field(default_factory=lambda: {"Accept": None, "Accept-Encoding": None, "Accept-Language": None, "Accept-Patch": None, "Accept-Post": None}, init=False)
-    controls_headers: dict[str, str | None]                 = dataclasses.field(default_factory=lambda: {"Expect": None, "Max-Forwards": None}, init=False)
-    cookies_headers: dict[str, str | None]                  = dataclasses.field(default_factory=lambda: {"Cookie": None, "Set-Cookie": None}, init=False)
-    cors_headers: dict[str, str | None]                     = dataclasses.field(default_factory=lambda: {"Access-Control-Allow-Credentials": None, "Access-Control-Allow-Headers": None, "Access-Control-Allow-Methods": None, "Access-Control-Allow-Origin": None, "Access-Control-Expose-Headers": None, "Access-Control-Max-Age": None, "Access-Control-Request-Headers": None, "Access-Control-Request-Method": None, "Origin": None, "Timing-Allow-Origin": None}, init=False)
-    downloads_headers: dict[str, str | None]                = dataclasses.field(default_factory=lambda: {"Content-Disposition": None}, init=False)
-    integrity_digests_headers: dict[str, str | None]        = dataclasses.field(default_factory=lambda: {"Content-Digest": None, "Repr-Digest": None, "Want-Content-Digest": None, "Want-Repr-Digest": None}, init=False)
-    message_body_information_headers: dict[str, str | None] = dataclasses.field(default_factory=lambda: {"Content-Length": None, "Content-Type": None, "Content-Encoding": None, "Content-Language": None, "Content-Location": None}, init=False)
-    proxies_headers: dict[str, str | None]                  = dataclasses.field(default_factory=lambda: {"Forwarded": None, "Via": None}, init=False)
-    range_requests_headers: dict[str, str | None]           = dataclasses.field(default_factory=lambda: {"Accept-Ranges": None, "Range": None, "If-Range": None, "Content-Range": None}, init=False)
-    redirects_headers: dict[str, str | None]                = dataclasses.field(default_factory=lambda: {"Location": None, "Refresh": None}, init=False)
-    request_context_headers: dict[str, str | None]          = dataclasses.field(default_factory=lambda: {"From": None, "Host": None, "Referer": None, "Referrer-Policy": None, "User-Agent": None}, init=False)
-    response_context_headers: dict[str, str | None]         = dataclasses.field(default_factory=lambda: {"Allow": None, "Server": None}, init=False)
-    security_headers: dict[str, str | None]                 = dataclasses.field(default_factory=lambda: {"Cross-Origin-Embedder-Policy": None, "Cross-Origin-Opener-Policy": None, "Cross-Origin-Resource-Policy": None, "Content-Security-Policy": None, "Content-Security-Policy-Report-Only": None, "Permissions-Policy": None, "Reporting-Endpoints": None, "Strict-Transport-Security": None, "Upgrade-Insecure-Requests": None, "X-Content-Type-Options": None, "X-Frame-Options": None, "X-Permitted-Cross-Domain-Policies": None, "X-Powered-By": None, "X-XSS-Protection": None}, init=False)
-    fetch_metadata_request_headers: dict[str, str | None]   = dataclasses.field(default_factory=lambda: {"Sec-Fetch-Site": None, "Sec-Fetch-Mode": None, "Sec-Fetch-User": None, "Sec-Fetch-Dest": None, "Sec-Purpose": None, "Service-Worker-Navigation-Preload": None}, init=False)
-    server_sent_events_headers: dict[str, str | None]       = dataclasses.field(default_factory=lambda: {"Report-To": None}, init=False)
-    transfer_coding_headers: dict[str, str | None]          = dataclasses.field(default_factory=lambda: {"Transfer-Encoding": None, "TE": None, "Trailer": None}, init=False)
-    websockets_headers: dict[str, str | None]               = dataclasses.field(default_factory=lambda: {"Sec-WebSocket-Accept": None}, init=False)
-    other_headers: dict[str, str | None]                    = dataclasses.field(default_factory=lambda: {}, init=False)
+    __slots__ = ("fields",)
+
+    fields: dict[str, list[str]]
+    """`[name, *values]` of every field by lowercase name"""
+
+    def __init__(self: typing.Self, headers: collections.abc.Iterable[tuple[str, str]] = ()) -> None:
+        self.fields = {}
+
+        for header_name, header_value in headers:
+            self.add(header_name, header_value)
 
     def __getitem__(self: typing.Self, __key: str) -> str | None:
-        for header_group in dataclasses.fields(self):
-            if __key in getattr(self, header_group.name):
-                return getattr(self, header_group.name)[__key]
-    
-    def __setitem__(self: typing.Self, __key: str, __value: str) -> str | None:
-        for header_group in dataclasses.fields(self):
-            if __key in getattr(self, header_group.name):
-                getattr(self, header_group.name)[__key] = __value
-                return
-        
-        self.other_headers[__key] = __value
-    
-    def get_headers(self:typing.Self) -> dict[str, str]:
+        if (field:=self.fields.get(__key.lower())) is None:
+            return None
+
+        return field[1] if len(field) == 2 else ", ".join(field[1:])
+
+    def __setitem__(self: typing.Self, __key: str, __value: typing.Any) -> None:
+        """Replaces every value of the header, `None` removes it"""
+        if __value is None:
+            self.fields.pop(__key.lower(), None)
+            return
+
+        key = __key.lower()
+        self.fields[key] = [CANONICAL_NAMES.get(key, __key), str(__value)]
+
+    def __delitem__(self: typing.Self, __key: str) -> None:
+        del self.fields[__key.lower()]
+
+    def __contains__(self: typing.Self, __key: object) -> bool:
+        return isinstance(__key, str) and __key.lower() in self.fields
+
+    def __len__(self: typing.Self) -> int:
+        return len(self.fields)
+
+    def __iter__(self: typing.Self) -> typing.Iterator[str]:
+        return (field[0] for field in self.fields.values())
+
+    def __repr__(self: typing.Self) -> str:
+        return f"{self.__class__.__name__}({pformat(self.get_headers(), 4)})"
+
+    def add(self: typing.Self, header_name: str, header_value: typing.Any) -> None:
+        """Adds a value to the header, keeping the ones it already has"""
+        key = header_name.lower()
+
+        if (field:=self.fields.get(key)) is None:
+            self.fields[key] = [CANONICAL_NAMES.get(key, header_name), str(header_value)]
+        else:
+            field.append(str(header_value))
+
+    def add_lines(self: typing.Self, lines: typing.Iterable[str]) -> None:
+        """Adds already validated `name: value` header lines, what `add` does for each written out"""
+        fields = self.fields
+
+        for line in lines:
+            header_name, _, header_value = line.partition(":")
+            header_value = header_value.strip(" \t")
+            key = header_name.lower()
+
+            if (field:=fields.get(key)) is None:
+                fields[key] = [CANONICAL_NAMES.get(key, header_name), header_value]
+            else:
+                field.append(header_value)
+
+    def get(self: typing.Self, header_name: str, default: str | None = None) -> str | None:
+        return value if (value:=self[header_name]) is not None else default
+
+    def get_all(self: typing.Self, header_name: str) -> list[str]:
+        """Every value of the header, in the order they were added"""
+        return field[1:] if (field:=self.fields.get(header_name.lower())) is not None else []
+
+    def items(self: typing.Self) -> typing.Iterator[tuple[str, str]]:
+        """Name and value of every header line, headers that can't be combined get one line per value"""
+        for key, (header_name, *values) in self.fields.items():
+            if len(values) == 1 or key in MULTI_LINE_HEADERS:
+                for value in values:
+                    yield header_name, value
+            else:
+                yield header_name, ", ".join(values)
+
+    def get_headers(self: typing.Self) -> dict[str, str]:
         """Returns the set HTTP headers"""
-        headers: dict[str, str] = dict()
-
-        for header_group in dataclasses.fields(self):
-            header_group_dict: dict[str, str | None] = getattr(self, header_group.name)
-            for header_name, value in header_group_dict.items():
-                if value is not None:
-                    headers[header_name] = value
-        
-        return headers
\ No newline at end of file
+        return {field[0]: self[key] for key, field in self.fields.items()}
+
+    @property
+    def other_headers(self: typing.Self) -> "HeaderCategory":
+        return HeaderCategory(self, tuple(field[0] for key, field in self.fields.items() if key not in CANONICAL_NAMES))
+
+class HeaderCategory(collections.abc.Mapping):
+    """Read-only view of the headers of a category, computed on access and `None` for the unset ones"""
+    __slots__ = ("headers", "names")
+
+    headers: HTTPHeaders
+    names: tuple[str, ...]
+
+    def __init__(self: typing.Self, headers: HTTPHeaders, names: tuple[str, ...]) -> None:
+        self.headers = headers
+        self.names = names
+
+    def __getitem__(self: typing.Self, __key: str) -> str | None:
+        if __key not in self.names:
+            raise KeyError(__key)
+
+        return self.headers[__key]
+
+    def __iter__(self: typing.Self) -> typing.Iterator[str]:
+        return iter(self.names)
+
+    def __len__(self: typing.Self) -> int:
+        return len(self.names)
+
+    def __repr__(self: typing.Self) -> str:
+        return pformat(dict(self))
+
+def category_view(names: tuple[str, ...]) -> property:
+    return property(lambda headers: HeaderCategory(headers, names))
+
+for category, names in HEADER_CATEGORIES.items():
+    setattr(HTTPHeaders, category, category_view(names))
+
+del category, names
@@ -0,0 +1,441 @@
+"""
+HPACK header compression (RFC 7541)
+
+Header blocks of HTTP/2 are made of references into a static table of common fields and a dynamic
+table of the fields recently sent on the connection, and of literal strings, optionally Huffman coded
+with the static code of the RFC. Each direction of a connection has its own dynamic table: the
+`Decoder` keeps the one of the client's requests, the `Encoder` the one of the server's responses.
+
+Huffman strings are decoded four bits at a time with a table of the decoder states, built once from the
+code when the module is imported, so decoding costs two lookups per byte.
+"""
+from __future__ import annotations
+
+import collections
+import typing
+
+class HPACKError(Exception):
+    """Malformed header block, the decoder's table may no longer match the peer's one (a connection error)"""
+
+STATIC_TABLE: typing.Final[tuple[tuple[str, str], ...]] = (
+    (":authority", ""), (":method", "GET"), (":method", "POST"),
+    (":path", "/"), (":path", "/index.html"), (":scheme", "http"),
+    (":scheme", "https"), (":status", "200"), (":status", "204"),
+    (":status", "206"), (":status", "304"), (":status", "400"),
+    (":status", "404"), (":status", "500"), ("accept-charset", ""),
+    ("accept-encoding", "gzip, deflate"), ("accept-language", ""), ("accept-ranges", ""),
+    ("accept", ""), ("access-control-allow-origin", ""), ("age", ""),
+    ("allow", ""), ("authorization", ""), ("cache-control", ""),
+    ("content-disposition", ""), ("content-encoding", ""), ("content-language", ""),
+    ("content-length", ""), ("content-location", ""), ("content-range", ""),
+    ("content-type", ""), ("cookie", ""), ("date", ""),
+    ("etag", ""), ("expect", ""), ("expires", ""),
+    ("from", ""), ("host", ""), ("if-match", ""),
+    ("if-modified-since", ""), ("if-none-match", ""), ("if-range", ""),
+    ("if-unmodified-since", ""), ("last-modified", ""), ("link", ""),
+    ("location", ""), ("max-forwards", ""), ("proxy-authenticate", ""),
+    ("proxy-authorization", ""), ("range", ""), ("referer", ""),
+    ("refresh", ""), ("retry-after", ""), ("server", ""),
+    ("set-cookie", ""), ("strict-transport-security", ""), ("transfer-encoding", ""),
+    ("user-agent", ""), ("vary", ""), ("via", ""),
+    ("www-authenticate", ""),
+)
+HUFFMAN_CODES: typing.Final[tuple[int, ...]] = (
+    0x1ff8, 0x7fffd8, 0xfffffe2, 0xfffffe3, 0xfffffe4, 0xfffffe5, 0xfffffe6, 0xfffffe7,
+    0xfffffe8, 0xffffea, 0x3ffffffc, 0xfffffe9, 0xfffffea, 0x3ffffffd, 0xfffffeb, 0xfffffec,
+    0xfffffed, 0xfffffee, 0xfffffef, 0xffffff0, 0xffffff1, 0xffffff2, 0x3ffffffe, 0xffffff3,
+    0xffffff4, 0xffffff5, 0xffffff6, 0xffffff7, 0xffffff8, 0xffffff9, 0xffffffa, 0xffffffb,
+    0x14, 0x3f8, 0x3f9, 0xffa, 0x1ff9, 0x15, 0xf8, 0x7fa,
+    0x3fa, 0x3fb, 0xf9, 0x7fb, 0xfa, 0x16, 0x17, 0x18,
+    0x0, 0x1, 0x2, 0x19, 0x1a, 0x1b, 0x1c, 0x1d,
+    0x1e, 0x1f, 0x5c, 0xfb, 0x7ffc, 0x20, 0xffb, 0x3fc,
+    0x1ffa, 0x21, 0x5d, 0x5e, 0x5f, 0x60, 0x61, 0x62,
+    0x63, 0x64, 0x65, 0x66, 0x67, 0x68, 0x69, 0x6a,
+    0x6b, 0x6c, 0x6d, 0x6e, 0x6f, 0x70, 0x71, 0x72,
+    0xfc, 0x73, 0xfd, 0x1ffb, 0x7fff0, 0x1ffc, 0x3ffc, 0x22,
+    0x7ffd, 0x3, 0x23, 0x4, 0x24, 0x5, 0x25, 0x26,
+    0x27, 0x6, 0x74, 0x75, 0x28, 0x29, 0x2a, 0x7,
+    0x2b, 0x76, 0x2c, 0x8, 0x9, 0x2d, 0x77, 0x78,
+    0x79, 0x7a, 0x7b, 0x7ffe, 0x7fc, 0x3ffd, 0x1ffd, 0xffffffc,
+    0xfffe6, 0x3fffd2, 0xfffe7, 0xfffe8, 0x3fffd3, 0x3fffd4, 0x3fffd5, 0x7fffd9,
+    0x3fffd6, 0x7fffda, 0x7fffdb, 0x7fffdc, 0x7fffdd, 0x7fffde, 0xffffeb, 0x7fffdf,
+    0xffffec, 0xffffed, 0x3fffd7, 0x7fffe0, 0xffffee, 0x7fffe1, 0x7fffe2, 0x7fffe3,
+    0x7fffe4, 0x1fffdc, 0x3fffd8, 0x7fffe5, 0x3fffd9, 0x7fffe6, 0x7fffe7, 0xffffef,
+    0x3fffda, 0x1fffdd, 0xfffe9, 0x3fffdb, 0x3fffdc, 0x7fffe8, 0x7fffe9, 0x1fffde,
+    0x7fffea, 0x3fffdd, 0x3fffde, 0xfffff0, 0x1fffdf, 0x3fffdf, 0x7fffeb, 0x7fffec,
+    0x1fffe0, 0x1fffe1, 0x3fffe0, 0x1fffe2, 0x7fffed, 0x3fffe1, 0x7fffee, 0x7fffef,
+    0xfffea, 0x3fffe2, 0x3fffe3, 0x3fffe4, 0x7ffff0, 0x3fffe5, 0x3fffe6, 0x7ffff1,
+    0x3ffffe0, 0x3ffffe1, 0xfffeb, 0x7fff1, 0x3fffe7, 0x7ffff2, 0x3fffe8, 0x1ffffec,
+    0x3ffffe2, 0x3ffffe3, 0x3ffffe4, 0x7ffffde, 0x7ffffdf, 0x3ffffe5, 0xfffff1, 0x1ffffed,
+    0x7fff2, 0x1fffe3, 0x3ffffe6, 0x7ffffe0, 0x7ffffe1, 0x3ffffe7, 0x7ffffe2, 0xfffff2,
+    0x1fffe4, 0x1fffe5, 0x3ffffe8, 0x3ffffe9, 0xffffffd, 0x7ffffe3, 0x7ffffe4, 0x7ffffe5,
+    0xfffec, 0xfffff3, 0xfffed, 0x1fffe6, 0x3fffe9, 0x1fffe7, 0x1fffe8, 0x7ffff3,
+    0x3fffea, 0x3fffeb, 0x1ffffee, 0x1ffffef, 0xfffff4, 0xfffff5, 0x3ffffea, 0x7ffff4,
+    0x3ffffeb, 0x7ffffe6, 0x3ffffec, 0x3ffffed, 0x7ffffe7, 0x7ffffe8, 0x7ffffe9, 0x7ffffea,
+    0x7ffffeb, 0xffffffe, 0x7ffffec, 0x7ffffed, 0x7ffffee, 0x7ffffef, 0x7fffff0, 0x3ffffee,
+)
+HUFFMAN_LENGTHS: typing.Final[tuple[int, ...]] = (
+    13, 23, 28, 28, 28, 28, 28, 28, 28, 24, 30, 28, 28, 30, 28, 28,
+    28, 28, 28, 28, 28, 28, 30, 28, 28, 28, 28, 28, 28, 28, 28, 28,
+    6, 10, 10, 12, 13, 6, 8, 11, 10, 10, 8, 11, 8, 6, 6, 6,
+    5, 5, 5, 6, 6, 6, 6, 6, 6, 6, 7, 8, 15, 6, 12, 10,
+    13, 6, 7, 7, 7, 7, 7, 7, 7, 7, 7, 7, 7, 7, 7, 7,
+    7, 7, 7, 7, 7, 7, 7, 7, 8, 7, 8, 13, 19, 13, 14, 6,
+    15, 5, 6, 5, 6, 5, 6, 6, 6, 5, 7, 7, 6, 6, 6, 5,
+    6, 7, 6, 5, 5, 6, 7, 7, 7, 7, 7, 15, 11, 14, 13, 28,
+    20, 22, 20, 20, 22, 22, 22, 23, 22, 23, 23, 23, 23, 23, 24, 23,
+    24, 24, 22, 23, 24, 23, 23, 23, 23, 21, 22, 23, 22, 23, 23, 24,
+    22, 21, 20, 22, 22, 23, 23, 21, 23, 22, 22, 24, 21, 22, 23, 23,
+    21, 21, 22, 21, 23, 22, 23, 23, 20, 22, 22, 22, 23, 22, 22, 23,
+    26, 26, 20, 19, 22, 23, 22, 25, 26, 26, 26, 27, 27, 26, 24, 25,
+    19, 21, 26, 27, 27, 26, 27, 24, 21, 21, 26, 26, 28, 27, 27, 27,
+    20, 24, 20, 21, 22, 21, 21, 23, 22, 22, 25, 25, 24, 24, 26, 23,
+    26, 27, 26, 26, 27, 27, 27, 27, 27, 28, 27, 27, 27, 27, 27, 26,
+)
+
+HUFFMAN_EOS: typing.Final[tuple[int, int]] = (0x3fffffff, 30)
+"""Code and length of the end of string symbol, which must never be decoded"""
+
+HUFFMAN_BITS: typing.Final[tuple[str, ...]] = tuple(format(code, f"0{length}b") for code, length in zip(HUFFMAN_CODES, HUFFMAN_LENGTHS))
+
+STATIC_FIELDS: typing.Final[dict[tuple[str, str], int]] = {}
+STATIC_NAMES: typing.Final[dict[str, int]] = {}
+
+for index, field in enumerate(STATIC_TABLE, 1):
+    STATIC_FIELDS.setdefault(field, index)
+    STATIC_NAMES.setdefault(field[0], index)
+
+del index, field
+
+ENTRY_OVERHEAD: typing.Final[int] = 32
+"""Size an entry takes in a dynamic table on top of its name and value (RFC 7541 4.1)"""
+
+NO_SYMBOL: typing.Final[int] = 256
+
+def build_huffman_decoder() -> tuple[tuple[int, ...], frozenset[int]]:
+    """
+    Transitions of the Huffman decoder by `state << 4 | nibble`, and the states a string may end in.
+
+    A state is an inner node of the code tree. A transition is `next_state << 9 | symbol` (`NO_SYMBOL`
+    if the nibble completes none, a code is at least 5 bits long so it completes at most one), or -1
+    if it completes the end of string symbol.
+    """
+    children: list[list[int]] = [[0, 0]]
+
+    for symbol, (code, length) in enumerate((*zip(HUFFMAN_CODES, HUFFMAN_LENGTHS), HUFFMAN_EOS)):
+        node = 0
+        for shift in range(length - 1, 0, -1):
+            bit = code >> shift & 1
+            if children[node][bit] == 0:
+                children[node][bit] = len(children)
+                children.append([0, 0])
+            node = children[node][bit]
+
+        # Leaves are stored negated, so none of them can be taken for the root
+        children[node][code & 1] = -symbol - 1
+
+    transitions: list[int] = []
+    for state in range(len(children)):
+        for nibble in range(16):
+            node, emitted, eos = state, NO_SYMBOL, False
+
+            for shift in (3, 2, 1, 0):
+                if (child:=children[node][nibble >> shift & 1]) >= 0:
+                    node = child
+                elif (emitted:=-child - 1) == len(HUFFMAN_CODES):
+                    eos = True
+                else:
+                    node = 0
+
+            transitions.append(-1 if eos else node << 9 | emitted)
+
+    # The padding is the start of the end of string symbol, less than a byte of ones (RFC 7541 5.2)
+    accepting, node = {0}, 0
+    for _ in range(7):
+        node = children[node][1]
+        accepting.add(node)
+
+    return tuple(transitions), frozenset(accepting)
+
+HUFFMAN_TRANSITIONS, HUFFMAN_ACCEPTING = build_huffman_decoder()
+
+def huffman_encode(data: bytes) -> bytes:
+    if len(data) == 0:
+        return data
+
+    bits = "".join(map(HUFFMAN_BITS.__getitem__, data))
+    bits += "1" * (-len(bits) % 8)
+
+    return int(bits, 2).to_bytes(len(bits) // 8, "big")
+
+def huffman_length(data: bytes) -> int:
+    return (sum(map(HUFFMAN_LENGTHS.__getitem__, data)) + 7) // 8
+
+def huffman_decode(data: bytes) -> bytes:
+    transitions = HUFFMAN_TRANSITIONS
+    decoded = bytearray()
+    state = 0
+
+    for byte in data:
+        if (transition:=transitions[state << 4 | byte >> 4]) < 0:
+            raise HPACKError("Huffman coded string contains the end of string symbol!")
+        if (symbol:=transition & 0x1ff) != NO_SYMBOL:
+            decoded.append(symbol)
+
+        if (transition:=transitions[(transition >> 9) << 4 | byte & 0xf]) < 0:
+            raise HPACKError("Huffman coded string contains the end of string symbol!")
+        if (symbol:=transition & 0x1ff) != NO_SYMBOL:
+            decoded.append(symbol)
+
+        state = transition >> 9
+
+    if state not in HUFFMAN_ACCEPTING:
+        raise HPACKError("Invalid padding of a Huffman coded string!")
+
+    return bytes(decoded)
+
+def encode_integer(value: int, prefix_bits: int, flags: int = 0) -> bytes:
+    """`value` with an N-bit prefix, `flags` are the bits of the first byte above the prefix (RFC 7541 5.1)"""
+    limit = (1 << prefix_bits) - 1
+
+    if value < limit:
+        return bytes((flags | value,))
+
+    encoded = bytearray((flags | limit,))
+    value -= limit
+    while value >= 0x80:
+        encoded.append(value & 0x7f | 0x80)
+        value >>= 7
+    encoded.append(value)
+
+    return bytes(encoded)
+
+def decode_integer(data: bytes, pos: int, prefix_bits: int) -> tuple[int, int]:
+    """Integer with an N-bit prefix starting at `pos`, and the position after it"""
+    limit = (1 << prefix_bits) - 1
+
+    if (value:=data[pos] & limit) < limit:
+        return value, pos + 1
+
+    shift = 0
+    for pos in range(pos + 1, min(len(data), pos + 6)):
+        value += (data[pos] & 0x7f) << shift
+        if data[pos] & 0x80 == 0:
+            return value, pos + 1
+        shift += 7
+
+    # Longer integers than 5 continuation bytes would be larger than any size or index in use
+    raise HPACKError("Truncated or oversized integer!")
+
+def encode_string(value: bytes) -> bytes:
+    """String literal, Huffman coded if that makes it shorter"""
+    if (length:=huffman_length(value)) < len(value):
+        return encode_integer(length, 7, 0x80) + huffman_encode(value)
+
+    return encode_integer(len(value), 7) + value
+
+def decode_string(data: bytes, pos: int) -> tuple[bytes, int]:
+    huffman = data[pos] & 0x80
+    length, pos = decode_integer(data, pos, 7)
+
+    if pos + length > len(data):
+        raise HPACKError("Truncated string literal!")
+
+    value = data[pos:pos + length]
+    return huffman_decode(value) if huffman else value, pos + length
+
+class Decoder:
+    """
+    Decodes the header blocks of a connection, in the order they were received.
+
+    `max_table_size` is the table size the server announced in its settings, the client may use
+    a smaller one but never a larger one.
+    """
+    table: collections.deque[tuple[str, str]]
+    """Dynamic table, newest entry first"""
+    table_size: int
+    current_max_size: int
+    max_table_size: int
+
+    def __init__(self: typing.Self, max_table_size: int = 4096) -> None:
+        self.table = collections.deque()
+        self.table_size = 0
+        self.current_max_size = max_table_size
+        self.max_table_size = max_table_size
+
+    def decode(self: typing.Self, block: bytes) -> list[tuple[str, str]]:
+        """
+        Name and value of every field of a header block, decoded as Latin-1.
+
+        Raises `HPACKError` for a malformed block, after which the connection can't be used anymore.
+        """
+        fields: list[tuple[str, str]] = []
+        pos = 0
+
+        try:
+            while pos < len(block):
+                byte = block[pos]
+
+                if byte & 0x80:
+                    index, pos = decode_integer(block, pos, 7)
+                    fields.append(self.field(index))
+                elif byte & 0x40:
+                    name, value, pos = self.literal(block, pos, 6)
+                    fields.append((name, value))
+                    self.insert(name, value)
+                elif byte & 0x20:
+                    if len(fields) != 0:
+                        raise HPACKError("Dynamic table size update after the first field of a block!")
+
+                    size, pos = decode_integer(block, pos, 5)
+                    if size > self.max_table_size:
+                        raise HPACKError(f"Dynamic table size update to {size} exceeds {self.max_table_size}!")
+
+                    self.current_max_size = size
+                    self.evict(0)
+                else:
+                    # Never indexed (0x10) and without indexing only differ for intermediaries
+                    name, value, pos = self.literal(block, pos, 4)
+                    fields.append((name, value))
+        except IndexError:
+            raise HPACKError("Truncated header block!") from None
+
+        return fields
+
+    def field(self: typing.Self, index: int) -> tuple[str, str]:
+        if 0 < index <= len(STATIC_TABLE):
+            return STATIC_TABLE[index - 1]
+
+        if index == 0 or index - len(STATIC_TABLE) > len(self.table):
+            raise HPACKError(f"Invalid header table index {index}!")
+
+        return self.table[index - len(STATIC_TABLE) - 1]
+
+    def literal(self: typing.Self, block: bytes, pos: int, prefix_bits: int) -> tuple[str, str, int]:
+        index, pos = decode_integer(block, pos, prefix_bits)
+
+        if index != 0:
+            name = self.field(index)[0]
+        else:
+            raw_name, pos = decode_string(block, pos)
+            name = raw_name.decode("latin-1")
+
+        value, pos = decode_string(block, pos)
+
+        return name, value.decode("latin-1"), pos
+
+    def insert(self: typing.Self, name: str, value: str) -> None:
+        size = len(name) + len(value) + ENTRY_OVERHEAD
+        self.evict(size)
+
+        # An entry larger than the whole table just empties it (RFC 7541 4.4)
+        if size <= self.current_max_size:
+            self.table.appendleft((name, value))
+            self.table_size += size
+
+    def evict(self: typing.Self, room: int) -> None:
+        """Evicts the oldest entries until `room` more bytes fit"""
+        while self.table_size + room > self.current_max_size and len(self.table) != 0:
+            name, value = self.table.pop()
+            self.table_size -= len(name) + len(value) + ENTRY_OVERHEAD
+
+class Encoder:
+    """
+    Encodes the header blocks of a connection, which must be sent in the order they were encoded.
+
+    Fields are found in the static table, then in the dynamic one, where they are added unless their
+    value changes with every response (`UNINDEXED`) or must not be compressed with others (`NEVER_INDEXED`).
+    """
+    UNINDEXED: typing.ClassVar[frozenset[str]] = frozenset({":status", "content-length", "content-range", "age"})
+    NEVER_INDEXED: typing.ClassVar[frozenset[str]] = frozenset({"set-cookie", "authorization", "proxy-authorization"})
+    """Secrets, which would otherwise be exposed to guessing by compression oracles such as CRIME"""
+
+    table: collections.deque[tuple[str, str]]
+    table_size: int
+    max_table_size: int
+    inserted: int
+    """Number of entries ever inserted, the id of the newest one"""
+    fields: dict[tuple[str, str], int]
+    names: dict[str, int]
+    """Id of the newest entry of every field and every name in the dynamic table"""
+    size_update: int | None
+    """Table size to announce at the start of the next block"""
+
+    def __init__(self: typing.Self, max_table_size: int = 4096) -> None:
+        self.table = collections.deque()
+        self.table_size = 0
+        self.max_table_size = max_table_size
+        self.inserted = 0
+        self.fields = {}
+        self.names = {}
+        self.size_update = None
+
+    def set_max_table_size(self: typing.Self, size: int) -> None:
+        """Applies the table size the client announced in its settings, it's only an upper bound for the encoder"""
+        size = min(size, 4096)
+
+        if size != self.max_table_size:
+            self.max_table_size = size
+            self.size_update = size if self.size_update is None else min(self.size_update, size)
+            self.evict(0)
+
+    def encode(self: typing.Self, fields: typing.Iterable[tuple[str, str]]) -> bytes:
+        """Header block of the fields, whose names must be lowercase"""
+        block = bytearray()
+
+        if self.size_update is not None:
+            block += encode_integer(self.size_update, 5, 0x20)
+            self.size_update = None
+
+        for name, value in fields:
+            if (index:=STATIC_FIELDS.get((name, value))) is not None or (index:=self.index(self.fields.get((name, value)))) is not None:
+                block += encode_integer(index, 7, 0x80)
+                continue
+
+            if (name_index:=STATIC_NAMES.get(name)) is None:
+                name_index = self.index(self.names.get(name)) or 0
+
+            if name in self.NEVER_INDEXED:
+                block += encode_integer(name_index, 4, 0x10)
+            elif name in self.UNINDEXED:
+                block += encode_integer(name_index, 4)
+            else:
+                block += encode_integer(name_index, 6, 0x40)
+                self.insert(name, value)
+
+            if name_index == 0:
+                block += encode_string(name.encode("latin-1"))
+            block += encode_string(value.encode("latin-1"))
+
+        return bytes(block)
+
+    def index(self: typing.Self, entry_id: int | None) -> int | None:
+        """Index of the entry with `entry_id`, if it wasn't evicted"""
+        if entry_id is None or self.inserted - entry_id >= len(self.table):
+            return None
+
+        return len(STATIC_TABLE) + 1 + self.inserted - entry_id
+
+    def insert(self: typing.Self, name: str, value: str) -> None:
+        size = len(name) + len(value) + ENTRY_OVERHEAD
+        self.evict(size)
+
+        if size > self.max_table_size:
+            return
+
+        self.table.appendleft((name, value))
+        self.table_size += size
+        self.inserted += 1
+        self.fields[name, value] = self.names[name] = self.inserted
+
+    def evict(self: typing.Self, room: int) -> None:
+        while self.table_size + room > self.max_table_size and len(self.table) != 0:
+            name, value = self.table.pop()
+            self.table_size -= len(name) + len(value) + ENTRY_OVERHEAD
+
+            # Lookups of an evicted id fail in `index`, only the stale keys are dropped here
+            evicted = self.inserted - len(self.table)
+            if self.fields.get((name, value)) == evicted:
+                del self.fields[name, value]
+            if self.names.get(name) == evicted:
+                del self.names[name]
@@ -1,56 +1,223 @@
+import asyncio
 import dataclasses
+import functools
+import mmap
 import os
 import time
 import urllib.parse
-import email.utils
+import zlib
 import typing
 
 from http import HTTPMethod, HTTPStatus
 
 from pformat import PP_Repr
-from http_constants import CRLF
+from http_constants import CRLF, HTTPError
 from http_headers import HTTPHeaders
+from http_conditional import http_date
+from http_body import RequestBody
+from http_compression import negotiate
+from http_router import RouteMatch
+from http_parser import parse_cookies, parse_header_lines, parse_request_line, split_target
 
 @dataclasses.dataclass(repr=False)
 class HTTPRequest(PP_Repr):
     method: HTTPMethod           = dataclasses.field(init=False)
     target: str                  = dataclasses.field(init=False)
-    query_params: dict[str, str] = dataclasses.field(init=False)
+    """Percent-decoded path of the request target"""
+    query: str                   = dataclasses.field(default="")
+    """Query string of the request target, still percent-encoded"""
     version: tuple[int, int]     = dataclasses.field(default=(1, 1))
     headers: HTTPHeaders         = dataclasses.field(default_factory=HTTPHeaders)
-    body: bytes                  = dataclasses.field(default=CRLF)
+    body: RequestBody            = dataclasses.field(default_factory=RequestBody)
+
+    route: RouteMatch | None     = dataclasses.field(default=None)
+    path_params: dict[str, typing.Any] = dataclasses.field(default_factory=dict)
+    """Parameters of the matched route, e.g. `{"user_id": 42}` for `/users/{user_id:int}`"""
 
     def parse_request(self: typing.Self, request: bytes) -> None:
         request_lines = request.splitlines()
 
         head_end = request_lines.index(b'')
 
-        request_head, self.body = CRLF.join(request_lines[:head_end]), CRLF.join(request_lines[head_end:])
-        self.parse_request_head(request_head.decode())
+        request_head, request_body = CRLF.join(request_lines[:head_end]), CRLF.join(request_lines[head_end:])
+        self.parse_request_head(request_head)
+        self.parse_request_body(request_body)
 
 
-    def parse_request_head(self: typing.Self, request_head: str) -> None:
-        request_line, *headers = request_head.splitlines()
+    def parse_request_head(self: typing.Self, request_head: bytes | str) -> None:
+        """
+        Parses the request line and the header lines (each ending with CRLF, as `RequestReader.next_head` returns them).
 
-        method, target_and_params, version = request_line.split()
-        try:
-            target, params = target_and_params.split("?")
-        except ValueError:
-            target = target_and_params
-            params = ""
-        target = target.split("#")[0]
-
-        self.method       = HTTPMethod(method)
-        self.target       = urllib.parse.unquote(target)
-        self.query_params = dict(tuple(param.split("=")) for param in params.split("&")) if len(params) != 0 else dict()
-        self.version      = tuple(map(int, version.split("/")[1].split(".")))
-
-        for line in headers:
-            header_name, header_content = line.split(':', maxsplit=1)
-            self.headers[header_name] = header_content.strip()
+        Raises `HTTPError` if the head is malformed, so the server answers with 400 and closes the connection.
+        """
+        if isinstance(request_head, str):
+            request_head = request_head.encode("latin-1")
+
+        # Empty lines before the request line are left over by some clients after a body (RFC 9112 2.2)
+        request_line, _, header_lines = request_head.lstrip(CRLF).partition(CRLF)
+
+        self.method, target, self.version = parse_request_line(request_line)
+        self.target, self.query = split_target(target)
+
+        parse_header_lines(header_lines, self.headers)
+
+        if self.version >= (1, 1) and len(self.headers.get_all("Host")) != 1:
+            raise HTTPError("HTTP/1.1 request without exactly one Host header!")
+
+    @functools.cached_property
+    def query_lists(self: typing.Self) -> dict[str, list[str]]:
+        """Every value of every query parameter, percent-decoded when first used"""
+        return urllib.parse.parse_qs(self.query, keep_blank_values=True)
+
+    @functools.cached_property
+    def query_params(self: typing.Self) -> dict[str, str]:
+        """Last value of every query parameter"""
+        return {name: values[-1] for name, values in self.query_lists.items()}
+
+    @functools.cached_property
+    def cookies(self: typing.Self) -> dict[str, str]:
+        """Cookies sent with the request, parsed when first used"""
+        return parse_cookies(self.headers.get_all("Cookie"))
     
     def parse_request_body(self: typing.Self, request_body: bytes) -> None:
-        self.body = request_body
+        self.body = RequestBody.from_bytes(request_body)
+
+@dataclasses.dataclass
+class FileBody:
+    """
+    File-backed response body.
+
+    It is sent with `sendfile` or in chunks of a memory map, so it never has to be read into memory.
+    Both use explicit offsets, so the file can be shared by responses sent at the same time.
+    """
+    file: typing.BinaryIO
+    offset: int
+    length: int
+    release: typing.Callable[[], None] | None = None
+    """Called instead of closing the file when it is shared, e.g. held open by the static file cache"""
+
+    def chunks(self: typing.Self, chunk_size: int = 64 * 1024) -> typing.Iterator[bytes]:
+        if self.length == 0:
+            return
+
+        with mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for offset in range(self.offset, self.offset + self.length, chunk_size):
+                yield mapped[offset:min(offset + chunk_size, self.offset + self.length)]
+
+    def close(self: typing.Self) -> None:
+        if self.release is not None:
+            self.release()
+        else:
+            self.file.close()
+
+    def __enter__(self: typing.Self) -> typing.Self:
+        return self
+    
+    def __exit__(self: typing.Self, *args) -> None:
+        self.close()
+
+class ResponseStream:
+    """
+    Response body produced by an iterator or async iterator while it is being sent.
+
+    Every piece of the source is sent as soon as it is produced: as a chunk with the chunked transfer
+    coding (followed by `trailers` once the source is exhausted), or as it is for close-delimited
+    HTTP/1.0 responses. With `gzip` the stream is compressed on the fly, flushing the compressor after
+    every piece so nothing is held back.
+
+    A source that raises aborts the stream with `ConnectionAbortedError`, the response can't be
+    completed, so the server drops the connection.
+    """
+    source: typing.Iterable[bytes] | typing.AsyncIterable[bytes]
+    chunked: bool
+    trailers: HTTPHeaders
+    compressor: typing.Any
+
+    def __init__(self: typing.Self,
+                 source: typing.Iterable[bytes] | typing.AsyncIterable[bytes],
+                 chunked: bool = True,
+                 trailers: HTTPHeaders | None = None,
+                 gzip: bool = False,
+                 gzip_level: int = 6) -> None:
+        self.source = source
+        self.chunked = chunked
+        self.trailers = trailers if trailers is not None else HTTPHeaders()
+        # wbits 31 is the gzip container
+        self.compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 31) if gzip else None
+
+    @property
+    def is_async(self: typing.Self) -> bool:
+        return isinstance(self.source, typing.AsyncIterable)
+
+    def frame(self: typing.Self, data: bytes) -> bytes:
+        if self.compressor is not None:
+            data = self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+        return self.chunk(data)
+
+    def chunk(self: typing.Self, data: bytes) -> bytes:
+        # An empty chunk would end the body
+        if len(data) == 0 or not self.chunked:
+            return data
+
+        return b"%x\r\n" % len(data) + data + CRLF
+
+    def end(self: typing.Self) -> bytes:
+        tail = self.compressor.flush(zlib.Z_FINISH) if self.compressor is not None else bytes()
+
+        if not self.chunked:
+            return tail
+
+        trailers = b"".join(f"{name}: {value}\r\n".encode() for name, value in self.trailers.items())
+        return self.chunk(tail) + b"0\r\n" + trailers + CRLF
+
+    def __iter__(self: typing.Self) -> typing.Iterator[bytes]:
+        """Wire bytes of the stream, an async source is driven by a private event loop"""
+        if self.is_async:
+            with asyncio.Runner() as runner:
+                iterator = aiter(self.source)
+                while (piece:=self.next_piece(lambda: runner.run(anext(iterator, None)))) is not None:
+                    if len(framed:=self.frame(piece)) != 0:
+                        yield framed
+        else:
+            iterator = iter(self.source)
+            while (piece:=self.next_piece(lambda: next(iterator, None))) is not None:
+                if len(framed:=self.frame(piece)) != 0:
+                    yield framed
+
+        yield self.end()
+
+    async def __aiter__(self: typing.Self) -> typing.AsyncIterator[bytes]:
+        """Wire bytes of the stream, a sync source is advanced in a thread so it can't block the event loop"""
+        if self.is_async:
+            iterator = aiter(self.source)
+            while True:
+                try:
+                    piece = await anext(iterator, None)
+                except Exception as e:
+                    self.abort(e)
+
+                if piece is None:
+                    break
+                if len(framed:=self.frame(piece)) != 0:
+                    yield framed
+        else:
+            iterator = iter(self.source)
+            while (piece:=await asyncio.to_thread(self.next_piece, lambda: next(iterator, None))) is not None:
+                if len(framed:=self.frame(piece)) != 0:
+                    yield framed
+
+        yield self.end()
+
+    def next_piece(self: typing.Self, advance: typing.Callable[[], bytes | None]) -> bytes | None:
+        try:
+            return advance()
+        except Exception as e:
+            self.abort(e)
+
+    def abort(self: typing.Self, error: Exception) -> typing.NoReturn:
+        print(f"[ERROR]: Response stream failed: {error!r}")
+        raise ConnectionAbortedError("Response stream failed") from error
 
 @dataclasses.dataclass(repr=False)
 class HTTPResponse(PP_Repr):
@@ -59,21 +226,55 @@ class HTTPResponse(PP_Repr):
 
     head: bytes                   = dataclasses.field(init=False)
     body: bytes                   = dataclasses.field(init=False)
+    body_file: FileBody | None    = dataclasses.field(default=None)
+    body_stream: ResponseStream | None = dataclasses.field(default=None)
+
+    keep_alive: bool              = dataclasses.field(default=False)
+    """Whether the connection stays open after this response, decided by the server"""
 
     gzip: bool                    = dataclasses.field(default=True)
 
     def construct_head(self: typing.Self, request: HTTPRequest, file_stat: os.stat_result | None) -> None:
         head = f"HTTP/{request.version[0]}.{request.version[1]} {self.status.value} {self.status.name}\r\n".encode()
 
-        self.headers["Date"] = email.utils.formatdate(time.time(), localtime=True)
+        self.headers["Date"] = http_date(time.time())
         if file_stat is not None:
-            self.headers["Last-Modified"] = email.utils.formatdate(file_stat.st_mtime, localtime=True)
+            self.headers["Last-Modified"] = http_date(file_stat.st_mtime)
 
-        for header_name, header_value in self.headers.get_headers().items():
+        for header_name, header_value in self.headers.items():
             head += f"{header_name}: {header_value}\r\n".encode()
 
         self.head = head
 
+    def stream(self: typing.Self, request: HTTPRequest, body: typing.Iterable[bytes] | typing.AsyncIterable[bytes], gzip: bool = False) -> ResponseStream:
+        """
+        Makes `body` the body of the response, sent while it is produced. Call it before `construct_head`.
+
+        HTTP/1.1 clients get it chunked, HTTP/1.0 ones until the connection closes and HTTP/2 ones in
+        DATA frames, which need no transfer coding. With `gzip` it is
+        compressed on the fly if the client accepts gzip. Trailers set on the returned stream (e.g. by
+        the generator itself) are sent after the last chunk.
+        """
+        chunked = (1, 1) <= request.version < (2, 0)
+        gzip = gzip and self.gzip and negotiate(request.headers["Accept-Encoding"], ("gzip",)) == "gzip"
+
+        self.headers["Content-Length"] = None
+        if chunked:
+            self.headers["Transfer-Encoding"] = "chunked"
+        if gzip:
+            self.headers["Content-Encoding"] = "gzip"
+            self.headers["Vary"] = "Accept-Encoding"
+
+        self.body = bytes()
+        self.body_stream = ResponseStream(body, chunked, gzip=gzip)
+
+        return self.body_stream
+
+    def add_header(self: typing.Self, header_name: str, header_value: str) -> None:
+        """Adds a header to the already constructed head"""
+        self.headers[header_name] = header_value
+        self.head += f"{header_name}: {header_value}\r\n".encode()
+
     def encode_head(self: typing.Self) -> bytes:
         return self.head + b"\r\n"
     
@@ -0,0 +1,325 @@
+"""
+Metrics
+
+Counters and histograms of the server, exported in the Prometheus text format.
+
+Every thread adds to a value array of its own without taking a lock and a scrape sums them,
+so instrumenting a request costs a handful of list item additions on the hot path.
+"""
+from __future__ import annotations
+
+import dataclasses
+import threading
+import typing
+import weakref
+
+from bisect import bisect_left
+
+if typing.TYPE_CHECKING:
+    from http_cache import StaticFileCache
+    from http_server import HTTPServer
+
+CONTENT_TYPE: typing.Final[str] = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS: typing.Final[tuple[float, ...]] = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+"""Upper bounds in seconds, from a cached file answered over loopback to a slow client"""
+
+Labels = tuple[typing.Any, ...]
+"""Label values in the order of the metric's label names, rendered with `str` only when scraped"""
+
+class Metric:
+    """
+    A metric family. Every combination of label values gets its own slots in the value arrays of
+    the registry, one for a counter and one per bucket plus one for the sum for a histogram.
+    """
+    kind: typing.ClassVar[str]
+    width: int
+    """Slots taken by every combination of label values"""
+
+    registry: MetricsRegistry
+    name: str
+    help: str
+    labelnames: tuple[str, ...]
+    slots: dict[Labels, int]
+
+    def __init__(self: typing.Self, registry: MetricsRegistry, name: str, help: str, labelnames: tuple[str, ...] = ()) -> None:
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.slots = {}
+        self.width = 1
+
+    def slot(self: typing.Self, labels: Labels = ()) -> int:
+        """First slot of the values of `labels`, allocated on first use"""
+        if (slot:=self.slots.get(labels)) is None:
+            with self.registry.lock:
+                if (slot:=self.slots.get(labels)) is None:
+                    slot = self.slots[labels] = self.registry.allocate(self.width)
+
+        return slot
+
+    def samples(self: typing.Self, shards: list[list[float]]) -> typing.Iterator[tuple[str, tuple[str, ...], Labels, float]]:
+        """`(suffix, label names, label values, value)` of every sample of the metric"""
+        for labels, slot in sorted(self.slots.copy().items(), key=lambda item: tuple(map(str, item[0]))):
+            yield "", self.labelnames, labels, sum_slot(shards, slot)
+
+    def render(self: typing.Self, shards: list[list[float]]) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+        for suffix, labelnames, labels, value in self.samples(shards):
+            lines.append(f"{self.name}{suffix}{format_labels(labelnames, labels)} {format_value(value)}")
+
+        return "\n".join(lines) + "\n"
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self: typing.Self, labels: Labels = (), amount: float = 1) -> None:
+        slot = self.slot(labels)
+        self.registry.values()[slot] += amount
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    buckets: tuple[float, ...]
+
+    def __init__(self: typing.Self, registry: MetricsRegistry, name: str, help: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        super().__init__(registry, name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # A count for every bucket, the `+Inf` one included, followed by the sum
+        self.width = len(self.buckets) + 2
+
+    def observe(self: typing.Self, value: float, labels: Labels = ()) -> None:
+        slot = self.slot(labels)
+        observe(self.registry.values(), slot, self.buckets, value)
+
+    @typing.override
+    def samples(self: typing.Self, shards: list[list[float]]) -> typing.Iterator[tuple[str, tuple[str, ...], Labels, float]]:
+        bucket_labelnames = (*self.labelnames, "le")
+
+        for labels, slot in sorted(self.slots.copy().items(), key=lambda item: tuple(map(str, item[0]))):
+            cumulative = 0
+
+            for i, bound in enumerate((*self.buckets, float("inf"))):
+                cumulative += sum_slot(shards, slot + i)
+                yield "_bucket", bucket_labelnames, (*labels, bound), cumulative
+
+            yield "_sum", self.labelnames, labels, sum_slot(shards, slot + len(self.buckets) + 1)
+            yield "_count", self.labelnames, labels, cumulative
+
+def observe(values: list[float], slot: int, buckets: tuple[float, ...], value: float) -> None:
+    # Buckets are inclusive upper bounds, past the last one is the `+Inf` bucket
+    values[slot + bisect_left(buckets, value)] += 1
+    values[slot + len(buckets) + 1] += value
+
+class CallbackMetric(Metric):
+    """Gauge or counter whose value is read from somewhere else (e.g. a server) when scraped"""
+    callback: typing.Callable[[], float | dict[Labels, float]]
+
+    def __init__(self: typing.Self, registry: MetricsRegistry, name: str, help: str, kind: str, callback: typing.Callable[[], float | dict[Labels, float]], labelnames: tuple[str, ...] = ()) -> None:
+        super().__init__(registry, name, help, labelnames)
+        self.kind = kind
+        self.callback = callback
+
+    @typing.override
+    def samples(self: typing.Self, shards: list[list[float]]) -> typing.Iterator[tuple[str, tuple[str, ...], Labels, float]]:
+        values = self.callback()
+
+        if not isinstance(values, dict):
+            values = {(): values}
+
+        for labels, value in values.items():
+            yield "", self.labelnames, labels, value
+
+class MetricsRegistry:
+    """
+    The metrics of a process and their values.
+
+    Every thread adds to a value array of its own (its shard) without taking a lock, a scrape sums
+    the shards slot by slot. Slots are allocated to metrics and label values as they are first used.
+    """
+    metrics: dict[str, Metric]
+    size: int
+    """Slots allocated so far, shards grow to it lazily"""
+    shards: list[list[float]]
+    local: threading.local
+    lock: threading.Lock
+    """Taken to allocate slots and shards, never to update a value"""
+
+    def __init__(self: typing.Self) -> None:
+        self.metrics = {}
+        self.size = 0
+        self.shards = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def values(self: typing.Self) -> list[float]:
+        """Shard of the calling thread, long enough for every slot allocated so far"""
+        try:
+            values = self.local.values
+        except AttributeError:
+            values = self.local.values = []
+
+            with self.lock:
+                self.shards.append(values)
+
+        if len(values) < self.size:
+            values.extend([0] * (self.size - len(values)))
+
+        return values
+
+    def allocate(self: typing.Self, width: int) -> int:
+        """Allocates `width` slots, the caller holds `lock`"""
+        slot = self.size
+        self.size += width
+
+        return slot
+
+    def register[M: Metric](self: typing.Self, metric: M) -> M:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name!r} is already registered!")
+
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self: typing.Self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(self, name, help, labelnames))
+
+    def histogram(self: typing.Self, name: str, help: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(self, name, help, labelnames, buckets))
+
+    def callback(self: typing.Self, name: str, help: str, kind: str, callback: typing.Callable[[], float | dict[Labels, float]], labelnames: tuple[str, ...] = ()) -> CallbackMetric:
+        return self.register(CallbackMetric(self, name, help, kind, callback, labelnames))
+
+    def render(self: typing.Self) -> str:
+        """Every metric in the Prometheus text exposition format"""
+        with self.lock:
+            shards = self.shards.copy()
+
+        return "".join(metric.render(shards) for metric in self.metrics.values())
+
+def sum_slot(shards: list[list[float]], slot: int) -> float:
+    # A shard that didn't grow to the slot yet never added to it
+    return sum(shard[slot] for shard in shards if slot < len(shard))
+
+def format_labels(labelnames: tuple[str, ...], labels: Labels) -> str:
+    if len(labelnames) == 0:
+        return ""
+
+    return "{" + ",".join(f'{name}="{format_label(value)}"' for name, value in zip(labelnames, labels)) + "}"
+
+def format_label(value: typing.Any) -> str:
+    if isinstance(value, float):
+        return format_value(value)
+
+    return str(value).replace("\\", r"\\").replace("\n", r"\n").replace('"', r"\"")
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+@dataclasses.dataclass(slots=True)
+class RequestTiming:
+    """`time.perf_counter` timestamps of the phases of a request and the bytes it moved"""
+    start: float
+    """Accept for the first request of a connection, the arrival of its first byte for the others"""
+    head: float
+    """Head parsed"""
+    handler: float = 0.0
+    """Body read and response generated"""
+
+    received: int = 0
+    sent: int = 0
+
+class ServerMetrics:
+    """
+    The metrics of the server engines and the handler.
+
+    Every server of a process shares `METRICS` unless its handler has other ones, a prefork
+    worker process exports only its own.
+    """
+    registry: MetricsRegistry
+    servers: weakref.WeakSet[HTTPServer]
+    caches: weakref.WeakSet[StaticFileCache]
+
+    def __init__(self: typing.Self, registry: MetricsRegistry | None = None) -> None:
+        self.registry = registry = registry if registry is not None else MetricsRegistry()
+        self.servers = weakref.WeakSet()
+        self.caches = weakref.WeakSet()
+
+        self.requests = registry.counter("http_requests_total", "Requests answered, by method and status.", ("method", "status"))
+        self.errors = registry.counter("http_request_errors_total", "Requests refused before reaching the handler, by status.", ("status",))
+        self.reused = registry.counter("http_keep_alive_requests_total", "Requests served on an already used persistent connection.")
+        self.received = registry.counter("http_request_bytes_total", "Bytes of request heads and bodies received.")
+        self.sent = registry.counter("http_response_bytes_total", "Bytes of responses sent.")
+        self.compression_in = registry.counter("http_compression_input_bytes_total", "Bytes of representations served with a content coding, before coding.", ("coding",))
+        self.compression_out = registry.counter("http_compression_output_bytes_total", "Bytes of representations served with a content coding, after coding.", ("coding",))
+        self.tls_handshakes = registry.counter("http_tls_handshakes_total", "TLS handshakes, by result: full, resumed or failed.", ("result",))
+        self.timeouts = registry.counter("http_connection_timeouts_total", "Connections closed for missing a deadline, by phase: handshake, idle, head, body or write.", ("phase",))
+
+        self.duration = registry.histogram("http_request_duration_seconds", "From the start of a request to its last byte sent.")
+        self.phases = registry.histogram("http_request_phase_seconds", "Time spent reading the head, in the handler (reading the body included) and sending the response.", ("phase",))
+
+        self.received_slot, self.sent_slot, self.reused_slot = self.received.slot(), self.sent.slot(), self.reused.slot()
+        self.duration_slot = self.duration.slot()
+        self.head_slot, self.handler_slot, self.send_slot = (self.phases.slot((phase,)) for phase in ("head", "handler", "send"))
+
+        registry.callback("http_connections_active", "Open client connections.", "gauge", lambda: sum(server.connection_count() for server in tuple(self.servers)))
+        registry.callback("http_connections_rejected_total", "Connections refused by admission control, with 503 or with 429 over the per-IP limit.", "counter", lambda: sum(server.rejected for server in tuple(self.servers)))
+        registry.callback("http_static_cache_requests_total", "Static file cache lookups, by result: hit, miss or not_found for a remembered missing file.", "counter", self.cache_requests, ("result",))
+        registry.callback("http_static_cache_bytes", "Bytes held by the static file cache.", "gauge", lambda: sum(cache.size for cache in tuple(self.caches)))
+
+    def track(self: typing.Self, server: HTTPServer) -> None:
+        """Includes the connections of `server` and its handler's file cache in the metrics"""
+        self.servers.add(server)
+        self.caches.add(server.handler.cache)
+
+    def cache_requests(self: typing.Self) -> dict[Labels, float]:
+        caches = tuple(self.caches)
+
+        return {
+            ("hit",): sum(cache.hits for cache in caches),
+            ("miss",): sum(cache.misses for cache in caches),
+            ("not_found",): sum(cache.not_found_hits for cache in caches),
+        }
+
+    def observe_request(self: typing.Self, method: str, status: int, timing: RequestTiming, served: int, end: float) -> None:
+        """Records a request whose last byte was sent at `end`"""
+        # Runs for every request, so it works on the slots directly instead of going through the metrics.
+        # Allocating a slot grows the shards, so it comes first
+        if (slot:=self.requests.slots.get((method, status))) is None:
+            slot = self.requests.slot((method, status))
+
+        values = self.registry.values()
+        buckets = self.duration.buckets
+
+        values[slot] += 1
+        values[self.received_slot] += timing.received
+        values[self.sent_slot] += timing.sent
+        if served > 1:
+            values[self.reused_slot] += 1
+
+        # `observe` written out, a call per histogram costs about as much as the update itself
+        elapsed, head, handler, send = end - timing.start, timing.head - timing.start, timing.handler - timing.head, end - timing.handler
+        sum_offset = len(buckets) + 1
+
+        values[self.duration_slot + bisect_left(buckets, elapsed)] += 1
+        values[self.duration_slot + sum_offset] += elapsed
+        values[self.head_slot + bisect_left(buckets, head)] += 1
+        values[self.head_slot + sum_offset] += head
+        values[self.handler_slot + bisect_left(buckets, handler)] += 1
+        values[self.handler_slot + sum_offset] += handler
+        values[self.send_slot + bisect_left(buckets, send)] += 1
+        values[self.send_slot + sum_offset] += send
+
+    def observe_compression(self: typing.Self, coding: str, size: int, encoded_size: int) -> None:
+        self.compression_in.inc((coding,), size)
+        self.compression_out.inc((coding,), encoded_size)
+
+    def render(self: typing.Self) -> str:
+        return self.registry.render()
+
+METRICS: typing.Final[ServerMetrics] = ServerMetrics()
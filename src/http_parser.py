@@ -0,0 +1,145 @@
+"""
+Request head parsing
+
+Works on the bytes of a head as the reader cut it out of the receive buffer. The request line is
+checked against the `http_constants` tables with `bytes.translate`, which deletes the allowed
+characters in C: whatever is left over is malformed. The header lines are checked all at once by a
+regular expression built from the same tables, so the Python loop over them only splits and stores.
+Only what the server needs for every request is decoded, the query string and the cookies are parsed
+when first used.
+
+Malformed heads raise `HTTPError` (400, 501 for unknown methods and 505 for other major versions)
+so the engines answer right away and close the connection.
+"""
+from __future__ import annotations
+
+import re
+import typing
+import urllib.parse
+
+from http import HTTPMethod, HTTPStatus
+
+from http_constants import CTL, DIGIT, HEX, HT, SP, TCHAR, VCHAR, HTTPError
+
+if typing.TYPE_CHECKING:
+    from http_headers import HTTPHeaders
+
+TOKEN: typing.Final[bytes] = b"".join(TCHAR)
+TARGET: typing.Final[bytes] = b"".join(VCHAR)
+HEX_DIGITS: typing.Final[bytes] = b"".join(HEX)
+
+HEADER_LINES: typing.Final[re.Pattern[str]] = re.compile(
+    "(?:[{token}]+:[^{ctl}]*\r\n)*".format(
+        token=re.escape(TOKEN.decode("ascii")),
+        ctl=re.escape(b"".join(octet for octet in CTL if octet != HT).decode("ascii")),
+    )
+)
+"""Header lines of token names and values without control characters but HT (RFC 9110 5.5), decoded as Latin-1"""
+
+METHODS: typing.Final[dict[bytes, HTTPMethod]] = {method.value.encode(): method for method in HTTPMethod}
+VERSIONS: typing.Final[dict[bytes, tuple[int, int]]] = {b"HTTP/1.1": (1, 1), b"HTTP/1.0": (1, 0)}
+
+ABSOLUTE_FORM: typing.Final[re.Pattern[bytes]] = re.compile(rb"[hH][tT][tT][pP][sS]?://[^/?]*")
+"""Scheme and authority of an absolute-form target, sent by clients that think they talk to a proxy"""
+
+def parse_request_line(line: bytes) -> tuple[HTTPMethod, bytes, tuple[int, int]]:
+    try:
+        method, target, version = line.split(SP)
+    except ValueError:
+        raise HTTPError(f"Malformed request line {line[:64]!r}!") from None
+
+    if (http_method:=METHODS.get(method)) is None:
+        if len(method) == 0 or len(method.translate(None, TOKEN)) != 0:
+            raise HTTPError(f"Malformed method {method[:64]!r}!")
+
+        raise HTTPError(f"Unknown method {method[:64]!r}!", status=HTTPStatus.NOT_IMPLEMENTED)
+
+    if (http_version:=VERSIONS.get(version)) is None:
+        http_version = parse_version(version)
+
+    if len(target) == 0 or len(target.translate(None, TARGET)) != 0:
+        raise HTTPError(f"Malformed request target {target[:64]!r}!")
+
+    return http_method, target, http_version
+
+def parse_version(version: bytes) -> tuple[int, int]:
+    """Versions other than the common HTTP/1.1 and HTTP/1.0"""
+    if len(version) != 8 or not version.startswith(b"HTTP/") or version[5:6] not in DIGIT or version[6:7] != b"." or version[7:8] not in DIGIT:
+        raise HTTPError(f"Malformed HTTP version {version[:64]!r}!")
+
+    if version[5:6] != b"1":
+        raise HTTPError(f"Unsupported HTTP version {version.decode()}!", status=HTTPStatus.HTTP_VERSION_NOT_SUPPORTED)
+
+    # Later minor versions are compatible with HTTP/1.1 and answered with it
+    return 1, 1
+
+def split_target(target: bytes) -> tuple[str, str]:
+    """Percent-decoded path and the still encoded query of a request target"""
+    target = target.partition(b"#")[0]
+
+    if not target.startswith(b"/") and (match:=ABSOLUTE_FORM.match(target)) is not None:
+        target = target[match.end():]
+        if not target.startswith(b"/"):
+            target = b"/" + target
+
+    # `*` of OPTIONS and the authority-form of CONNECT are kept as they are
+    path, _, query = target.partition(b"?")
+
+    return unquote_path(path) if b"%" in path else path.decode("ascii"), query.decode("ascii")
+
+def unquote_path(path: bytes) -> str:
+    i = path.find(b"%")
+
+    while i != -1:
+        if len(escape:=path[i + 1:i + 3]) != 2 or len(escape.translate(None, HEX_DIGITS)) != 0:
+            raise HTTPError(f"Malformed percent-encoding in {path[:64]!r}!")
+
+        i = path.find(b"%", i + 3)
+
+    decoded = urllib.parse.unquote(path.decode("ascii"))
+
+    # Would end up in file system calls, which refuse it
+    if "\0" in decoded:
+        raise HTTPError(f"Encoded NUL in {path[:64]!r}!")
+
+    return decoded
+
+def parse_header_lines(header_lines: bytes, headers: HTTPHeaders) -> None:
+    """Adds the CRLF terminated `header_lines` to `headers`"""
+    text = header_lines.decode("latin-1")
+    if not text.endswith("\r\n") and len(text) != 0:
+        text += "\r\n"
+
+    # Also refuses whitespace before the colon and obsolete line folding (RFC 9112 5.1 and 5.2)
+    if HEADER_LINES.fullmatch(text) is None:
+        for line in text.split("\r\n")[:-1]:
+            if HEADER_LINES.fullmatch(line + "\r\n") is None:
+                raise HTTPError(f"Malformed header line {line[:64]!r}!")
+
+        raise HTTPError("Bare CR or LF in a header line!")
+
+    headers.add_lines(text.split("\r\n")[:-1])
+
+def parse_cookies(values: typing.Iterable[str]) -> dict[str, str]:
+    """
+    Cookies of the values of `Cookie` headers.
+
+    Pairs without a name or `=` are skipped instead of failing the whole header, of a name sent twice
+    the first one is kept (RFC 6265 5.4 orders the more specific cookies first).
+    """
+    cookies: dict[str, str] = {}
+
+    for value in values:
+        for pair in value.split(";"):
+            name, equals, cookie = pair.partition("=")
+
+            if len(equals) == 0 or len(name:=name.strip()) == 0:
+                continue
+
+            cookie = cookie.strip()
+            if len(cookie) >= 2 and cookie[0] == cookie[-1] == '"':
+                cookie = cookie[1:-1]
+
+            cookies.setdefault(name, cookie)
+
+    return cookies
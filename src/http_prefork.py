@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+import dataclasses
+import os
+import signal
+import threading
+import time
+import typing
+
+from http_server import HTTPServer
+
+@dataclasses.dataclass(eq=False)
+class WorkerProcess:
+    pid: int
+    generation: int
+    started_at: float
+
+class PreforkServer:
+    """
+    Runs a server engine in several worker processes to use more than one CPU core.
+
+    With `reuse_port` every worker builds its own server bound with `SO_REUSEPORT` and the kernel
+    balances the connections, otherwise the server is built once and the workers share the inherited
+    listening socket.
+
+    Signals handled by the master process:
+        - `SIGTERM`/`SIGINT`: stops every worker and exits
+        - `SIGHUP`: graceful restart, a new generation of workers is started before the old one is stopped
+
+    A stopped worker stops accepting and finishes the requests in flight for up to `shutdown_timeout`
+    seconds before it exits.
+
+    Workers that exit unexpectedly are respawned.
+    """
+    server_factory: typing.Callable[[], HTTPServer]
+    processes: int
+    reuse_port: bool
+
+    shutdown_timeout: float
+    min_uptime: float
+    respawn_delay: float
+
+    server: HTTPServer | None
+    workers: dict[int, WorkerProcess]
+    respawns: list[float]
+    generation: int
+
+    running: bool
+    restart_requested: bool
+
+    def __init__(self: typing.Self,
+                 server_factory: typing.Callable[[], HTTPServer],
+                 processes: int | None = None,
+                 reuse_port: bool = True) -> None:
+        if not hasattr(os, "fork"):
+            raise NotImplementedError("Pre-fork mode needs os.fork, which is not available on this platform!")
+
+        self.server_factory = server_factory
+        self.processes = processes if processes is not None else (os.cpu_count() or 1)
+        self.reuse_port = reuse_port
+
+        self.shutdown_timeout = 10.0
+        self.min_uptime = 1.0
+        self.respawn_delay = 1.0
+
+        self.server = None
+        self.workers = {}
+        self.respawns = []
+        self.generation = 0
+
+        self.running = False
+        self.restart_requested = False
+
+    def serv(self: typing.Self) -> None:
+        if not self.reuse_port:
+            self.server = self.server_factory()
+
+        signal.signal(signal.SIGTERM, self.on_stop_signal)
+        signal.signal(signal.SIGINT, self.on_stop_signal)
+        signal.signal(signal.SIGHUP, self.on_restart_signal)
+
+        self.running = True
+        print(f"[INFO]: Pre-fork master {os.getpid()} starting {self.processes} worker(s)")
+
+        for _ in range(self.processes):
+            self.spawn()
+
+        try:
+            while self.running:
+                self.reap()
+
+                if self.restart_requested:
+                    self.restart()
+
+                now = time.monotonic()
+                while len(self.respawns) != 0 and self.respawns[0] <= now:
+                    self.respawns.pop(0)
+                    self.spawn()
+
+                time.sleep(0.1)
+        finally:
+            self.shutdown()
+
+    def spawn(self: typing.Self) -> None:
+        pid = os.fork()
+
+        if pid == 0:
+            self.run_worker()
+
+        self.workers[pid] = WorkerProcess(pid, self.generation, time.monotonic())
+
+    def run_worker(self: typing.Self) -> typing.NoReturn:
+        stop_event = threading.Event()
+
+        signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+        signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+        exit_code = 0
+        try:
+            server = self.server if self.server is not None else self.server_factory()
+
+            serv_thread = threading.Thread(target=server.serv, daemon=True)
+            serv_thread.start()
+
+            while not stop_event.is_set() and serv_thread.is_alive():
+                stop_event.wait(0.1)
+
+            if stop_event.is_set():
+                server.shutdown(self.shutdown_timeout)
+            else:
+                exit_code = 1
+                server.close()
+
+            serv_thread.join(self.shutdown_timeout)
+        except BaseException as e:
+            print(f"[ERROR]: Worker {os.getpid()} failed: {e!r}")
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+
+    def reap(self: typing.Self) -> None:
+        while len(self.workers) != 0:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+
+            if pid == 0:
+                return
+
+            worker = self.workers.pop(pid, None)
+            if worker is None or not self.running or worker.generation != self.generation:
+                continue
+
+            print(f"[WARNING]: Worker {pid} exited unexpectedly (status {os.waitstatus_to_exitcode(status)}), respawning")
+
+            # A worker crashing right after start would otherwise be respawned in a tight loop
+            delay = self.respawn_delay if time.monotonic() - worker.started_at < self.min_uptime else 0.0
+            self.respawns.append(time.monotonic() + delay)
+
+    def restart(self: typing.Self) -> None:
+        self.restart_requested = False
+
+        old_workers = tuple(self.workers.values())
+        self.generation += 1
+        self.respawns.clear()
+
+        print(f"[INFO]: Graceful restart, starting generation {self.generation}")
+
+        for _ in range(self.processes):
+            self.spawn()
+
+        for worker in old_workers:
+            self.signal_worker(worker, signal.SIGTERM)
+
+    def shutdown(self: typing.Self) -> None:
+        """Stops every worker, killing the ones that don't exit within `shutdown_timeout`"""
+        self.running = False
+
+        for worker in tuple(self.workers.values()):
+            self.signal_worker(worker, signal.SIGTERM)
+
+        # A little past the workers' own timeout, for them to close what is left and exit by themselves
+        deadline = time.monotonic() + self.shutdown_timeout + 1.0
+        while len(self.workers) != 0 and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.05)
+
+        for worker in tuple(self.workers.values()):
+            self.signal_worker(worker, signal.SIGKILL)
+            try:
+                os.waitpid(worker.pid, 0)
+            except ChildProcessError:
+                pass
+
+        self.workers.clear()
+
+        if self.server is not None:
+            self.server.sock.close()
+
+        print(f"[INFO]: Pre-fork master {os.getpid()} stopped")
+
+    def signal_worker(self: typing.Self, worker: WorkerProcess, signum: int) -> None:
+        try:
+            os.kill(worker.pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def on_stop_signal(self: typing.Self, signum: int, frame: typing.Any) -> None:
+        self.running = False
+
+    def on_restart_signal(self: typing.Self, signum: int, frame: typing.Any) -> None:
+        self.restart_requested = True
@@ -0,0 +1,86 @@
+"""
+Byte ranges
+
+Parsing of `Range` headers and framing of `multipart/byteranges` bodies (RFC 9110 14).
+"""
+from __future__ import annotations
+
+import secrets
+import typing
+
+MAX_RANGES: typing.Final[int] = 16
+"""Requests with more ranges are answered with the whole representation, they are more likely abuse than use"""
+
+MAX_MULTIPART_SIZE: typing.Final[int] = 8 * 1024 * 1024
+"""Multipart bodies are assembled in memory, larger ones are answered with the whole representation instead"""
+
+def parse_range(range_header: str, size: int) -> list[tuple[int, int]] | None:
+    """
+    Satisfiable byte ranges of a `Range` header as sorted, coalesced `(start, end)` pairs with an inclusive end.
+
+    Returns `None` if the header must be ignored (another unit, invalid syntax, too many ranges)
+    and an empty list if none of the ranges is satisfiable.
+    """
+    unit, _, range_set = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or len(range_set.strip()) == 0:
+        return None
+
+    specs = range_set.split(",")
+    if len(specs) > MAX_RANGES:
+        return None
+
+    ranges: list[tuple[int, int]] = []
+    for spec in specs:
+        first, dash, last = spec.strip().partition("-")
+
+        # `isdigit` alone takes any Unicode digit, such as the `²` of a Latin-1 decoded byte, that `int` refuses
+        if len(dash) == 0 or not (first.isascii() and last.isascii()) or not (first.isdigit() or len(first) == 0) or not (last.isdigit() or len(last) == 0):
+            return None
+
+        if len(first) == 0:
+            # Suffix range, the last `last` bytes
+            if len(last) == 0:
+                return None
+            if (suffix:=int(last)) > 0 and size > 0:
+                ranges.append((max(size - suffix, 0), size - 1))
+            continue
+
+        start = int(first)
+        if len(last) != 0 and int(last) < start:
+            return None
+
+        if start < size:
+            ranges.append((start, min(int(last), size - 1) if len(last) != 0 else size - 1))
+
+    ranges.sort()
+
+    coalesced: list[tuple[int, int]] = []
+    for start, end in ranges:
+        if len(coalesced) != 0 and start <= coalesced[-1][1] + 1:
+            coalesced[-1] = (coalesced[-1][0], max(end, coalesced[-1][1]))
+        else:
+            coalesced.append((start, end))
+
+    return coalesced
+
+def content_range(start: int, end: int, size: int) -> str:
+    return f"bytes {start}-{end}/{size}"
+
+def new_boundary() -> str:
+    return secrets.token_hex(16)
+
+def multipart_byteranges(parts: typing.Iterable[tuple[int, int, bytes]], size: int, content_type: str | None, boundary: str) -> bytes:
+    """Body of a `multipart/byteranges` response made of `(start, end, data)` parts"""
+    body = bytearray()
+
+    for start, end, data in parts:
+        body += f"--{boundary}\r\n".encode()
+        if content_type is not None:
+            body += f"Content-Type: {content_type}\r\n".encode()
+        body += f"Content-Range: {content_range(start, end, size)}\r\n\r\n".encode()
+        body += data
+        body += b"\r\n"
+
+    body += f"--{boundary}--\r\n".encode()
+
+    return bytes(body)
@@ -0,0 +1,629 @@
+from __future__ import annotations
+
+import collections
+import concurrent.futures
+import dataclasses
+import functools
+import os
+import selectors
+import socket
+import ssl
+import time
+import typing
+
+from http import HTTPStatus
+
+import http_constants
+from http_message import HTTPRequest, HTTPResponse, FileBody, ResponseStream
+from http_handler import HTTPHandler
+from http_body    import BodyDecoder, CONTINUE_RESPONSE
+from http_metrics import RequestTiming
+from http_server  import HTTPServer, HTTPSServer, ClientConnection
+from http_h2      import SWITCHING_PROTOCOLS, ErrorCode, H2Stream
+from http_deadlines import Phase
+
+STREAM_BUFFER_SIZE: typing.Final[int] = 64 * 1024
+"""Bytes of a streamed HTTP/2 body produced ahead of what the flow control windows let out"""
+
+@dataclasses.dataclass(eq=False)
+class ReactorConnection(ClientConnection):
+    """State of a single client connection owned by the reactor loop"""
+    outbuf: memoryview | None          = dataclasses.field(default=None)
+    body_file: FileBody | None         = dataclasses.field(default=None)
+    body_chunks: typing.Iterator[bytes] | None = dataclasses.field(default=None)
+    pending_request: HTTPRequest | None = dataclasses.field(default=None)
+    pending_body: BodyDecoder | None   = dataclasses.field(default=None)
+    close_after_write: bool            = dataclasses.field(default=False)
+
+    timing: RequestTiming | None       = dataclasses.field(default=None)
+    """Timing of the request being received or answered"""
+    request: HTTPRequest | None        = dataclasses.field(default=None)
+    response: HTTPResponse | None      = dataclasses.field(default=None)
+    """Response being sent, recorded in the metrics once its last byte is"""
+
+    jobs: int                          = dataclasses.field(default=0)
+    """Handlers and pieces of streamed bodies being produced by workers, an HTTP/1.1 socket is out of the selector meanwhile"""
+    h2_sources: dict[int, tuple[typing.Iterator[bytes], ResponseStream]] = dataclasses.field(default_factory=dict)
+    """Streamed HTTP/2 bodies, by stream"""
+    h2_parked: set[int]                = dataclasses.field(default_factory=set)
+    """Streams whose next piece waits for their output to drain"""
+
+class HTTPReactorServer(HTTPServer):
+    """
+    Event-driven server engine built on the `selectors` module (epoll on Linux).
+
+    Every socket is non-blocking and registered with a single selector, requests are parsed
+    incrementally as bytes arrive, so idle keep-alive connections cost no CPU and no thread.
+    Handlers and streamed bodies run in the worker pool, which hands their results back to the
+    loop through a socket pair, so a slow one never holds up the other connections.
+    """
+    selector: selectors.BaseSelector
+    connections: dict[socket.socket, ReactorConnection]
+    wakeup_sock: socket.socket
+    """Registered with the selector, readable once a worker posted a result"""
+    notify_sock: socket.socket
+    posted: collections.deque[typing.Callable[[], None]]
+    wakeup_pending: bool
+    """Whether the loop was woken up and has yet to run what was posted, further posts needn't wake it again"""
+
+    select_timeout: float
+
+    def __init__(self: typing.Self,
+                 version: str = "HTTP/1.1",
+                 addr: tuple[str, int] = ("localhost", 80),
+                 handler: HTTPHandler | None = None,
+                 **kwargs) -> None:
+        super().__init__(version, addr, handler, **kwargs)
+        self.connections = {}
+        self.posted = collections.deque()
+        self.wakeup_pending = False
+        self.select_timeout = 0.5
+
+    @typing.override
+    def serv(self: typing.Self) -> typing.NoReturn:
+        # Created here and not in __init__ so forked workers never share one epoll instance
+        self.selector = selectors.DefaultSelector()
+
+        self.sock.listen(socket.SOMAXCONN)
+        self.sock.setblocking(False)
+        self.selector.register(self.sock, selectors.EVENT_READ, None)
+
+        self.executor = concurrent.futures.ThreadPoolExecutor(self.max_workers, thread_name_prefix="http-worker")
+        self.wakeup_sock, self.notify_sock = socket.socketpair()
+        self.wakeup_sock.setblocking(False)
+        self.notify_sock.setblocking(False)
+        self.selector.register(self.wakeup_sock, selectors.EVENT_READ, None)
+        print(f"[INFO]: HTTP Server (reactor) listening on: {self.addr[0]}:{self.addr[1]}")
+
+        self.running = True
+        reaped_at = time.monotonic()
+
+        while self.running:
+            if self.draining and self.sock.fileno() != -1:
+                self.selector.unregister(self.sock)
+                self.sock.close()
+
+            if (now:=time.monotonic()) - reaped_at >= self.select_timeout:
+                self.reap(now)
+                reaped_at = now
+
+            for key, mask in self.selector.select(self.select_timeout):
+                if key.fileobj is self.wakeup_sock:
+                    self.run_posted()
+                    continue
+                if key.data is None:
+                    self.accept()
+                    continue
+
+                conn: ReactorConnection = key.data
+                if mask & selectors.EVENT_READ and conn.sock in self.connections:
+                    self.on_readable(conn)
+                if mask & selectors.EVENT_WRITE and conn.sock in self.connections:
+                    self.on_writable(conn)
+
+        self.close_all()
+
+    def accept(self: typing.Self) -> None:
+        while True:
+            try:
+                sock, addr = self.sock.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except ConnectionError:
+                continue
+            except OSError:
+                return
+
+            if len(self.connections) >= self.max_connections:
+                self.reject(sock)
+                continue
+            if not self.admit(addr):
+                self.reject(sock, HTTPStatus.TOO_MANY_REQUESTS)
+                continue
+
+            sock.setblocking(False)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock = self.wrap_client(sock)
+
+            conn = ReactorConnection(sock, addr, self.new_reader(), handshaking=isinstance(sock, ssl.SSLSocket))
+            self.connections[sock] = conn
+            self.selector.register(sock, selectors.EVENT_READ, conn)
+            self.arm(conn, Phase.HANDSHAKE if conn.handshaking else Phase.HEAD)
+
+    @typing.override
+    def connection_count(self: typing.Self) -> int:
+        return len(self.connections)
+
+    def submit(self: typing.Self, conn: ReactorConnection, callback: typing.Callable[[concurrent.futures.Future], None], fn: typing.Callable, *args: typing.Any) -> None:
+        """Runs `fn(*args)` in a worker for `conn`, then `callback` with its future on the loop"""
+        conn.jobs += 1
+        self.executor.submit(fn, *args).add_done_callback(lambda future: self.post(functools.partial(callback, future)))
+
+    def post(self: typing.Self, callback: typing.Callable[[], None]) -> None:
+        """Has the loop run `callback`, called from the workers"""
+        self.posted.append(callback)
+
+        if self.wakeup_pending:
+            return
+
+        self.wakeup_pending = True
+        try:
+            self.notify_sock.send(b"\0")
+        except OSError:
+            # Closed along with the server
+            pass
+
+    def run_posted(self: typing.Self) -> None:
+        try:
+            while len(self.wakeup_sock.recv(4096)) != 0:
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+        # Cleared once the socket is drained and before the queue is, a callback posted from now on either is run below or sends a fresh byte
+        self.wakeup_pending = False
+
+        while len(self.posted) != 0:
+            self.posted.popleft()()
+
+    @typing.override
+    def expire(self: typing.Self, conn: ReactorConnection, phase: Phase) -> None:
+        if conn.sock not in self.connections:
+            return
+
+        if conn.h2 is None and (phase is Phase.BODY or phase is Phase.HEAD and len(conn.reader) != 0):
+            return self.fail(conn, http_constants.HTTPError(self.timeout_message(phase), status=HTTPStatus.REQUEST_TIMEOUT))
+
+        if phase is Phase.IDLE and conn.h2 is not None:
+            self.send_goaway(conn.sock, conn.h2)
+        elif phase in (Phase.HANDSHAKE, Phase.BODY, Phase.WRITE):
+            print(f"[ERROR]: {conn.addr[0]}:{conn.addr[1]} {self.timeout_message(phase)}")
+
+        self.close_connection(conn)
+
+    def on_readable(self: typing.Self, conn: ReactorConnection) -> None:
+        if conn.handshaking:
+            return self.continue_handshake(conn)
+
+        while True:
+            try:
+                received = conn.reader.recv_into(conn.sock)
+            except (BlockingIOError, InterruptedError, ssl.SSLWantReadError, ssl.SSLWantWriteError):
+                break
+            except (ConnectionError, ssl.SSLError, OSError):
+                return self.close_connection(conn)
+
+            if received == 0:
+                return self.close_connection(conn)
+
+            self.deadlines.progress(conn, received)
+
+            # TLS may hold already decrypted records that the selector won't report again
+            if not (isinstance(conn.sock, ssl.SSLSocket) and conn.sock.pending()):
+                break
+
+        if self.deadlines.phase(conn) is Phase.IDLE:
+            self.arm(conn, Phase.HEAD)
+
+        self.process_buffer(conn)
+
+    def process_buffer(self: typing.Self, conn: ReactorConnection) -> None:
+        """Parses and answers as many complete requests out of the input buffer as possible without blocking"""
+        if conn.h2 is not None:
+            return self.process_h2(conn)
+
+        while True:
+            if conn.pending_request is None:
+                http_request = HTTPRequest()
+                try:
+                    if (request_head:=conn.reader.next_head()) is None:
+                        return
+
+                    if (h2:=self.prior_knowledge(request_head, conn.served)) is not None:
+                        conn.h2 = h2
+                        return self.process_h2(conn)
+
+                    http_request.parse_request_head(request_head)
+                    conn.timing = self.new_timing(conn, request_head)
+                    conn.pending_body = self.new_body_decoder(http_request)
+                except http_constants.HTTPError as e:
+                    return self.fail(conn, e)
+                except ValueError:
+                    return self.close_connection(conn)
+
+                conn.pending_request = http_request
+
+                if conn.pending_body is not None:
+                    self.arm(conn, Phase.BODY)
+
+                    if self.expects_continue(http_request, conn.reader):
+                        conn.outbuf = memoryview(CONTINUE_RESPONSE)
+                        if not self.flush(conn):
+                            return
+
+            if conn.pending_body is not None:
+                try:
+                    if not conn.pending_body.feed(conn.reader):
+                        return
+                except http_constants.HTTPError as e:
+                    return self.fail(conn, e)
+
+                conn.pending_request.body = conn.pending_body.body
+
+            http_request, conn.pending_request, conn.pending_body = conn.pending_request, None, None
+
+            try:
+                h2 = self.h2c_upgrade(http_request, conn.timing)
+            except http_constants.HTTPError as e:
+                http_request.body.close()
+                return self.fail(conn, e)
+
+            if h2 is not None:
+                conn.h2, conn.timing = h2, None
+                conn.outbuf = memoryview(SWITCHING_PROTOCOLS)
+                self.answer_h2(conn, h2.streams[1])
+                return self.process_h2(conn)
+
+            # The connection is left alone while the handler runs, the requests behind it stay buffered
+            conn.served += 1
+            self.deadlines.cancel(conn)
+            self.selector.unregister(conn.sock)
+            return self.submit(conn, functools.partial(self.respond, conn, http_request), self.process_request, http_request, conn.served)
+
+    def respond(self: typing.Self, conn: ReactorConnection, http_request: HTTPRequest, future: concurrent.futures.Future) -> None:
+        """Sends the response a worker generated for `http_request`, then goes on with the requests buffered behind it"""
+        conn.jobs -= 1
+        http_request.body.close()
+
+        if conn.sock not in self.connections:
+            if future.exception() is None and (body_file:=future.result().body_file) is not None:
+                body_file.close()
+            return
+
+        self.selector.register(conn.sock, selectors.EVENT_WRITE, conn)
+
+        try:
+            http_response: HTTPResponse = future.result()
+        except Exception as e:
+            return self.fail(conn, http_constants.HTTPError(f"{http_request.method} {http_request.target} {e!r}", status=HTTPStatus.INTERNAL_SERVER_ERROR))
+
+        conn.timing.handler = time.perf_counter()
+        conn.timing.received += http_request.body.length
+        conn.request, conn.response = http_request, http_response
+
+        conn.close_after_write = not http_response.keep_alive
+        self.arm(conn, Phase.WRITE)
+
+        if http_response.body_stream is not None:
+            conn.outbuf = memoryview(http_response.encode_head())
+            conn.body_chunks = iter(http_response.body_stream)
+        elif (body_file:=http_response.body_file) is None:
+            conn.outbuf = memoryview(http_response.encode_head() + http_response.encode_body())
+        else:
+            conn.outbuf = memoryview(http_response.encode_head())
+            conn.body_file = body_file
+
+            # sendfile can't encrypt, TLS gets the file in memory mapped chunks instead
+            if isinstance(conn.sock, ssl.SSLSocket):
+                conn.body_chunks = body_file.chunks()
+
+        conn.timing.sent = len(conn.outbuf) + (conn.body_file.length if conn.body_file is not None else 0)
+
+        # Optimistic write, most responses fit into the socket buffer at once
+        if self.flush(conn):
+            self.process_buffer(conn)
+
+    def next_piece(self: typing.Self, conn: ReactorConnection, future: concurrent.futures.Future) -> None:
+        """Sends the piece of a streamed body a worker produced, `None` once the stream is exhausted"""
+        conn.jobs -= 1
+
+        if conn.sock not in self.connections:
+            return self.close_body(conn)
+
+        self.selector.register(conn.sock, selectors.EVENT_WRITE, conn)
+
+        if (error:=future.exception()) is not None:
+            # A failing stream was reported by itself
+            if not isinstance(error, ConnectionError):
+                print(f"[ERROR]: {conn.addr[0]}:{conn.addr[1]} {error!r}")
+            return self.close_connection(conn)
+
+        if (chunk:=future.result()) is None:
+            self.close_body(conn)
+        else:
+            conn.outbuf = memoryview(chunk)
+            conn.timing.sent += len(chunk)
+
+        self.arm(conn, Phase.WRITE)
+        if self.flush(conn):
+            self.process_buffer(conn)
+
+    def process_h2(self: typing.Self, conn: ReactorConnection) -> None:
+        """Feeds the input buffer to the HTTP/2 state, answers the requests it completed and sends the responses"""
+        for stream in conn.h2.receive(conn.reader.read(len(conn.reader))):
+            self.answer_h2(conn, stream)
+
+        self.flush_h2(conn)
+
+    def answer_h2(self: typing.Self, conn: ReactorConnection, stream: H2Stream) -> None:
+        """Has a worker generate the response of a complete HTTP/2 request, the connection goes on meanwhile"""
+        conn.served += 1
+        stream.served = conn.served
+        self.submit(conn, functools.partial(self.respond_h2, conn, stream), self.process_request, stream.request, conn.served)
+
+    def respond_h2(self: typing.Self, conn: ReactorConnection, stream: H2Stream, future: concurrent.futures.Future) -> None:
+        """Queues the response a worker generated on its stream, a streamed body is produced by the workers piece by piece"""
+        conn.jobs -= 1
+        stream.request.body.close()
+
+        if conn.sock not in self.connections:
+            if future.exception() is None and (body_file:=future.result().body_file) is not None:
+                body_file.close()
+            return
+
+        try:
+            http_response: HTTPResponse = future.result()
+        except Exception as e:
+            print(f"[ERROR]: {stream.request.method} {stream.request.target} {e!r}")
+            conn.h2.reset_stream(stream.id, ErrorCode.INTERNAL_ERROR)
+            return self.flush_h2(conn)
+
+        stream.timing.handler = time.perf_counter()
+
+        body_stream = http_response.body_stream
+        if conn.h2.send_response(stream.id, http_response, pull=body_stream is None) and body_stream is not None:
+            conn.h2_sources[stream.id] = (iter(body_stream), body_stream)
+            self.submit(conn, functools.partial(self.next_h2_piece, conn, stream.id), next, conn.h2_sources[stream.id][0], None)
+
+        self.flush_h2(conn)
+
+    def next_h2_piece(self: typing.Self, conn: ReactorConnection, stream_id: int, future: concurrent.futures.Future) -> None:
+        """Queues the piece of a streamed body a worker produced, and has the next one produced unless too much waits to be sent"""
+        conn.jobs -= 1
+        source, body_stream = conn.h2_sources[stream_id]
+
+        if conn.sock not in self.connections:
+            del conn.h2_sources[stream_id]
+            return source.close()
+
+        if future.exception() is not None:
+            del conn.h2_sources[stream_id]
+            conn.h2.reset_stream(stream_id, ErrorCode.INTERNAL_ERROR)
+        elif (data:=future.result()) is None:
+            del conn.h2_sources[stream_id]
+            conn.h2.end_data(stream_id, body_stream.trailers.items())
+        elif not conn.h2.send_data(stream_id, data):
+            del conn.h2_sources[stream_id]
+            source.close()
+        elif conn.h2.buffered(stream_id) > STREAM_BUFFER_SIZE:
+            conn.h2_parked.add(stream_id)
+        else:
+            self.submit(conn, functools.partial(self.next_h2_piece, conn, stream_id), next, source, None)
+
+        self.flush_h2(conn)
+
+    def flush_h2(self: typing.Self, conn: ReactorConnection) -> None:
+        """
+        Sends the HTTP/2 output as far as the socket accepts it. Unlike HTTP/1.1 the connection is read
+        while its output waits, the client's window updates are what lets it go on.
+        """
+        h2 = conn.h2
+        while True:
+            if conn.outbuf is None or len(conn.outbuf) == 0:
+                # Everything queued before was sent, so were the streams it finished
+                self.observe_h2(h2, conn.addr)
+
+                if len(data:=h2.data_to_send()) == 0:
+                    break
+                conn.outbuf = memoryview(data)
+
+            try:
+                sent = conn.sock.send(conn.outbuf)
+            except (BlockingIOError, InterruptedError, ssl.SSLWantReadError, ssl.SSLWantWriteError):
+                if self.deadlines.phase(conn) is not Phase.WRITE:
+                    self.arm(conn, Phase.WRITE)
+                if self.selector.get_key(conn.sock).events != selectors.EVENT_READ | selectors.EVENT_WRITE:
+                    self.selector.modify(conn.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, conn)
+                return
+            except (ConnectionError, ssl.SSLError, OSError):
+                return self.close_connection(conn)
+
+            conn.outbuf = conn.outbuf[sent:]
+            self.deadlines.progress(conn, sent)
+
+        conn.outbuf = None
+
+        if h2.done:
+            if h2.error is not None:
+                print(f"[ERROR]: {conn.addr[0]}:{conn.addr[1]} {h2.error}")
+            return self.close_connection(conn)
+
+        for stream_id in tuple(conn.h2_parked):
+            if h2.buffered(stream_id) <= STREAM_BUFFER_SIZE:
+                conn.h2_parked.discard(stream_id)
+                self.submit(conn, functools.partial(self.next_h2_piece, conn, stream_id), next, conn.h2_sources[stream_id][0], None)
+
+        if conn.jobs != 0:
+            # The client isn't kept to a deadline while the workers have yet to answer it
+            self.deadlines.cancel(conn)
+        else:
+            # Waiting for the client: its next request, the rest of one in flight or a window update
+            self.arm(conn, Phase.IDLE if h2.idle else Phase.BODY)
+
+        if self.selector.get_key(conn.sock).events != selectors.EVENT_READ:
+            self.selector.modify(conn.sock, selectors.EVENT_READ, conn)
+
+    def fail(self: typing.Self, conn: ReactorConnection, error: http_constants.HTTPError) -> None:
+        """Answers a request the server won't process with an error and closes the connection"""
+        print(f"[ERROR]: {conn.addr[0]}:{conn.addr[1]} {error}")
+        self.metrics.errors.inc((error.status.value,))
+
+        if conn.pending_body is not None:
+            conn.pending_body.body.close()
+
+        conn.pending_request = conn.pending_body = None
+        conn.close_after_write = True
+        conn.outbuf = memoryview(self.error_response(error.status))
+        self.arm(conn, Phase.WRITE)
+        self.flush(conn)
+
+    def continue_handshake(self: typing.Self, conn: ReactorConnection) -> None:
+        """Advances the TLS handshake of a connection as far as its socket allows without blocking"""
+        try:
+            conn.sock.do_handshake()
+        except ssl.SSLWantReadError:
+            return self.selector.modify(conn.sock, selectors.EVENT_READ, conn)
+        except ssl.SSLWantWriteError:
+            return self.selector.modify(conn.sock, selectors.EVENT_WRITE, conn)
+        except (ConnectionError, ssl.SSLError, OSError):
+            self.metrics.tls_handshakes.inc(("failed",))
+            return self.close_connection(conn)
+
+        conn.handshaking = False
+        conn.protocol = self.handshake_done(conn.sock)
+        self.selector.modify(conn.sock, selectors.EVENT_READ, conn)
+        self.arm(conn, Phase.HEAD)
+
+        if conn.protocol == "h2":
+            conn.h2 = self.new_h2_connection()
+
+        # The first request may have come with the end of the handshake, already read by OpenSSL
+        self.on_readable(conn)
+
+    def on_writable(self: typing.Self, conn: ReactorConnection) -> None:
+        if conn.handshaking:
+            return self.continue_handshake(conn)
+
+        if conn.h2 is not None:
+            return self.flush_h2(conn)
+
+        if self.flush(conn):
+            self.process_buffer(conn)
+
+    def flush(self: typing.Self, conn: ReactorConnection) -> bool:
+        """
+        Sends as much of the pending output as the socket accepts.
+
+        Returns `True` if everything was sent and the connection is ready to read the next request.
+        """
+        while True:
+            try:
+                if len(conn.outbuf) > 0:
+                    sent = conn.sock.send(conn.outbuf)
+                    conn.outbuf = conn.outbuf[sent:]
+                    self.deadlines.progress(conn, sent)
+                elif conn.body_chunks is not None:
+                    if conn.response is not None and conn.response.body_stream is not None:
+                        # Produced by a worker, a stream may block or compress. The client's part only is timed
+                        self.deadlines.cancel(conn)
+                        self.selector.unregister(conn.sock)
+                        self.submit(conn, functools.partial(self.next_piece, conn), next, conn.body_chunks, None)
+                        return False
+
+                    if (chunk:=next(conn.body_chunks, None)) is None:
+                        self.close_body(conn)
+                    else:
+                        conn.outbuf = memoryview(chunk)
+                elif conn.body_file is None:
+                    break
+                elif conn.body_file.length > 0:
+                    if (sent:=os.sendfile(conn.sock.fileno(), conn.body_file.file.fileno(), conn.body_file.offset, conn.body_file.length)) == 0:
+                        raise ConnectionError("File truncated while sending it")
+
+                    conn.body_file.offset += sent
+                    conn.body_file.length -= sent
+                    self.deadlines.progress(conn, sent)
+                else:
+                    self.close_body(conn)
+            except (BlockingIOError, InterruptedError, ssl.SSLWantReadError, ssl.SSLWantWriteError):
+                self.selector.modify(conn.sock, selectors.EVENT_WRITE, conn)
+                return False
+            except (ConnectionError, ssl.SSLError, OSError):
+                self.close_connection(conn)
+                return False
+
+        conn.outbuf = None
+
+        if conn.response is not None:
+            self.observe_request(conn.request, conn.response, conn.timing, conn.served)
+            conn.request = conn.response = conn.timing = None
+
+        if conn.close_after_write:
+            self.close_connection(conn)
+            return False
+
+        # Not after a `100 Continue`, the body is still to come
+        if conn.pending_request is None:
+            self.arm(conn, Phase.HEAD if len(conn.reader) != 0 else Phase.IDLE)
+
+        if self.selector.get_key(conn.sock).events != selectors.EVENT_READ:
+            self.selector.modify(conn.sock, selectors.EVENT_READ, conn)
+
+        return True
+
+    def close_body(self: typing.Self, conn: ReactorConnection) -> None:
+        if conn.body_chunks is not None:
+            conn.body_chunks.close()
+        if conn.body_file is not None:
+            conn.body_file.close()
+
+        conn.body_file = conn.body_chunks = None
+
+    def close_connection(self: typing.Self, conn: ReactorConnection) -> None:
+        if self.connections.pop(conn.sock, None) is None:
+            return
+
+        self.deadlines.cancel(conn)
+        self.release(conn.addr)
+
+        # Sources a worker is running are closed once it is done
+        if conn.jobs == 0:
+            self.close_body(conn)
+        for stream_id in conn.h2_parked:
+            conn.h2_sources.pop(stream_id)[0].close()
+        if conn.pending_body is not None:
+            conn.pending_body.body.close()
+        if conn.h2 is not None:
+            conn.h2.close()
+
+        if conn.sock in self.selector.get_map():
+            self.selector.unregister(conn.sock)
+        conn.sock.close()
+
+    def close_all(self: typing.Self) -> None:
+        for conn in tuple(self.connections.values()):
+            self.close_connection(conn)
+
+        self.selector.close()
+        self.wakeup_sock.close()
+        self.notify_sock.close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    @typing.override
+    def close(self: typing.Self) -> None:
+        # The executor is shut down by the loop once it stopped, until then it may still hand work to it
+        self.running = False
+        self.sock.close()
+
+class HTTPSReactorServer(HTTPSServer, HTTPReactorServer):
+    pass
@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import socket
+import time
+import typing
+
+from http import HTTPStatus
+
+from http_constants import CRLF, HTTPError
+
+HEAD_END: typing.Final[bytes] = CRLF * 2
+
+class RequestReader:
+    """
+    Per-connection receive buffer with an incremental request head parser.
+
+    Bytes are received straight into a reusable `bytearray` with `recv_into`, the end of the head
+    is searched in bulk and only in the newly arrived bytes, and whatever follows the head stays
+    buffered for the body or the next pipelined request.
+    """
+    buffer: bytearray
+    start: int
+    end: int
+    scan_from: int
+    received_at: float
+    """`time.perf_counter` of the arrival of the oldest buffered bytes, the start of the next request"""
+
+    max_head_size: int
+    max_header_count: int
+
+    def __init__(self: typing.Self,
+                 max_head_size: int = 16 * 1024,
+                 max_header_count: int = 100,
+                 buffer_size: int = 64 * 1024) -> None:
+        self.buffer = bytearray(max(buffer_size, max_head_size))
+        self.start = 0
+        self.end = 0
+        self.scan_from = 0
+        self.received_at = 0.0
+
+        self.max_head_size = max_head_size
+        self.max_header_count = max_header_count
+
+    def __len__(self: typing.Self) -> int:
+        return self.end - self.start
+
+    def reserve(self: typing.Self, size: int) -> None:
+        """Makes room for at least `size` more bytes after the buffered ones"""
+        if len(self.buffer) - self.end >= size:
+            return
+
+        buffered = len(self)
+        if self.start != 0:
+            self.buffer[:buffered] = self.buffer[self.start:self.end]
+            self.scan_from -= self.start
+            self.start, self.end = 0, buffered
+
+        if len(self.buffer) - self.end < size:
+            self.buffer.extend(bytes(size - (len(self.buffer) - self.end)))
+
+    def recv_into(self: typing.Self, sock: socket.socket) -> int:
+        """Receives whatever the socket has into the free space of the buffer, returns 0 on EOF"""
+        if self.end == len(self.buffer):
+            self.reserve(len(self.buffer) // 2)
+
+        with memoryview(self.buffer) as view:
+            received = sock.recv_into(view[self.end:])
+
+        if self.start == self.end:
+            self.received_at = time.perf_counter()
+
+        self.end += received
+        return received
+
+    def feed(self: typing.Self, data: bytes) -> None:
+        """Appends bytes received by other means (e.g. an asyncio stream)"""
+        self.reserve(len(data))
+        if self.start == self.end:
+            self.received_at = time.perf_counter()
+
+        self.buffer[self.end:self.end + len(data)] = data
+        self.end += len(data)
+
+    def next_head(self: typing.Self) -> bytes | None:
+        """
+        Returns the next complete request head (request line and header lines, each ending with CRLF),
+        or `None` if more bytes are needed.
+
+        Raises `HTTPError` if the head exceeds `max_head_size` or `max_header_count`.
+        """
+        # The terminator may straddle the previously scanned bytes and the new ones
+        head_end = self.buffer.find(HEAD_END, max(self.start, self.scan_from - len(HEAD_END) + 1), self.end)
+
+        if head_end == -1:
+            self.scan_from = self.end
+
+            if len(self) > self.max_head_size:
+                raise HTTPError(f"Request head exceeds {self.max_head_size} byte(s)!", status=HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+            return None
+
+        if head_end + len(HEAD_END) - self.start > self.max_head_size:
+            raise HTTPError(f"Request head exceeds {self.max_head_size} byte(s)!", status=HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+
+        head = bytes(self.buffer[self.start:head_end + len(CRLF)])
+
+        # The request line is not a header
+        if head.count(CRLF) - 1 > self.max_header_count:
+            raise HTTPError(f"Request has more than {self.max_header_count} header(s)!", status=HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+
+        self.consume(head_end + len(HEAD_END) - self.start)
+        return head
+
+    def head_ready(self: typing.Self) -> bool:
+        """Whether `next_head` returns a head or raises without more bytes, without taking the head"""
+        if len(self) > self.max_head_size:
+            return True
+
+        if self.buffer.find(HEAD_END, max(self.start, self.scan_from - len(HEAD_END) + 1), self.end) == -1:
+            self.scan_from = self.end
+            return False
+
+        return True
+
+    def read_line(self: typing.Self, max_length: int) -> bytes | None:
+        """
+        Takes the next CRLF terminated line without its CRLF, or returns `None` if it isn't complete yet.
+
+        Raises `HTTPError` if the line is longer than `max_length`.
+        """
+        line_end = self.buffer.find(CRLF, self.start, self.end)
+
+        if line_end == -1:
+            if len(self) > max_length:
+                raise HTTPError(f"Line exceeds {max_length} byte(s)!")
+            return None
+
+        if line_end - self.start > max_length:
+            raise HTTPError(f"Line exceeds {max_length} byte(s)!")
+
+        line = bytes(self.buffer[self.start:line_end])
+        self.consume(line_end + len(CRLF) - self.start)
+
+        return line
+
+    def read(self: typing.Self, size: int) -> bytes:
+        """Takes at most `size` buffered bytes"""
+        size = min(size, len(self))
+        data = bytes(self.buffer[self.start:self.start + size])
+        self.consume(size)
+
+        return data
+
+    def consume(self: typing.Self, size: int) -> None:
+        self.start += size
+        self.scan_from = max(self.scan_from, self.start)
+
+        if self.start == self.end:
+            self.start = self.end = self.scan_from = 0
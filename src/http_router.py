@@ -0,0 +1,216 @@
+"""
+Routing
+
+Route table of a handler: static segments, path parameters and mounted static directories compiled
+into a segment trie when they are added, so a lookup walks the path once whatever the number of routes.
+"""
+from __future__ import annotations
+
+import dataclasses
+import functools
+import os
+import typing
+
+from http import HTTPMethod
+
+if typing.TYPE_CHECKING:
+    from http_message import HTTPRequest, HTTPResponse
+
+Endpoint = typing.Callable[["HTTPResponse", "HTTPRequest"], typing.Any]
+"""Sync or async function filling in the response of a request, like the handler methods"""
+
+CONVERTERS: typing.Final[dict[str, typing.Callable[[str], typing.Any]]] = {
+    "str": str,
+    "int": int,
+}
+"""Converters of single segment path parameters (`{name}` is `{name:str}`), `{name:path}` matches the rest of the path"""
+
+@dataclasses.dataclass(frozen=True)
+class StaticMount:
+    """Endpoint serving the files under `directory`, the matched rest of the path is the file"""
+    directory: str
+
+    @functools.cached_property
+    def root(self: typing.Self) -> str:
+        """Real path of `directory`, resolved on first use so a relative one is relative to the working directory the server runs in"""
+        return os.path.realpath(self.directory)
+
+@dataclasses.dataclass(eq=False)
+class RouteNode:
+    children: dict[str, RouteNode] = dataclasses.field(default_factory=dict)
+    """Child nodes of the static segments"""
+
+    param: RouteNode | None = None
+    """Child node matching any single segment"""
+    param_name: str | None = None
+    converter: typing.Callable[[str], typing.Any] = str
+
+    rest: RouteNode | None = None
+    """Node matching the rest of the path, however many segments that is"""
+    rest_name: str | None = None
+
+    endpoints: dict[HTTPMethod, Endpoint | StaticMount] = dataclasses.field(default_factory=dict)
+    pattern: str | None = None
+
+@dataclasses.dataclass
+class RouteMatch:
+    pattern: str
+    endpoints: dict[HTTPMethod, Endpoint | StaticMount]
+    params: dict[str, typing.Any]
+
+    @property
+    def allowed_methods(self: typing.Self) -> list[HTTPMethod]:
+        """Methods answered on the route, HEAD comes with GET and OPTIONS is always answered"""
+        methods = list(self.endpoints)
+
+        if HTTPMethod.GET in methods and HTTPMethod.HEAD not in methods:
+            methods.append(HTTPMethod.HEAD)
+        if HTTPMethod.OPTIONS not in methods:
+            methods.append(HTTPMethod.OPTIONS)
+
+        return methods
+
+class Router:
+    """
+    Maps request paths and methods to endpoints.
+
+    Patterns are made of `/` separated segments, each one either static or a parameter such as
+    `{user_id:int}`. Static segments take precedence over parameters, which take precedence
+    over a trailing `{name:path}`.
+
+        router = Router()
+
+        @router.get("/users/{user_id:int}")
+        def user(response, request):
+            ...
+
+        router.mount("/static", "public")
+    """
+    root: RouteNode
+    patterns: list[str]
+
+    def __init__(self: typing.Self) -> None:
+        self.root = RouteNode()
+        self.patterns = []
+
+    def add(self: typing.Self, pattern: str, endpoint: Endpoint | StaticMount, methods: typing.Iterable[HTTPMethod | str] = (HTTPMethod.GET,)) -> None:
+        if not pattern.startswith("/"):
+            raise ValueError(f"Route pattern {pattern!r} must start with '/'!")
+
+        node = self.root
+        segments = pattern.split("/")[1:]
+
+        for i, segment in enumerate(segments):
+            if not (segment.startswith("{") and segment.endswith("}")):
+                node = node.children.setdefault(segment, RouteNode())
+                continue
+
+            name, _, converter = segment[1:-1].partition(":")
+
+            if converter == "path":
+                if i != len(segments) - 1:
+                    raise ValueError(f"Path parameter {name!r} of {pattern!r} must be the last segment!")
+                if node.rest_name not in (None, name):
+                    raise ValueError(f"Path parameter {name!r} of {pattern!r} conflicts with {node.rest_name!r}!")
+
+                if node.rest is None:
+                    node.rest = RouteNode()
+
+                node.rest_name = name
+                node = node.rest
+                continue
+
+            if converter not in CONVERTERS and len(converter) != 0:
+                raise ValueError(f"Unknown converter {converter!r} in {pattern!r}!")
+            if node.param is not None and (node.param_name, node.converter) != (name, CONVERTERS[converter or "str"]):
+                raise ValueError(f"Parameter {name!r} of {pattern!r} conflicts with {node.param_name!r}!")
+
+            if node.param is None:
+                node.param = RouteNode()
+
+            node.param_name, node.converter = name, CONVERTERS[converter or "str"]
+            node = node.param
+
+        for method in methods:
+            node.endpoints[HTTPMethod(method.upper() if isinstance(method, str) else method)] = endpoint
+
+        node.pattern = pattern
+        if pattern not in self.patterns:
+            self.patterns.append(pattern)
+
+    def route(self: typing.Self, pattern: str, methods: typing.Iterable[HTTPMethod | str] = (HTTPMethod.GET,)) -> typing.Callable[[Endpoint], Endpoint]:
+        """Decorator adding the endpoint for `methods` on `pattern`"""
+        def decorator(endpoint: Endpoint) -> Endpoint:
+            self.add(pattern, endpoint, methods)
+            return endpoint
+
+        return decorator
+
+    def get(self: typing.Self, pattern: str) -> typing.Callable[[Endpoint], Endpoint]:
+        return self.route(pattern, (HTTPMethod.GET,))
+
+    def post(self: typing.Self, pattern: str) -> typing.Callable[[Endpoint], Endpoint]:
+        return self.route(pattern, (HTTPMethod.POST,))
+
+    def put(self: typing.Self, pattern: str) -> typing.Callable[[Endpoint], Endpoint]:
+        return self.route(pattern, (HTTPMethod.PUT,))
+
+    def delete(self: typing.Self, pattern: str) -> typing.Callable[[Endpoint], Endpoint]:
+        return self.route(pattern, (HTTPMethod.DELETE,))
+
+    def mount(self: typing.Self, prefix: str, directory: str) -> typing.Self:
+        """Serves the files under the document root `directory` below the URL `prefix`"""
+        self.add(prefix.rstrip("/") + "/{path:path}", StaticMount(directory), (HTTPMethod.GET,))
+
+        return self
+
+    def match(self: typing.Self, path: str) -> RouteMatch | None:
+        params: dict[str, typing.Any] = {}
+
+        if (node:=self.match_node(self.root, path.split("/")[1:], 0, params)) is None:
+            return None
+
+        return RouteMatch(node.pattern, node.endpoints, params)
+
+    def match_node(self: typing.Self, node: RouteNode, segments: list[str], i: int, params: dict[str, typing.Any]) -> RouteNode | None:
+        if i == len(segments):
+            if len(node.endpoints) != 0:
+                return node
+            if node.rest is not None and len(node.rest.endpoints) != 0:
+                params[node.rest_name] = ""
+                return node.rest
+            return None
+
+        segment = segments[i]
+
+        if (child:=node.children.get(segment)) is not None and (found:=self.match_node(child, segments, i + 1, params)) is not None:
+            return found
+
+        if node.param is not None and len(segment) != 0:
+            try:
+                params[node.param_name] = node.converter(segment)
+            except ValueError:
+                pass
+            else:
+                if (found:=self.match_node(node.param, segments, i + 1, params)) is not None:
+                    return found
+
+                del params[node.param_name]
+
+        if node.rest is not None and len(node.rest.endpoints) != 0:
+            params[node.rest_name] = "/".join(segments[i:])
+            return node.rest
+
+        return None
+
+    def methods(self: typing.Self) -> list[HTTPMethod]:
+        """Every method answered by some route, for `OPTIONS *`"""
+        methods: dict[HTTPMethod, None] = {}
+        nodes = [self.root]
+
+        while len(nodes) != 0:
+            node = nodes.pop()
+            methods.update(dict.fromkeys(node.endpoints))
+            nodes.extend(child for child in (*node.children.values(), node.param, node.rest) if child is not None)
+
+        return RouteMatch("*", methods, {}).allowed_methods
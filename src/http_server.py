@@ -1,20 +1,58 @@
 from __future__ import annotations
 
+import argparse
+import base64
+import binascii
+import collections
+import concurrent.futures
+import dataclasses
+import functools
+import os
 import socket
 import select
-import sys
 import ssl
+import sys
 import typing
 import threading
+import time
 
 if typing.TYPE_CHECKING:
     import pathlib
 
+from http import HTTPStatus, HTTPMethod
 from time import sleep
 
 import http_constants
-from http_message  import HTTPRequest
+from http_message  import HTTPRequest, HTTPResponse, FileBody
 from http_handler  import HTTPHandler
+from http_reader   import RequestReader
+from http_body     import BodyDecoder, CONTINUE_RESPONSE
+from http_metrics  import CONTENT_TYPE as METRICS_CONTENT_TYPE, RequestTiming, ServerMetrics
+from http_tls      import TLS_PRESETS, new_context
+from http_h2       import PREFACE, PREFACE_HEAD, SWITCHING_PROTOCOLS, ErrorCode, H2Connection, H2Stream
+from http_deadlines import Deadlines, Phase
+
+SENDFILE_CHUNK_SIZE: typing.Final[int] = 1024 * 1024
+"""Bytes of a file handed to `sendfile` at once, the write deadline is pushed back between the calls"""
+
+@dataclasses.dataclass(eq=False)
+class ClientConnection:
+    """State kept for a client connection across its requests"""
+    sock: socket.socket
+    addr: tuple[str, int]
+    reader: RequestReader
+
+    served: int         = dataclasses.field(default=0)
+    accepted_at: float  = dataclasses.field(default_factory=time.perf_counter)
+
+    handshaking: bool   = dataclasses.field(default=False)
+    """Whether the TLS handshake of the connection is still to be completed"""
+    protocol: str | None = dataclasses.field(default=None)
+    """Application protocol negotiated with ALPN"""
+    h2: H2Connection | None = dataclasses.field(default=None)
+    """Protocol state once the connection speaks HTTP/2"""
+    expired: Phase | None = dataclasses.field(default=None)
+    """Phase whose deadline passed while a worker was serving the connection"""
 
 class HTTPServer:
     sock: socket.socket
@@ -23,30 +61,133 @@ class HTTPServer:
 
     addr: tuple[str, int]
     clients: dict[tuple[str, int], socket.socket]
+    client_connections: dict[tuple[str, int], ClientConnection]
     currently_handling: set[tuple[str, int]]
 
     handler: HTTPHandler
 
     running: bool
+    draining: bool
+    """Set by `shutdown`, the server no longer accepts and closes connections once they are idle"""
+
+    max_workers: int
+    max_connections: int
+    max_queue: int
+    retry_after: int
+    max_head_size: int
+    max_header_count: int
+    keep_alive_timeout: float
+    keep_alive_max: int
+    max_body_size: int
+    spool_threshold: int
+    """Request bodies larger than this are spooled to a temporary file"""
+    metrics_path: str | None
+    """Target answered with the metrics in the Prometheus text format instead of by the handler"""
+    access_log: bool
+    handshake_timeout: float
+    """Seconds a TLS client has to complete its handshake"""
+    http2: bool
+    """Whether HTTP/2 is offered: with ALPN over TLS, by prior knowledge and as an `h2c` upgrade in the clear"""
+    max_concurrent_streams: int
+    header_timeout: float
+    """Seconds a client has to send a complete request head, from its first byte or the start of the connection"""
+    body_timeout: float
+    write_timeout: float
+    """Seconds a request body or a response may stall, and the grace period before `min_transfer_rate` applies"""
+    min_transfer_rate: int
+    """Bytes per second request bodies and responses have to average, 0 for no minimum"""
+    max_connections_per_ip: int | None
+    ssl_context: ssl.SSLContext | None
+
+    deadlines: Deadlines[ClientConnection]
+    connections_per_ip: collections.Counter[str]
+
+    metrics: ServerMetrics
+    executor: concurrent.futures.ThreadPoolExecutor | None
+    stats_lock: threading.Lock
+    queued: int
+    active: int
+    rejected: int
 
     def __init__(self: typing.Self,
                  version: str = "HTTP/1.1",
                  addr: tuple[str, int] = ("localhost", 80),
-                 handler: HTTPHandler | None = None) -> None:
+                 handler: HTTPHandler | None = None,
+                 *,
+                 max_workers: int | None = None,
+                 max_connections: int = 1000,
+                 max_queue: int = 128,
+                 retry_after: int = 1,
+                 reuse_port: bool = False,
+                 max_head_size: int = 16 * 1024,
+                 max_header_count: int = 100,
+                 keep_alive_timeout: float = 5.0,
+                 keep_alive_max: int = 100,
+                 max_body_size: int = 1024 * 1024 * 1024,
+                 spool_threshold: int = 1024 * 1024,
+                 metrics_path: str | None = None,
+                 access_log: bool = True,
+                 handshake_timeout: float = 10.0,
+                 http2: bool = True,
+                 max_concurrent_streams: int = 100,
+                 header_timeout: float = 10.0,
+                 body_timeout: float = 30.0,
+                 write_timeout: float = 30.0,
+                 min_transfer_rate: int = 1024,
+                 max_connections_per_ip: int | None = 100) -> None:
         self.version = version
         self.addr = addr
         self.clients = {}
+        self.client_connections = {}
         self.currently_handling = set()
         self.handler = handler if handler is not None else HTTPHandler()
         self.running = False
+        self.draining = False
+
+        self.max_workers = max_workers if max_workers is not None else min(32, (os.cpu_count() or 1) + 4)
+        self.max_connections = max_connections
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self.max_head_size = max_head_size
+        self.max_header_count = max_header_count
+        self.keep_alive_timeout = keep_alive_timeout
+        self.keep_alive_max = keep_alive_max
+        self.max_body_size = max_body_size
+        self.spool_threshold = spool_threshold
+        self.metrics_path = metrics_path
+        self.access_log = access_log
+        self.handshake_timeout = handshake_timeout
+        self.http2 = http2
+        self.max_concurrent_streams = max_concurrent_streams
+        self.header_timeout = header_timeout
+        self.body_timeout = body_timeout
+        self.write_timeout = write_timeout
+        self.min_transfer_rate = min_transfer_rate
+        self.max_connections_per_ip = max_connections_per_ip
+        self.ssl_context = None
+
+        self.deadlines = Deadlines()
+        self.connections_per_ip = collections.Counter()
+
+        self.metrics = self.handler.metrics
+        self.metrics.track(self)
+
+        self.executor = None
+        self.stats_lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+        self.rejected = 0
 
         if self.version_to_tuple() >= (2, 0):
-            raise NotImplementedError("HTTP version 2 and 3 are not supported yet!")
+            raise NotImplementedError("HTTP/2 is negotiated per connection (see `http2`) and HTTP/3 is not supported yet!")
         else:
             socket_kind = socket.SOCK_STREAM
         
         self.sock = socket.socket(socket.AF_INET, socket_kind)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            # Lets several worker processes bind the same address, the kernel balances connections between them
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.sock.bind(self.addr)
     
     def serv(self: typing.Self) -> typing.NoReturn:
@@ -54,92 +195,766 @@ class HTTPServer:
         print(f"[INFO]: HTTP Server listening on: {self.addr[0]}:{self.addr[1]}")
 
         self.running = True
+        self.executor = concurrent.futures.ThreadPoolExecutor(self.max_workers, thread_name_prefix="http-worker")
+        reaped_at = time.monotonic()
 
         while self.running:
-            tuples: tuple[list[socket.socket], list, list] = select.select((self.sock, *self.clients.values()), (), (), 0.001)
+            if self.draining and self.sock.fileno() != -1:
+                # Closed here and not by `shutdown`, the loop selects on it
+                self.sock.close()
+
+            listening = (self.sock,) if self.sock.fileno() != -1 else ()
+            tuples: tuple[list[socket.socket], list, list] = select.select((*listening, *self.clients.values()), (), (), 0.001)
             inputs: list[socket.socket] = tuples[0]
 
+            if (now:=time.monotonic()) - reaped_at >= 0.5:
+                self.reap(now)
+                reaped_at = now
+
             for s in inputs:
                 if s is self.sock:
                     try:
                         sock, addr = self.sock.accept()
-                        self.clients[addr] = sock
                     except ConnectionError:
-                        pass
-                    except ssl.SSLError:
-                        pass
+                        continue
                     except OSError:
-                        pass
+                        continue
+
+                    if len(self.clients) + len(self.currently_handling) >= self.max_connections:
+                        self.reject(sock)
+                    elif not self.admit(addr):
+                        self.reject(sock, HTTPStatus.TOO_MANY_REQUESTS)
+                    else:
+                        # Persistent connections would otherwise stall on Nagle's algorithm and delayed ACKs
+                        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                        # Read by this loop without blocking until a worker takes it over
+                        sock.setblocking(False)
+                        sock = self.wrap_client(sock)
+                        self.clients[addr] = sock
+                        conn = self.client_connections[addr] = ClientConnection(sock, addr, self.new_reader(), handshaking=isinstance(sock, ssl.SSLSocket))
+                        self.arm(conn, Phase.HANDSHAKE if conn.handshaking else Phase.HEAD)
                 else:
-                    if s.getpeername() in self.currently_handling:
+                    try:
+                        peername = s.getpeername()
+                    except OSError:
+                        # Reset by the client while idle, the socket no longer knows its peer
+                        self.drop_client(s)
+                        continue
+
+                    if peername in self.currently_handling:
+                        continue
+
+                    # A client trickling its head ties up no worker, it gets one once the head is complete
+                    if not self.receive_head(conn:=self.client_connections[peername]):
                         continue
-                    
-                    threading.Thread(target=self.handle_request, args=(s,)).start()
-                    self.currently_handling.add(s.getpeername())
+
+                    del self.clients[peername]
+
+                    if self.queued >= self.max_queue:
+                        self.reject(s)
+                        self.close_client(conn)
+                        continue
+
+                    with self.stats_lock:
+                        self.queued += 1
+
+                    self.currently_handling.add(peername)
+                    self.executor.submit(self.run_worker, s)
     
-    def read_head(self: typing.Self, sock: socket.socket) -> bytes:
-        head: bytes = bytes()
+    def reap(self: typing.Self, now: float) -> None:
+        """Acts on the connections whose deadline passed, called periodically by the engine's loop"""
+        for conn, phase in self.deadlines.expired(now):
+            self.metrics.timeouts.inc((phase.value,))
+            self.expire(conn, phase)
 
-        EOF_reached: bool = False
-        while not EOF_reached:
-            chunk = sock.recv(1)
+        if self.draining:
+            # Connections waiting for their next request are closed as if they timed out, without counting them
+            for conn in self.deadlines.keys(Phase.IDLE):
+                self.deadlines.cancel(conn)
+                self.expire(conn, Phase.IDLE)
 
-            head += chunk
+    def expire(self: typing.Self, conn: ClientConnection, phase: Phase) -> None:
+        """Closes a connection that missed the deadline of `phase`, a late request head is answered with 408"""
+        if self.clients.get(conn.addr) is not conn.sock:
+            # A worker is blocked on the socket, shutting it down wakes it up. A late body in the clear
+            # only stops the reading, so that the worker can still answer with 408
+            answered = phase is Phase.BODY and conn.h2 is None and not isinstance(conn.sock, ssl.SSLSocket)
+            if not answered:
+                print(f"[ERROR]: {conn.addr[0]}:{conn.addr[1]} {self.timeout_message(phase)}")
 
-            if head.endswith(http_constants.CRLF * 2):
-                return head[:-2]
-            elif len(chunk) == 0:
-                EOF_reached = True
+            conn.expired = phase
+            try:
+                # Below the TLS layer, `SSLSocket.shutdown` would pull the TLS state from under the worker
+                socket.socket.shutdown(conn.sock, socket.SHUT_RD if answered else socket.SHUT_RDWR)
+            except OSError:
+                pass
+            return
 
-        else:
-            if len(head) == 0:
-                return head
-            
-            peername = sock.getpeername()
-            raise http_constants.HTTPError(f"Incomplete head recived from {peername[0]}:{peername[1]}!")
+        del self.clients[conn.addr]
+
+        if phase is Phase.HEAD and len(conn.reader) != 0:
+            return self.refuse(conn, http_constants.HTTPError(self.timeout_message(phase), status=HTTPStatus.REQUEST_TIMEOUT))
+
+        if phase is Phase.HANDSHAKE:
+            print(f"[ERROR]: {conn.addr[0]}:{conn.addr[1]} {self.timeout_message(phase)}")
+        elif conn.h2 is not None:
+            self.send_goaway(conn.sock, conn.h2)
+
+        self.close_client(conn)
+
+    def timeout_message(self: typing.Self, phase: Phase) -> str:
+        match phase:
+            case Phase.HANDSHAKE:
+                return f"TLS handshake not completed within {self.handshake_timeout}s!"
+            case Phase.HEAD:
+                return f"Request head not received within {self.header_timeout}s!"
+            case Phase.BODY:
+                return f"Request body stalled for {self.body_timeout}s or slower than {self.min_transfer_rate} byte(s)/s!"
+            case Phase.WRITE:
+                return f"Response stalled for {self.write_timeout}s or taken slower than {self.min_transfer_rate} byte(s)/s!"
+
+        return f"Idle for {self.keep_alive_timeout}s!"
+
+    def arm(self: typing.Self, conn: typing.Hashable, phase: Phase) -> None:
+        """Starts the deadline of the phase a connection enters"""
+        match phase:
+            case Phase.HANDSHAKE:
+                timeout = self.handshake_timeout
+            case Phase.IDLE:
+                timeout = self.keep_alive_timeout
+            case Phase.HEAD:
+                timeout = self.header_timeout
+            case Phase.BODY:
+                timeout = self.body_timeout
+            case Phase.WRITE:
+                timeout = self.write_timeout
+
+        self.deadlines.start(conn, phase, timeout, self.min_transfer_rate)
+
+    def admit(self: typing.Self, addr: tuple[str, int]) -> bool:
+        """Counts a new connection of the client at `addr`, unless it already has `max_connections_per_ip` open"""
+        with self.stats_lock:
+            if self.max_connections_per_ip is not None and self.connections_per_ip[addr[0]] >= self.max_connections_per_ip:
+                return False
+
+            self.connections_per_ip[addr[0]] += 1
+
+        return True
+
+    def release(self: typing.Self, addr: tuple[str, int]) -> None:
+        with self.stats_lock:
+            if (count:=self.connections_per_ip[addr[0]] - 1) > 0:
+                self.connections_per_ip[addr[0]] = count
+            else:
+                del self.connections_per_ip[addr[0]]
+
+    def receive_head(self: typing.Self, conn: ClientConnection) -> bool:
+        """
+        Receives what a connection waiting in the select loop sent, without blocking. Returns whether
+        a worker should take it over: once its head is complete or too large, its ClientHello arrived
+        or it has HTTP/2 frames. A connection that closed is closed here.
+        """
+        if conn.handshaking:
+            return client_hello_received(conn.sock)
+
+        if conn.h2 is not None:
+            return True
+
+        try:
+            while True:
+                if conn.reader.recv_into(conn.sock) == 0:
+                    if len(conn.reader) != 0:
+                        self.refuse(conn, http_constants.HTTPError("Incomplete head recived!"))
+                    else:
+                        self.drop_client(conn.sock)
+                    return False
+
+                # TLS may hold already decrypted records that select won't report
+                if not (isinstance(conn.sock, ssl.SSLSocket) and conn.sock.pending()):
+                    break
+        except (BlockingIOError, InterruptedError, ssl.SSLWantReadError, ssl.SSLWantWriteError):
+            pass
+        except OSError:
+            self.drop_client(conn.sock)
+            return False
+
+        if len(conn.reader) != 0 and self.deadlines.phase(conn) is Phase.IDLE:
+            self.arm(conn, Phase.HEAD)
+
+        return conn.reader.head_ready()
+
+    def refuse(self: typing.Self, conn: ClientConnection, error: http_constants.HTTPError) -> None:
+        """Answers a connection waiting in the select loop with an error and closes it"""
+        print(f"[ERROR]: {conn.addr[0]}:{conn.addr[1]} {error}")
+        self.metrics.errors.inc((error.status.value,))
+
+        self.clients.pop(conn.addr, None)
+        try:
+            conn.sock.send(self.error_response(error.status))
+        except OSError:
+            pass
+
+        self.close_client(conn)
+
+    def drop_client(self: typing.Self, sock: socket.socket) -> None:
+        for addr, client in tuple(self.clients.items()):
+            if client is sock:
+                del self.clients[addr]
+                self.close_client(self.client_connections[addr])
+
+        sock.close()
+
+    def close_client(self: typing.Self, conn: ClientConnection) -> None:
+        """Forgets a connection of the thread engine and closes it"""
+        if self.client_connections.pop(conn.addr, None) is None:
+            return
+
+        self.deadlines.cancel(conn)
+        self.release(conn.addr)
+
+        if conn.h2 is not None:
+            conn.h2.close()
+        conn.sock.close()
+    
+    def wrap_client(self: typing.Self, sock: socket.socket) -> socket.socket:
+        """Socket a newly accepted connection is served on, TLS servers wrap it for a handshake driven by the engine"""
+        return sock
+
+    def handshake(self: typing.Self, conn: ClientConnection) -> None:
+        """Completes the TLS handshake of a connection on its blocking socket in a worker, its deadline runs since accept"""
+        try:
+            conn.sock.do_handshake()
+        except OSError:
+            self.metrics.tls_handshakes.inc(("failed",))
+            raise
+
+        conn.handshaking = False
+        conn.protocol = self.handshake_done(conn.sock)
+
+    def handshake_done(self: typing.Self, ssl_object: ssl.SSLSocket | ssl.SSLObject) -> str | None:
+        """Records a completed TLS handshake, returns the application protocol chosen with ALPN"""
+        self.metrics.tls_handshakes.inc(("resumed" if ssl_object.session_reused else "full",))
+
+        return ssl_object.selected_alpn_protocol()
+    
+    def new_reader(self: typing.Self) -> RequestReader:
+        return RequestReader(self.max_head_size, self.max_header_count)
+
+    def new_h2_connection(self: typing.Self) -> H2Connection:
+        return H2Connection(self.max_concurrent_streams, self.max_head_size, self.max_body_size, self.spool_threshold)
+
+    def prior_knowledge(self: typing.Self, request_head: bytes, served: int) -> H2Connection | None:
+        """HTTP/2 state of a connection whose client started it with the HTTP/2 preface instead of a request"""
+        if not self.http2 or served != 0 or request_head != PREFACE_HEAD:
+            return None
+
+        h2 = self.new_h2_connection()
+        # The reader took the preface up to its first empty line as a head
+        h2.receive(PREFACE[:len(PREFACE_HEAD) + 2])
+
+        return h2
+
+    def h2c_upgrade(self: typing.Self, http_request: HTTPRequest, timing: RequestTiming) -> H2Connection | None:
+        """
+        HTTP/2 state of a connection whose request asks to upgrade to `h2c`, the request becomes its
+        stream 1 (RFC 7540 3.2). Only cleartext connections are upgraded, TLS ones negotiate with ALPN.
+
+        Raises `HTTPError` for a malformed `HTTP2-Settings` header.
+        """
+        if not self.http2 or self.ssl_context is not None or http_request.version != (1, 1):
+            return None
+
+        upgrade = {token.strip().lower() for token in (http_request.headers["Upgrade"] or "").split(",")}
+        options = {option.strip().lower() for option in (http_request.headers["Connection"] or "").split(",")}
+        if "h2c" not in upgrade or not {"upgrade", "http2-settings"} <= options or len(settings:=http_request.headers.get_all("HTTP2-Settings")) != 1:
+            return None
+
+        try:
+            payload = base64.urlsafe_b64decode(settings[0] + "=" * (-len(settings[0]) % 4))
+        except (ValueError, binascii.Error):
+            raise http_constants.HTTPError("Malformed HTTP2-Settings header!") from None
+
+        h2 = self.new_h2_connection()
+        h2.upgrade(payload, http_request, timing)
+        timing.received += http_request.body.length
+
+        return h2
+
+    def answer_h2_stream(self: typing.Self, h2: H2Connection, stream: H2Stream, served: int) -> None:
+        """Generates the response of a complete HTTP/2 request and queues it on its stream"""
+        stream.served = served
+        try:
+            http_response = self.process_request(stream.request, served)
+        except Exception as e:
+            print(f"[ERROR]: {stream.request.method} {stream.request.target} {e!r}")
+            h2.reset_stream(stream.id, ErrorCode.INTERNAL_ERROR)
+            return
+        finally:
+            stream.request.body.close()
+
+        stream.timing.handler = time.perf_counter()
+        h2.send_response(stream.id, http_response)
+
+    def observe_h2(self: typing.Self, h2: H2Connection, addr: tuple[str, int]) -> None:
+        """Records the streams whose response was sent completely"""
+        for stream in h2.take_finished():
+            if stream.error is not None:
+                print(f"[ERROR]: {addr[0]}:{addr[1]} {stream.error}")
+                self.metrics.errors.inc((stream.error.status.value,))
+            elif stream.response is not None:
+                self.observe_request(stream.request, stream.response, stream.timing, stream.served)
+
+    def send_goaway(self: typing.Self, sock: socket.socket, h2: H2Connection) -> None:
+        """Tells the client of an idle HTTP/2 connection that it is being closed, so it doesn't start a request on it"""
+        h2.goaway()
+        try:
+            sock.send(h2.data_to_send())
+        except OSError:
+            pass
+
+        h2.close()
+    
+    def run_worker(self: typing.Self, sock: socket.socket) -> None:
+        with self.stats_lock:
+            self.queued -= 1
+            self.active += 1
+
+        try:
+            self.handle_request(sock)
+        finally:
+            with self.stats_lock:
+                self.active -= 1
+    
+    def error_response(self: typing.Self, status: HTTPStatus, headers: dict[str, str | int] | None = None) -> bytes:
+        """Encoded bodyless response that also closes the connection"""
+        http_response = HTTPResponse(gzip=False)
+        http_response.status = status
+        for header_name, header_value in (headers or {}).items():
+            http_response.headers[header_name] = header_value
+        http_response.headers["Content-Length"] = 0
+        http_response.headers["Connection"] = "close"
+        http_response.construct_head(HTTPRequest(), None)
+
+        return http_response.encode_head()
+    
+    def reject(self: typing.Self, sock: socket.socket, status: HTTPStatus = HTTPStatus.SERVICE_UNAVAILABLE) -> None:
+        """
+        Sheds load by answering with `503 Service Unavailable` right away and closing the connection,
+        `429 Too Many Requests` for a client over `max_connections_per_ip`.
+        """
+        try:
+            sock.send(self.error_response(status, {"Retry-After": self.retry_after}))
+            sock.shutdown(socket.SHUT_WR)
+
+            # Discard the unread request, closing with pending input would reset the connection before the 503 arrives
+            sock.setblocking(False)
+            while sock.recv(4096):
+                pass
+        except (OSError, ValueError):
+            pass
+        finally:
+            sock.close()
+
+        with self.stats_lock:
+            self.rejected += 1
+    
+    def connection_count(self: typing.Self) -> int:
+        return len(self.client_connections)
+    
+    def pool_stats(self: typing.Self) -> dict[str, int | float]:
+        """Snapshot of the worker pool and admission counters, useful for sizing `max_workers` and `max_queue`"""
+        with self.stats_lock:
+            return {
+                "max_workers": self.max_workers,
+                "active": self.active,
+                "queue_depth": self.queued,
+                "utilisation": self.active / self.max_workers,
+                "connections": len(self.clients) + len(self.currently_handling),
+                "rejected": self.rejected,
+            }
+    
+    def read_head(self: typing.Self, sock: socket.socket, reader: RequestReader) -> bytes:
+        while (head:=reader.next_head()) is None:
+            if reader.recv_into(sock) == 0:
+                if len(reader) == 0:
+                    return bytes()
+
+                peername = sock.getpeername()
+                raise http_constants.HTTPError(f"Incomplete head recived from {peername[0]}:{peername[1]}!")
+        
+        return head
         
     def handle_request(self: typing.Self, sock: socket.socket) -> None:
         sock_peername: tuple[str, int] = sock.getpeername()
-        del self.clients[sock_peername]
+        conn = self.client_connections[sock_peername]
+        reader = conn.reader
 
-        request_head: bytes = self.read_head(sock)
+        keep_alive = True
+        # Once part of a response is out, an error can only close the connection
+        responding = False
+        sock.setblocking(True)
+        try:
+            if conn.handshaking:
+                self.handshake(conn)
+                self.arm(conn, Phase.HEAD)
 
-        if len(request_head) == 0:
-            self.currently_handling.remove(sock_peername)
-            return sock.close()
+                if conn.protocol == "h2":
+                    conn.h2 = self.new_h2_connection()
+                elif sock.pending() != 0:
+                    # The first request may have come with the end of the handshake, already read by OpenSSL
+                    reader.recv_into(sock)
 
-        http_request = HTTPRequest()
-        http_request.parse_request_head(request_head.decode())
+            if conn.h2 is not None:
+                keep_alive = self.serve_h2(conn)
 
-        if (body_len:=http_request.headers["Content-Length"]) is not None:
-            request_body: bytes = sock.recv(body_len)
+            # Pipelined requests already in the buffer won't make the socket readable again, a partial
+            # head goes back to the select loop
+            while keep_alive and conn.h2 is None and reader.head_ready():
+                request_head: bytes = self.read_head(sock, reader)
 
-            if (request_body_len:=len(request_body)) < body_len:
-                raise http_constants.HTTPError(f"Request body length ({request_body_len} byte(s)) doesn't match the header information ({body_len} byte(s))!")
+                if len(request_head) == 0:
+                    keep_alive = False
+                    break
 
-            http_request.parse_request_body(request_body.decode())
+                if (h2:=self.prior_knowledge(request_head, conn.served)) is not None:
+                    conn.h2 = h2
+                    keep_alive = self.serve_h2(conn, reader.read(len(reader)))
+                    break
 
-        http_response = self.handler.generate_response(http_request, "gzip" in http_request.headers["Accept-Encoding"])
-        print(f"[INFO]: {http_request.method} {http_request.target} {http_response.status}")
+                http_request = HTTPRequest()
+                http_request.parse_request_head(request_head)
+                timing = self.new_timing(conn, request_head)
+
+                if (body_decoder:=self.new_body_decoder(http_request)) is not None:
+                    self.read_body(conn, http_request, body_decoder)
+
+                # The handler takes as long as it takes
+                self.deadlines.cancel(conn)
+
+                if (h2:=self.h2c_upgrade(http_request, timing)) is not None:
+                    sock.sendall(SWITCHING_PROTOCOLS)
+                    conn.h2 = h2
+                    conn.served += 1
+                    self.answer_h2_stream(h2, h2.streams[1], conn.served)
+                    keep_alive = self.serve_h2(conn, reader.read(len(reader)))
+                    break
+
+                conn.served += 1
+                http_response = self.process_request(http_request, conn.served)
+                timing.handler = time.perf_counter()
+
+                responding = True
+                timing.sent = self.send_response(conn, http_response)
+                responding = False
+                http_request.body.close()
+
+                timing.received += http_request.body.length
+                self.observe_request(http_request, http_response, timing, conn.served)
 
-        sock.sendall(http_response.encode_head())
-        sock.sendall(http_response.encode_body())
+                keep_alive = http_response.keep_alive
+        except http_constants.HTTPError as e:
+            print(f"[ERROR]: {sock_peername[0]}:{sock_peername[1]} {e}")
+            self.metrics.errors.inc((e.status.value,))
+            keep_alive = False
 
-        if (conn:=getattr(http_request.headers, "Connection", None) is not None) and conn.lower() == "keep-alive":
+            try:
+                sock.sendall(self.error_response(e.status))
+            except OSError:
+                pass
+        except OSError:
+            keep_alive = False
+        except Exception as e:
+            # A failing handler must not leave the connection marked as handled forever
+            print(f"[ERROR]: {sock_peername[0]}:{sock_peername[1]} {e!r}")
+            keep_alive = False
+
+            if conn.h2 is None and not responding:
+                self.metrics.errors.inc((HTTPStatus.INTERNAL_SERVER_ERROR.value,))
+
+                try:
+                    sock.sendall(self.error_response(HTTPStatus.INTERNAL_SERVER_ERROR))
+                except OSError:
+                    pass
+
+        if keep_alive:
+            self.arm(conn, Phase.HEAD if len(reader) != 0 or conn.served == 0 else Phase.IDLE)
+            sock.setblocking(False)
             self.clients[sock_peername] = sock
         else:
-            sock.close()
+            self.close_client(conn)
 
         self.currently_handling.remove(sock_peername)
-        
+
+    def serve_h2(self: typing.Self, conn: ClientConnection, data: bytes | None = None) -> bool:
+        """
+        Serves an HTTP/2 connection on its blocking socket until no request is in flight, `data` are bytes
+        already received. Returns whether the connection stays open, it goes back to the select loop then.
+
+        The streams are answered one after the other as their requests complete, while their responses are
+        sent interleaved within the flow control windows.
+        """
+        h2, sock = typing.cast(H2Connection, conn.h2), conn.sock
+        received = data is not None
+
+        if data is not None:
+            self.answer_h2_streams(conn, h2.receive(data))
+
+        while True:
+            if len(data:=h2.data_to_send()) != 0:
+                self.arm(conn, Phase.WRITE)
+                self.send_all(conn, data)
+                self.deadlines.cancel(conn)
+
+                self.observe_h2(h2, conn.addr)
+                continue
+
+            if h2.done:
+                if h2.error is not None:
+                    print(f"[ERROR]: {conn.addr[0]}:{conn.addr[1]} {h2.error}")
+                return False
+
+            # TLS may hold already decrypted records that select won't report
+            if received and h2.idle and not (isinstance(sock, ssl.SSLSocket) and sock.pending()):
+                return True
+
+            # Blocks for the preface, the rest of a request in flight or the window update a response waits for
+            self.arm(conn, Phase.BODY if received else Phase.HEAD)
+            data = sock.recv(65536)
+            self.deadlines.cancel(conn)
+
+            if len(data) == 0:
+                return False
+
+            received = True
+            self.answer_h2_streams(conn, h2.receive(data))
+
+    def answer_h2_streams(self: typing.Self, conn: ClientConnection, streams: list[H2Stream]) -> None:
+        for stream in streams:
+            conn.served += 1
+            self.answer_h2_stream(typing.cast(H2Connection, conn.h2), stream, conn.served)
+    
+    def new_timing(self: typing.Self, conn: ClientConnection, request_head: bytes) -> RequestTiming:
+        """Timing of a request whose head was just parsed"""
+        # The first request of a connection starts at accept, the next ones when their first byte arrived
+        start = conn.accepted_at if conn.served == 0 else conn.reader.received_at
+
+        return RequestTiming(start, time.perf_counter(), received=len(request_head))
+
+    def observe_request(self: typing.Self, http_request: HTTPRequest, http_response: HTTPResponse, timing: RequestTiming, served: int) -> None:
+        """Records a request in the metrics once its last byte was sent"""
+        self.metrics.observe_request(http_request.method.value, http_response.status.value, timing, served, time.perf_counter())
+
+    def new_body_decoder(self: typing.Self, http_request: HTTPRequest) -> BodyDecoder | None:
+        """
+        Decoder of the body announced by the head of `http_request`, `None` if it has none.
+
+        Raises `HTTPError` for a framing the server can't or won't handle and for unknown expectations.
+        """
+        if (expect:=http_request.headers["Expect"]) is not None and expect.lower() != "100-continue":
+            raise http_constants.HTTPError(f"Unknown expectation {expect!r}!", status=HTTPStatus.EXPECTATION_FAILED)
+
+        transfer_encoding = http_request.headers["Transfer-Encoding"]
+        content_length = http_request.headers["Content-Length"]
+
+        if transfer_encoding is not None:
+            # Both framings at once is how requests get smuggled past proxies
+            if content_length is not None:
+                raise http_constants.HTTPError("Request has both Transfer-Encoding and Content-Length!")
+            if [coding.strip().lower() for coding in transfer_encoding.split(",")] != ["chunked"]:
+                raise http_constants.HTTPError(f"Unsupported transfer coding {transfer_encoding!r}!", status=HTTPStatus.NOT_IMPLEMENTED)
+
+            length = None
+        elif content_length is not None:
+            if not (content_length.isascii() and content_length.isdigit()):
+                raise http_constants.HTTPError(f"Invalid Content-Length {content_length!r}!")
+            if (length:=int(content_length)) == 0:
+                return None
+        else:
+            return None
+
+        return BodyDecoder(length, self.max_body_size, self.spool_threshold)
+
+    def expects_continue(self: typing.Self, http_request: HTTPRequest, reader: RequestReader) -> bool:
+        """Whether the client waits for a `100 Continue` before sending the body, which it didn't start yet"""
+        return http_request.version >= (1, 1) and (http_request.headers["Expect"] or "").lower() == "100-continue" and len(reader) == 0
+
+    def read_body(self: typing.Self, conn: ClientConnection, http_request: HTTPRequest, body_decoder: BodyDecoder) -> None:
+        """Decodes the body of `http_request` from the blocking socket of `conn`, spooling it as it arrives"""
+        sock, reader = conn.sock, conn.reader
+
+        if self.expects_continue(http_request, reader):
+            sock.sendall(CONTINUE_RESPONSE)
+
+        self.arm(conn, Phase.BODY)
+        while not body_decoder.feed(reader):
+            if (received:=reader.recv_into(sock)) == 0:
+                if conn.expired is None:
+                    raise http_constants.HTTPError("Incomplete request body recived!")
+                if isinstance(sock, ssl.SSLSocket):
+                    # Shut down both ways, reported when that happened
+                    raise ConnectionAbortedError(self.timeout_message(conn.expired))
+
+                raise http_constants.HTTPError(self.timeout_message(conn.expired), status=HTTPStatus.REQUEST_TIMEOUT)
+
+            self.deadlines.progress(conn, received)
+
+        http_request.body = body_decoder.body
+
+    def send_response(self: typing.Self, conn: ClientConnection, http_response: HTTPResponse) -> int:
+        """Sends the whole response on the blocking socket of `conn`, returns the number of bytes sent"""
+        if (body_stream:=http_response.body_stream) is not None:
+            self.arm(conn, Phase.WRITE)
+            self.send_all(conn, head:=http_response.encode_head())
+            sent = len(head)
+
+            for data in body_stream:
+                # Only the client's part counts, not the time the stream takes to produce the next piece
+                self.arm(conn, Phase.WRITE)
+                self.send_all(conn, data)
+                self.deadlines.cancel(conn)
+                sent += len(data)
+            return sent
+
+        self.arm(conn, Phase.WRITE)
+
+        if (body_file:=http_response.body_file) is None:
+            self.send_all(conn, data:=http_response.encode_head() + http_response.encode_body())
+            return len(data)
+
+        self.send_all(conn, head:=http_response.encode_head())
+
+        with body_file:
+            if isinstance(conn.sock, ssl.SSLSocket):
+                # sendfile can't encrypt, TLS gets the file in memory mapped chunks instead
+                for chunk in body_file.chunks():
+                    self.send_all(conn, chunk)
+            else:
+                self.send_file(conn, body_file)
+
+        return len(head) + body_file.length
+
+    def send_all(self: typing.Self, conn: ClientConnection, data: bytes | memoryview) -> None:
+        """`sendall` pushing back the write deadline of `conn` as the client takes the data"""
+        view = memoryview(data)
+
+        while len(view) != 0:
+            sent = conn.sock.send(view)
+            self.deadlines.progress(conn, sent)
+            view = view[sent:]
+
+    def send_file(self: typing.Self, conn: ClientConnection, body_file: FileBody) -> None:
+        offset, remaining = body_file.offset, body_file.length
+
+        while remaining > 0:
+            if (sent:=os.sendfile(conn.sock.fileno(), body_file.file.fileno(), offset, min(remaining, SENDFILE_CHUNK_SIZE))) == 0:
+                raise ConnectionError("File truncated while sending it")
+
+            self.deadlines.progress(conn, sent)
+            offset += sent
+            remaining -= sent
+    
+    def process_request(self: typing.Self, http_request: HTTPRequest, served: int = 1) -> HTTPResponse:
+        """
+        Generates the response for an already parsed request, shared by every server engine.
+
+        `served` is the number of requests received on the connection so far, this one included.
+        """
+        if self.is_metrics_request(http_request):
+            http_response = self.metrics_response(http_request)
+        else:
+            http_response = self.handler.generate_response(http_request)
+
+        return self.finish_response(http_request, http_response, served)
+    
+    def is_metrics_request(self: typing.Self, http_request: HTTPRequest) -> bool:
+        return self.metrics_path is not None and http_request.target == self.metrics_path
+
+    def metrics_response(self: typing.Self, http_request: HTTPRequest) -> HTTPResponse:
+        """Response of the metrics endpoint, the metrics of this process in the Prometheus text format"""
+        http_response = HTTPResponse(gzip=False)
+        http_response.body = bytes()
+
+        if http_request.method not in (HTTPMethod.GET, HTTPMethod.HEAD):
+            http_response.status = HTTPStatus.METHOD_NOT_ALLOWED
+            http_response.headers["Allow"] = "GET, HEAD"
+            http_response.headers["Content-Length"] = 0
+        else:
+            body = self.metrics.render().encode()
+
+            http_response.status = HTTPStatus.OK
+            http_response.headers["Content-Type"] = METRICS_CONTENT_TYPE
+            http_response.headers["Cache-Control"] = "no-store"
+            http_response.headers["Content-Length"] = len(body)
+
+            if http_request.method is HTTPMethod.GET:
+                http_response.body = body
+
+        http_response.construct_head(http_request, None)
+
+        return http_response
+    
+    def finish_response(self: typing.Self, http_request: HTTPRequest, http_response: HTTPResponse, served: int) -> HTTPResponse:
+        # Without chunking a streamed body ends when the connection does
+        delimited = http_response.body_stream is None or http_response.body_stream.chunked
+        http_response.keep_alive = delimited and self.keep_alive(http_request, served)
+
+        if http_request.version >= (2, 0):
+            # Streams end on their own and the connection outlives them, its headers don't apply
+            http_response.keep_alive = True
+        elif http_response.keep_alive:
+            http_response.add_header("Connection", "keep-alive")
+            http_response.add_header("Keep-Alive", f"timeout={int(self.keep_alive_timeout)}, max={self.keep_alive_max - served}")
+        else:
+            http_response.add_header("Connection", "close")
+
+        if self.access_log:
+            self.log_request(http_request, http_response)
+
+        return http_response
+    
+    def log_request(self: typing.Self, http_request: HTTPRequest, http_response: HTTPResponse) -> None:
+        print(f"[INFO]: {http_request.method} {http_request.target} {http_response.status}")
+    
+    def keep_alive(self: typing.Self, http_request: HTTPRequest, served: int) -> bool:
+        """
+        Whether the connection should be kept open after responding to `http_request`.
+
+        HTTP/1.1 connections are persistent unless the client asks to close them, HTTP/1.0 ones
+        only if the client asks to keep them alive. No connection serves more than `keep_alive_max` requests.
+        """
+        if served >= self.keep_alive_max or self.draining:
+            return False
+
+        options = {option.strip().lower() for option in (http_request.headers["Connection"] or "").split(",")}
+        if "close" in options:
+            return False
+
+        return http_request.version >= (1, 1) or "keep-alive" in options
     
     def version_to_tuple(self: typing.Self) -> tuple[int, int]:
         return tuple(map(int, self.version.split('/')[1].split('.')))
     
+    def shutdown(self: typing.Self, timeout: float) -> None:
+        """
+        Stops the server gracefully, from another thread than the one serving: it stops accepting, lets the
+        requests in flight finish and closes every connection once it is idle, then closes when no connection
+        is left or after `timeout` seconds.
+        """
+        self.draining = True
+
+        deadline = time.monotonic() + timeout
+        while self.connection_count() != 0 and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        self.close()
+
     def close(self: typing.Self) -> None:
         self.running = False            
         self.sock.close()
 
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
     def __enter__(self: typing.Self) -> typing.Self:
         return self
     
@@ -149,22 +964,49 @@ class HTTPServer:
 
 
 class HTTPSServer(HTTPServer):
+    """
+    HTTPS server on any engine.
+
+    Connections are accepted in the clear and their TLS handshakes are driven by the engine (a worker
+    thread, the reactor loop or asyncio), so a slow or silent client never holds up accepting the others.
+    The certificate files are checked every `cert_check_interval` seconds and reloaded into the same
+    context when they change, which keeps its session cache and ticket keys: clients that connected
+    before the reload still resume their sessions with an abbreviated handshake.
+    """
     certfile: str | bytes | pathlib.Path
     keyfile: str | bytes | pathlib.Path
+    ssl_context: ssl.SSLContext
+
+    cert_check_interval: float | None
+    cert_checked_at: float
+    cert_stamps: tuple[tuple[int, int], ...] | None
+    """Modification time and inode of the certificate and key files last loaded"""
 
     def __init__(self: typing.Self,
                  version: str = "HTTP/1.1",
                  addr: tuple[str, int] = ("localhost", 443),
-                 handler: HTTPHandler | None = None) -> None:
-        super().__init__(version, addr, handler)
-        self.ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+                 handler: HTTPHandler | None = None,
+                 *,
+                 tls_preset: str = "intermediate",
+                 alpn_protocols: typing.Sequence[str] | None = None,
+                 session_tickets: int = 2,
+                 stateless_tickets: bool = True,
+                 cert_check_interval: float | None = 5.0,
+                 **kwargs) -> None:
+        super().__init__(version, addr, handler, **kwargs)
+
+        if alpn_protocols is None:
+            alpn_protocols = ("h2", "http/1.1") if self.http2 else ("http/1.1",)
+        self.ssl_context = new_context(tls_preset, alpn_protocols, session_tickets, stateless_tickets)
 
         self.ssl_context.load_default_certs(ssl.Purpose.CLIENT_AUTH)
 
         self.certfile = "server.crt"
         self.keyfile  = "server.key"
 
-        self.sock = self.ssl_context.wrap_socket(self.sock, server_side=True)
+        self.cert_check_interval = cert_check_interval
+        self.cert_checked_at = time.monotonic()
+        self.cert_stamps = None
     
     def set_cert(self: typing.Self, certfile: str | bytes | pathlib.Path | None = None,
                  keyfile: str | bytes | pathlib.Path | None = None) -> None:
@@ -175,7 +1017,61 @@ class HTTPSServer(HTTPServer):
             self.keyfile = keyfile
 
     def load_cert(self: typing.Self):
+        self.cert_stamps = self.stat_cert()
         self.ssl_context.load_cert_chain(self.certfile, self.keyfile)
+
+    def stat_cert(self: typing.Self) -> tuple[tuple[int, int], ...]:
+        return tuple((stat.st_mtime_ns, stat.st_ino) for stat in map(os.stat, (self.certfile, self.keyfile)))
+
+    def reload_cert(self: typing.Self) -> bool:
+        """Loads the certificate files again, new handshakes use them while open connections keep the old certificate"""
+        try:
+            # A key not matching the certificate would leave the live context with the new certificate and the old key
+            ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER).load_cert_chain(self.certfile, self.keyfile)
+            self.load_cert()
+        except OSError as e:
+            print(f"[ERROR]: Keeping the current certificate, {self.certfile!s} can't be loaded: {e}")
+            return False
+
+        print(f"[INFO]: Reloaded certificate {self.certfile!s}")
+        return True
+
+    def check_cert(self: typing.Self, now: float) -> None:
+        """Reloads the certificate if its files changed since they were loaded, at most every `cert_check_interval` seconds"""
+        if self.cert_check_interval is None or now - self.cert_checked_at < self.cert_check_interval:
+            return
+
+        self.cert_checked_at = now
+        try:
+            stamps = self.stat_cert()
+        except OSError:
+            # Half way through being replaced, the next check will see both files
+            return
+
+        if stamps != self.cert_stamps:
+            # Remembered even if loading fails, so a broken pair is reported once and not every check
+            self.cert_stamps = stamps
+            self.reload_cert()
+
+    @typing.override
+    def reap(self: typing.Self, now: float) -> None:
+        self.check_cert(now)
+        super().reap(now)
+
+    @typing.override
+    def wrap_client(self: typing.Self, sock: socket.socket) -> socket.socket:
+        return self.ssl_context.wrap_socket(sock, server_side=True, do_handshake_on_connect=False)
+
+    @typing.override
+    def reject(self: typing.Self, sock: socket.socket, status: HTTPStatus = HTTPStatus.SERVICE_UNAVAILABLE) -> None:
+        if isinstance(sock, ssl.SSLSocket):
+            return super().reject(sock, status)
+
+        # Rejected before the handshake, a TLS client couldn't read a plaintext 503 and the handshake is the expensive part
+        sock.close()
+
+        with self.stats_lock:
+            self.rejected += 1
     
     @typing.override
     def serv(self: typing.Self) -> typing.NoReturn:
@@ -183,19 +1079,83 @@ class HTTPSServer(HTTPServer):
 
         super().serv()
 
+def client_hello_received(sock: socket.socket) -> bool:
+    """Whether the first TLS record of a client, its ClientHello, arrived completely or the client is gone, peeked at below the TLS layer"""
+    try:
+        if len(header:=socket.socket.recv(sock, 5, socket.MSG_PEEK)) < 5:
+            return len(header) == 0
+
+        size = 5 + int.from_bytes(header[3:5])
+        return len(socket.socket.recv(sock, size, socket.MSG_PEEK)) == size
+    except (BlockingIOError, InterruptedError):
+        return False
+    except OSError:
+        return True
+
+ENGINES: typing.Final[tuple[str, ...]] = ("thread", "reactor", "asyncio")
+
+def get_engine(name: str) -> tuple[type[HTTPServer], type[HTTPSServer]]:
+    """Returns the HTTP and HTTPS server classes of the server engine called `name`"""
+    match name:
+        case "thread":
+            return HTTPServer, HTTPSServer
+        case "reactor":
+            from http_reactor import HTTPReactorServer, HTTPSReactorServer
+            return HTTPReactorServer, HTTPSReactorServer
+        case "asyncio":
+            from http_async import AsyncHTTPServer, AsyncHTTPSServer
+            return AsyncHTTPServer, AsyncHTTPSServer
+    
+    raise ValueError(f"Unknown server engine: {name}")
+
 def main() -> None:
-    addr = "192.168.1.110"
-    if len(sys.argv) > 1:
-        http_port = int(sys.argv[1])
-        if len(sys.argv) > 2:
-            https_port = int(sys.argv[2])
-        else:
-            https_port = 443
-    else:
-        http_port = 80
-        https_port = 443
+    if len(sys.argv) > 1 and sys.argv[1] == "compress":
+        from http_compression import compress_command
+        return compress_command(sys.argv[2:])
+
+    parser = argparse.ArgumentParser(description="HTTP/HTTPS server", epilog="Run `%(prog)s compress --help` for writing precompressed sidecars.")
+    parser.add_argument("http_port", nargs="?", type=int, default=80)
+    parser.add_argument("https_port", nargs="?", type=int, default=443)
+    parser.add_argument("--addr", default="192.168.1.110")
+    parser.add_argument("--engine", choices=ENGINES, default="thread")
+    parser.add_argument("--workers", type=int, default=None, help="size of the worker thread pool")
+    parser.add_argument("--max-connections", type=int, default=1000, help="connections above this are answered with 503")
+    parser.add_argument("--max-queue", type=int, default=128, help="requests waiting for a worker above this are answered with 503")
+    parser.add_argument("--processes", type=int, default=1, help="run the HTTP server in this many pre-forked worker processes")
+    parser.add_argument("--keep-alive-timeout", type=float, default=5.0, help="seconds an idle persistent connection is kept open")
+    parser.add_argument("--keep-alive-max", type=int, default=100, help="requests served on a persistent connection before closing it")
+    parser.add_argument("--max-body-size", type=int, default=1024 * 1024 * 1024, help="larger request bodies are answered with 413")
+    parser.add_argument("--spool-threshold", type=int, default=1024 * 1024, help="larger request bodies are spooled to a temporary file")
+    parser.add_argument("--metrics-path", default=None, help="serve the metrics in the Prometheus text format at this target, e.g. /metrics")
+    parser.add_argument("--no-access-log", dest="access_log", action="store_false", help="don't print a line for every request")
+    parser.add_argument("--no-http2", dest="http2", action="store_false", help="serve HTTP/1.1 only, without ALPN h2, prior knowledge or h2c upgrades")
+    parser.add_argument("--max-concurrent-streams", type=int, default=100, help="requests in flight on an HTTP/2 connection, more are refused")
+    parser.add_argument("--header-timeout", type=float, default=10.0, help="seconds a client has to send a complete request head")
+    parser.add_argument("--body-timeout", type=float, default=30.0, help="seconds a request body may stall")
+    parser.add_argument("--write-timeout", type=float, default=30.0, help="seconds a response may stall because the client doesn't read it")
+    parser.add_argument("--min-transfer-rate", type=int, default=1024, help="bytes per second request bodies and responses have to average once their timeout passed, 0 for no minimum")
+    parser.add_argument("--max-connections-per-ip", type=int, default=100, help="connections of a single client address above this are answered with 429")
+    parser.add_argument("--tls-preset", choices=TLS_PRESETS, default="intermediate", help="protocol versions, cipher suites and key exchange of the HTTPS server")
+    args = parser.parse_args()
+
+    http_server_cls, https_server_cls = get_engine(args.engine)
+    limits = {
+        "max_workers": args.workers, "max_connections": args.max_connections, "max_queue": args.max_queue,
+        "keep_alive_timeout": args.keep_alive_timeout, "keep_alive_max": args.keep_alive_max,
+        "max_body_size": args.max_body_size, "spool_threshold": args.spool_threshold,
+        "metrics_path": args.metrics_path, "access_log": args.access_log,
+        "http2": args.http2, "max_concurrent_streams": args.max_concurrent_streams,
+        "header_timeout": args.header_timeout, "body_timeout": args.body_timeout, "write_timeout": args.write_timeout,
+        "min_transfer_rate": args.min_transfer_rate, "max_connections_per_ip": args.max_connections_per_ip,
+    }
+
+    if args.processes > 1:
+        from http_prefork import PreforkServer
+
+        server_factory = functools.partial(http_server_cls, addr=(args.addr, args.http_port), reuse_port=True, **limits)
+        return PreforkServer(server_factory, args.processes).serv()
     
-    with HTTPServer(addr=(addr, http_port)) as http_server, HTTPSServer(addr=(addr, https_port)) as https_server:
+    with http_server_cls(addr=(args.addr, args.http_port), **limits) as http_server, https_server_cls(addr=(args.addr, args.https_port), tls_preset=args.tls_preset, **limits) as https_server:
         http = threading.Thread(target=http_server.serv)
         https = threading.Thread(target=https_server.serv)
 
@@ -0,0 +1,69 @@
+"""
+TLS
+
+Server contexts built from presets: protocol versions, TLS 1.2 cipher suites and key exchange groups
+ordered for handshake and bulk encryption speed, session resumption and ALPN.
+"""
+from __future__ import annotations
+
+import dataclasses
+import ssl
+import typing
+
+@dataclasses.dataclass(frozen=True)
+class TLSPreset:
+    minimum_version: ssl.TLSVersion
+    ciphers: str | None
+    """TLS 1.2 cipher suites in order of preference, `None` keeps OpenSSL's. TLS 1.3 ones can't be chosen from Python"""
+    curve: str | None
+    """Only key exchange group offered, `None` keeps OpenSSL's list (X25519 first, then P-256)"""
+
+FAST_CIPHERS: typing.Final[str] = ":".join((
+    # AES-GCM runs on AES-NI and 128 bit keys need fewer rounds, ChaCha20 is for clients without AES hardware
+    "ECDHE-ECDSA-AES128-GCM-SHA256", "ECDHE-RSA-AES128-GCM-SHA256",
+    "ECDHE-ECDSA-CHACHA20-POLY1305", "ECDHE-RSA-CHACHA20-POLY1305",
+    "ECDHE-ECDSA-AES256-GCM-SHA384", "ECDHE-RSA-AES256-GCM-SHA384",
+))
+
+TLS_PRESETS: typing.Final[dict[str, TLSPreset]] = {
+    # Cheapest key exchange, refuses the few clients without X25519
+    "fast": TLSPreset(ssl.TLSVersion.TLSv1_2, FAST_CIPHERS, "X25519"),
+    "modern": TLSPreset(ssl.TLSVersion.TLSv1_3, None, None),
+    "intermediate": TLSPreset(ssl.TLSVersion.TLSv1_2, FAST_CIPHERS, None),
+    "compatible": TLSPreset(ssl.TLSVersion.TLSv1_2, None, None),
+}
+
+def new_context(preset: str = "intermediate",
+                alpn_protocols: typing.Sequence[str] = ("http/1.1",),
+                session_tickets: int = 2,
+                stateless_tickets: bool = True) -> ssl.SSLContext:
+    """
+    Server context without a certificate yet.
+
+    `session_tickets` is the number of TLS 1.3 tickets sent after a full handshake, one per connection
+    the client may resume in parallel, 0 turns resumption off for TLS 1.3. With `stateless_tickets`
+    the session state travels encrypted in the ticket, otherwise it stays in the context's session cache
+    and the ticket only names it, which stops resumption across processes that don't share the context.
+    """
+    try:
+        tls_preset = TLS_PRESETS[preset]
+    except KeyError:
+        raise ValueError(f"Unknown TLS preset {preset!r}!") from None
+
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = tls_preset.minimum_version
+    if tls_preset.ciphers is not None:
+        context.set_ciphers(tls_preset.ciphers)
+    if tls_preset.curve is not None:
+        context.set_ecdh_curve(tls_preset.curve)
+
+    # Renegotiation lets a client make the server redo the expensive part of a handshake at will
+    context.options |= ssl.OP_NO_RENEGOTIATION
+    if not stateless_tickets:
+        context.options |= ssl.OP_NO_TICKET
+    context.num_tickets = session_tickets
+
+    if len(alpn_protocols) != 0:
+        context.set_alpn_protocols(list(alpn_protocols))
+
+    return context